@@ -0,0 +1,123 @@
+"""gzip and brotli response compression.
+
+``negotiate`` picks an encoding from an ``Accept-Encoding`` header, brotli
+first when the ``brotli`` package is installed. Handlers that cache their
+responses (the menu) compress once with ``compress(..., best=True)`` and
+keep the result; ``CompressionMiddleware`` compresses everything else per
+request at a faster level, leaving alone responses that are already
+encoded, small, images, or server-sent events.
+"""
+import gzip
+import zlib
+from typing import Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+ENCODINGS = ("br", "gzip") if brotli else ("gzip",)
+# Event streams must reach the browser as they are written, and images are
+# already compressed.
+UNCOMPRESSED_TYPES = ("text/event-stream", "image/")
+
+def negotiate(accept_encoding: Optional[str]) -> Optional[str]:
+    """The preferred encoding ``accept_encoding`` allows, or None for identity."""
+    if not accept_encoding:
+        return None
+    weights = {}
+    for part in accept_encoding.split(","):
+        coding, _, params = part.strip().partition(";")
+        weight = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                weight = float(params[2:])
+            except ValueError:
+                weight = 0.0
+        weights[coding.strip().lower()] = weight
+    for encoding in ENCODINGS:
+        if weights.get(encoding, weights.get("*", 0.0)) > 0:
+            return encoding
+    return None
+
+def compress(body: bytes, encoding: str, best: bool = False) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=11 if best else 4)
+    return gzip.compress(body, compresslevel=9 if best else 6, mtime=0)
+
+class StreamCompressor:
+    """Compresses a streamed body chunk by chunk, flushing after each one."""
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "br":
+            self._compressor = brotli.Compressor(quality=4)
+        else:
+            self._compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def chunk(self, data: bytes) -> bytes:
+        if self.encoding == "br":
+            return self._compressor.process(data) + self._compressor.flush()
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        if self.encoding == "br":
+            return self._compressor.finish()
+        return self._compressor.flush()
+
+class CompressionMiddleware:
+    """Pure ASGI middleware; streamed bodies are compressed as they go out."""
+
+    def __init__(self, app, minimum_size: int = 500):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        encoding = negotiate(Headers(scope=scope).get("accept-encoding")) if scope["type"] == "http" else None
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        start = None
+        compressor: Optional[StreamCompressor] = None
+        passthrough = False
+
+        async def send_compressed(message):
+            nonlocal start, compressor, passthrough
+            if message["type"] == "http.response.start":
+                start = message
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if compressor is not None:
+                data = compressor.chunk(body)
+                if not more_body:
+                    data += compressor.finish()
+                await send({**message, "body": data})
+                return
+            headers = MutableHeaders(raw=start["headers"])
+            if ("content-encoding" in headers
+                    or headers.get("content-type", "").startswith(UNCOMPRESSED_TYPES)
+                    or (not more_body and len(body) < self.minimum_size)):
+                passthrough = True
+                await send(start)
+                await send(message)
+                return
+            headers["Content-Encoding"] = encoding
+            headers.add_vary_header("Accept-Encoding")
+            if more_body:
+                del headers["Content-Length"]
+                compressor = StreamCompressor(encoding)
+                data = compressor.chunk(body)
+            else:
+                data = compress(body, encoding)
+                headers["Content-Length"] = str(len(data))
+            await send(start)
+            await send({**message, "body": data})
+
+        await self.app(scope, receive, send_compressed)
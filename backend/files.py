@@ -0,0 +1,18 @@
+"""Filesystem helpers shared by the image and profile stores."""
+import os
+import tempfile
+from pathlib import Path
+
+def write_atomic(path: Path, data: bytes):
+    """Write ``data`` to ``path`` through a temporary file in the same directory.
+
+    Readers see either the old file or the whole new one, never a partial write.
+    """
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as fh:
+            fh.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
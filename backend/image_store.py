@@ -0,0 +1,99 @@
+"""Content-addressed image store for menu pictures.
+
+An image is stored under the SHA-256 of its bytes, in
+``<root>/<hash[:2]>/<hash>/``: the original upload plus one WebP file per
+entry in ``VARIANTS``. Identical uploads therefore share one directory,
+and a stored variant never changes, so it can be served with immutable
+cache headers. Decoding and resizing run in a process pool so a large
+upload does not stall the event loop.
+"""
+import asyncio
+import hashlib
+import io
+import re
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Optional
+
+from PIL import Image, ImageOps
+
+from files import write_atomic
+
+# Variant name -> maximum width in pixels. Images narrower than that are
+# re-encoded at their own size rather than upscaled.
+VARIANTS = {"thumb": 240, "card": 800}
+HASH_RE = re.compile(r"^[0-9a-f]{64}$")
+
+class InvalidImage(ValueError):
+    pass
+
+def render_variants(data: bytes, directory: str, quality: int) -> Dict[str, int]:
+    """Decode ``data`` and write every WebP variant into ``directory``.
+
+    Runs in a worker process; returns the original width and height.
+    """
+    try:
+        with Image.open(io.BytesIO(data)) as source:
+            source.load()
+            image = ImageOps.exif_transpose(source)
+    except (OSError, SyntaxError, ValueError, Image.DecompressionBombError) as e:
+        raise InvalidImage("unsupported or corrupt image file") from e
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA" if "A" in image.getbands() or "transparency" in image.info else "RGB")
+    for name, max_width in VARIANTS.items():
+        variant = image
+        if image.width > max_width:
+            height = max(1, round(image.height * max_width / image.width))
+            variant = image.resize((max_width, height), Image.Resampling.LANCZOS)
+        buffer = io.BytesIO()
+        variant.save(buffer, "WEBP", quality=quality, method=4)
+        write_atomic(Path(directory) / f"{name}.webp", buffer.getvalue())
+    return {"width": image.width, "height": image.height}
+
+class ImageStore:
+    def __init__(self, root: Path, max_bytes: int, workers: int, quality: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.workers = workers
+        self.quality = quality
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def directory(self, image_hash: str) -> Path:
+        return self.root / image_hash[:2] / image_hash
+
+    def variant_path(self, image_hash: str, size: str) -> Optional[Path]:
+        if size not in VARIANTS or not HASH_RE.match(image_hash):
+            return None
+        path = self.directory(image_hash) / f"{size}.webp"
+        return path if path.is_file() else None
+
+    def exists(self, image_hash: str) -> bool:
+        return all(self.variant_path(image_hash, size) for size in VARIANTS)
+
+    async def save(self, data: bytes) -> str:
+        """Store ``data`` and its variants; return its hash. Raises InvalidImage."""
+        if not data:
+            raise InvalidImage("Empty image")
+        if len(data) > self.max_bytes:
+            raise InvalidImage(f"Image larger than {self.max_bytes} bytes")
+        image_hash = hashlib.sha256(data).hexdigest()
+        if self.exists(image_hash):
+            return image_hash
+        directory = self.directory(image_hash)
+        directory.mkdir(parents=True, exist_ok=True)
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(self._executor, render_variants, data, str(directory), self.quality)
+        except InvalidImage:
+            if not any(directory.iterdir()):
+                directory.rmdir()
+            raise
+        await asyncio.to_thread(write_atomic, directory / "original", data)
+        return image_hash
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,584 @@
+"""In-memory stand-in for the Motor database handle used by server.py.
+
+It implements the subset of the Motor collection API that the handlers call
+(filters with the common comparison operators, projections, sorts, updates,
+bulk writes, simple aggregation pipelines and unique indexes), so the
+benchmark suite can drive the app on a machine without MongoDB:
+
+    import server
+    from memory_db import MemoryDatabase
+    server.db = MemoryDatabase()
+
+It is not a general purpose Mongo emulator; anything outside that subset
+raises NotImplementedError rather than silently misbehaving.
+"""
+import asyncio
+import copy
+from typing import Any, Dict, List, Optional, Tuple
+
+from bson import ObjectId
+from pymongo import DeleteOne, InsertOne, ReplaceOne, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from pymongo.results import BulkWriteResult, DeleteResult, InsertManyResult, InsertOneResult, UpdateResult
+
+_MISSING = object()
+
+def get_path(doc: dict, path: str):
+    value = doc
+    for part in path.split('.'):
+        if not isinstance(value, dict) or part not in value:
+            return _MISSING
+        value = value[part]
+    return value
+
+def set_path(doc: dict, path: str, value):
+    parts = path.split('.')
+    for part in parts[:-1]:
+        doc = doc.setdefault(part, {})
+    doc[parts[-1]] = value
+
+def unset_path(doc: dict, path: str):
+    parts = path.split('.')
+    for part in parts[:-1]:
+        doc = doc.get(part)
+        if not isinstance(doc, dict):
+            return
+    doc.pop(parts[-1], None)
+
+def _compare(op):
+    def check(value, arg):
+        if value is _MISSING or value is None:
+            return False
+        try:
+            return op(value, arg)
+        except TypeError:
+            return False
+    return check
+
+OPERATORS = {
+    "$eq": lambda value, arg: (None if value is _MISSING else value) == arg,
+    "$ne": lambda value, arg: (None if value is _MISSING else value) != arg,
+    "$gt": _compare(lambda a, b: a > b),
+    "$gte": _compare(lambda a, b: a >= b),
+    "$lt": _compare(lambda a, b: a < b),
+    "$lte": _compare(lambda a, b: a <= b),
+    "$in": lambda value, arg: (None if value is _MISSING else value) in arg,
+    "$nin": lambda value, arg: (None if value is _MISSING else value) not in arg,
+    "$exists": lambda value, arg: (value is not _MISSING) == bool(arg),
+}
+
+def is_operator_dict(cond) -> bool:
+    return isinstance(cond, dict) and bool(cond) and all(key.startswith('$') for key in cond)
+
+def matches(doc: dict, flt: dict) -> bool:
+    for key, cond in flt.items():
+        if key == "$or":
+            if not any(matches(doc, sub) for sub in cond):
+                return False
+        elif key == "$and":
+            if not all(matches(doc, sub) for sub in cond):
+                return False
+        elif key.startswith('$'):
+            raise NotImplementedError(f"Unsupported query operator {key}")
+        elif is_operator_dict(cond):
+            value = get_path(doc, key)
+            for op, arg in cond.items():
+                if op not in OPERATORS:
+                    raise NotImplementedError(f"Unsupported query operator {op}")
+                if not OPERATORS[op](value, arg):
+                    return False
+        else:
+            value = get_path(doc, key)
+            if (None if value is _MISSING else value) != cond:
+                return False
+    return True
+
+def project(doc: dict, projection: Optional[dict]) -> dict:
+    if not projection:
+        return copy.deepcopy(doc)
+    include = [key for key, flag in projection.items() if flag and key != "_id"]
+    if include:
+        result = {}
+        if projection.get("_id", 1) and "_id" in doc:
+            result["_id"] = doc["_id"]
+        for key in include:
+            value = get_path(doc, key)
+            if value is not _MISSING:
+                set_path(result, key, copy.deepcopy(value))
+        return result
+    result = copy.deepcopy(doc)
+    for key, flag in projection.items():
+        if not flag:
+            unset_path(result, key)
+    return result
+
+def sort_docs(docs: List[dict], sort: List[Tuple[str, int]]) -> List[dict]:
+    # Stable sorts applied from the last key to the first give a multi-key sort
+    # with independent directions. Missing values sort first, as in Mongo.
+    for key, direction in reversed(sort):
+        def sort_key(doc, key=key):
+            value = get_path(doc, key)
+            return (0, 0) if value is _MISSING or value is None else (1, value)
+        docs.sort(key=sort_key, reverse=direction < 0)
+    return docs
+
+def normalize_sort(key_or_list, direction=None) -> List[Tuple[str, int]]:
+    if isinstance(key_or_list, str):
+        return [(key_or_list, direction or 1)]
+    return [(key, value) for key, value in key_or_list]
+
+def apply_update(doc: dict, update: dict, inserting: bool = False):
+    if not any(key.startswith('$') for key in update):
+        raise NotImplementedError("Replacement documents are not supported in updates")
+    for op, fields in update.items():
+        for path, value in fields.items():
+            current = get_path(doc, path)
+            if op == "$set":
+                set_path(doc, path, copy.deepcopy(value))
+            elif op == "$setOnInsert":
+                if inserting:
+                    set_path(doc, path, copy.deepcopy(value))
+            elif op == "$inc":
+                set_path(doc, path, (0 if current is _MISSING else current) + value)
+            elif op == "$unset":
+                unset_path(doc, path)
+            elif op == "$max":
+                if current is _MISSING or value > current:
+                    set_path(doc, path, value)
+            elif op == "$min":
+                if current is _MISSING or value < current:
+                    set_path(doc, path, value)
+            elif op == "$push":
+                set_path(doc, path, ([] if current is _MISSING else current) + [copy.deepcopy(value)])
+            else:
+                raise NotImplementedError(f"Unsupported update operator {op}")
+
+def upsert_seed(flt: dict) -> dict:
+    doc = {}
+    for key, cond in flt.items():
+        if key.startswith('$'):
+            continue
+        if is_operator_dict(cond):
+            if "$eq" in cond:
+                set_path(doc, key, copy.deepcopy(cond["$eq"]))
+        else:
+            set_path(doc, key, copy.deepcopy(cond))
+    return doc
+
+def evaluate(expr, doc: dict):
+    if isinstance(expr, str) and expr.startswith('$'):
+        value = get_path(doc, expr[1:])
+        return None if value is _MISSING else value
+    if isinstance(expr, dict):
+        return {key: evaluate(value, doc) for key, value in expr.items()}
+    return expr
+
+def run_group(docs: List[dict], spec: dict) -> List[dict]:
+    groups: Dict[Any, dict] = {}
+    for doc in docs:
+        group_id = evaluate(spec["_id"], doc)
+        key = repr(group_id)
+        row = groups.setdefault(key, {"_id": group_id})
+        for field, accumulator in spec.items():
+            if field == "_id":
+                continue
+            (op, expr), = accumulator.items()
+            value = evaluate(expr, doc)
+            if op == "$sum":
+                row[field] = row.get(field, 0) + (value if isinstance(value, (int, float)) else 0)
+            elif op == "$min":
+                row[field] = value if field not in row else min(row[field], value)
+            elif op == "$max":
+                row[field] = value if field not in row else max(row[field], value)
+            elif op == "$first":
+                row.setdefault(field, value)
+            elif op == "$last":
+                row[field] = value
+            else:
+                raise NotImplementedError(f"Unsupported accumulator {op}")
+    return list(groups.values())
+
+class MemoryCursor:
+    def __init__(self, collection: "MemoryCollection", flt: dict, projection: Optional[dict]):
+        self._collection = collection
+        self._filter = flt
+        self._projection = projection
+        self._sort: List[Tuple[str, int]] = []
+        self._skip = 0
+        self._limit = 0
+
+    def sort(self, key_or_list, direction=None):
+        self._sort = normalize_sort(key_or_list, direction)
+        return self
+
+    def skip(self, count: int):
+        self._skip = count
+        return self
+
+    def limit(self, count: int):
+        self._limit = count
+        return self
+
+    def batch_size(self, size: int):
+        return self
+
+    def _materialize(self) -> List[dict]:
+        docs = list(self._collection._matching(self._filter))
+        if self._sort:
+            docs = sort_docs(docs, self._sort)
+        docs = docs[self._skip:]
+        if self._limit:
+            docs = docs[:self._limit]
+        return [project(doc, self._projection) for doc in docs]
+
+    async def to_list(self, length: Optional[int]):
+        await asyncio.sleep(0)
+        docs = self._materialize()
+        return docs[:length] if length else docs
+
+    async def __aiter__(self):
+        await asyncio.sleep(0)
+        for doc in self._materialize():
+            yield doc
+
+    async def explain(self) -> dict:
+        index = self._collection._index_for(self._filter, self._sort)
+        if index:
+            plan = {"stage": "FETCH", "inputStage": {"stage": "IXSCAN", "indexName": index}}
+        else:
+            plan = {"stage": "COLLSCAN"}
+        return {"queryPlanner": {"winningPlan": plan}}
+
+class MemoryAggregation:
+    def __init__(self, collection: "MemoryCollection", pipeline: List[dict]):
+        self._collection = collection
+        self._pipeline = pipeline
+
+    def _run(self) -> List[dict]:
+        docs = [copy.deepcopy(doc) for doc in self._collection._docs.values()]
+        for stage in self._pipeline:
+            (name, spec), = stage.items()
+            if name == "$match":
+                docs = [doc for doc in docs if matches(doc, spec)]
+            elif name == "$group":
+                docs = run_group(docs, spec)
+            elif name == "$sort":
+                docs = sort_docs(docs, normalize_sort(list(spec.items())))
+            elif name == "$limit":
+                docs = docs[:spec]
+            elif name == "$skip":
+                docs = docs[spec:]
+            elif name == "$project":
+                docs = [project(doc, spec) for doc in docs]
+            elif name == "$count":
+                docs = [{spec: len(docs)}] if docs else []
+            else:
+                raise NotImplementedError(f"Unsupported pipeline stage {name}")
+        return docs
+
+    async def to_list(self, length: Optional[int]):
+        await asyncio.sleep(0)
+        docs = self._run()
+        return docs[:length] if length else docs
+
+    async def __aiter__(self):
+        await asyncio.sleep(0)
+        for doc in self._run():
+            yield doc
+
+class MemoryCollection:
+    def __init__(self, name: str):
+        self.name = name
+        self._docs: Dict[Any, dict] = {}
+        # index name -> list of (field, direction)
+        self._indexes: Dict[str, List[Tuple[str, int]]] = {"_id_": [("_id", 1)]}
+        # index name -> {key values: _id} for unique indexes
+        self._unique: Dict[str, Dict[tuple, Any]] = {}
+
+    # -- internals --------------------------------------------------------
+
+    def _unique_key(self, name: str, doc: dict) -> tuple:
+        return tuple(
+            None if get_path(doc, field) is _MISSING else get_path(doc, field)
+            for field, _ in self._indexes[name]
+        )
+
+    def _check_unique(self, doc: dict, ignore_id=_MISSING):
+        if doc["_id"] in self._docs and doc["_id"] != ignore_id:
+            raise DuplicateKeyError(f"E11000 duplicate key error collection: {self.name} index: _id_")
+        for name, entries in self._unique.items():
+            owner = entries.get(self._unique_key(name, doc), _MISSING)
+            if owner is not _MISSING and owner != ignore_id:
+                raise DuplicateKeyError(f"E11000 duplicate key error collection: {self.name} index: {name}")
+
+    def _add(self, doc: dict):
+        self._check_unique(doc)
+        self._docs[doc["_id"]] = doc
+        for name, entries in self._unique.items():
+            entries[self._unique_key(name, doc)] = doc["_id"]
+
+    def _remove(self, doc: dict):
+        self._docs.pop(doc["_id"], None)
+        for name, entries in self._unique.items():
+            entries.pop(self._unique_key(name, doc), None)
+
+    def _replace(self, old: dict, new: dict):
+        self._remove(old)
+        try:
+            self._add(new)
+        except DuplicateKeyError:
+            self._add(old)
+            raise
+
+    def _matching(self, flt: dict):
+        flt = flt or {}
+        if "_id" in flt and not is_operator_dict(flt["_id"]):
+            doc = self._docs.get(flt["_id"])
+            candidates = [doc] if doc else []
+        else:
+            candidates = None
+            for name, entries in self._unique.items():
+                fields = [field for field, _ in self._indexes[name]]
+                if len(fields) == 1 and fields[0] in flt and not is_operator_dict(flt[fields[0]]):
+                    owner = entries.get((flt[fields[0]],), _MISSING)
+                    candidates = [] if owner is _MISSING else [self._docs[owner]]
+                    break
+            if candidates is None:
+                candidates = list(self._docs.values())
+        return [doc for doc in candidates if matches(doc, flt)]
+
+    def _index_for(self, flt: dict, sort: List[Tuple[str, int]]) -> Optional[str]:
+        fields = {key for key in (flt or {}) if not key.startswith('$')}
+        for name, keys in self._indexes.items():
+            first = keys[0][0]
+            if first in fields or (not fields and sort and sort[0][0] == first):
+                return name
+        return None
+
+    def _prepare_insert(self, document: dict) -> dict:
+        if "_id" not in document:
+            document["_id"] = ObjectId()
+        return copy.deepcopy(document)
+
+    def _update(self, flt: dict, update: dict, upsert: bool, many: bool) -> UpdateResult:
+        targets = self._matching(flt)
+        if not many:
+            targets = targets[:1]
+        modified = 0
+        for doc in targets:
+            new = copy.deepcopy(doc)
+            apply_update(new, update)
+            if new != doc:
+                self._replace(doc, new)
+                modified += 1
+        raw = {"n": len(targets), "nModified": modified, "ok": 1.0, "updatedExisting": bool(targets)}
+        if not targets and upsert:
+            doc = upsert_seed(flt)
+            apply_update(doc, update, inserting=True)
+            doc.setdefault("_id", ObjectId())
+            self._add(doc)
+            raw.update({"n": 1, "upserted": doc["_id"]})
+        return UpdateResult(raw, True)
+
+    # -- Motor collection API ---------------------------------------------
+
+    def find(self, filter: Optional[dict] = None, projection: Optional[dict] = None) -> MemoryCursor:
+        return MemoryCursor(self, filter or {}, projection)
+
+    async def find_one(self, filter: Optional[dict] = None, projection: Optional[dict] = None):
+        docs = await self.find(filter, projection).limit(1).to_list(1)
+        return docs[0] if docs else None
+
+    async def count_documents(self, filter: dict) -> int:
+        await asyncio.sleep(0)
+        return len(self._matching(filter))
+
+    async def insert_one(self, document: dict) -> InsertOneResult:
+        await asyncio.sleep(0)
+        doc = self._prepare_insert(document)
+        self._add(doc)
+        return InsertOneResult(doc["_id"], True)
+
+    async def insert_many(self, documents: List[dict], ordered: bool = True) -> InsertManyResult:
+        await asyncio.sleep(0)
+        ids, errors = [], []
+        for index, document in enumerate(documents):
+            doc = self._prepare_insert(document)
+            try:
+                self._add(doc)
+                ids.append(doc["_id"])
+            except DuplicateKeyError as e:
+                errors.append({"index": index, "code": 11000, "errmsg": str(e)})
+                if ordered:
+                    break
+        if errors:
+            raise BulkWriteError({
+                "writeErrors": errors, "nInserted": len(ids), "nUpserted": 0, "nMatched": 0,
+                "nModified": 0, "nRemoved": 0, "upserted": [], "writeConcernErrors": [],
+            })
+        return InsertManyResult(ids, True)
+
+    async def update_one(self, filter: dict, update: dict, upsert: bool = False) -> UpdateResult:
+        await asyncio.sleep(0)
+        return self._update(filter, update, upsert, many=False)
+
+    async def update_many(self, filter: dict, update: dict, upsert: bool = False) -> UpdateResult:
+        await asyncio.sleep(0)
+        return self._update(filter, update, upsert, many=True)
+
+    async def find_one_and_update(self, filter: dict, update: dict, projection: Optional[dict] = None,
+                                  sort=None, upsert: bool = False, return_document=ReturnDocument.BEFORE):
+        await asyncio.sleep(0)
+        targets = self._matching(filter)
+        if sort:
+            targets = sort_docs(targets, normalize_sort(sort))
+        if targets:
+            before = targets[0]
+            after = copy.deepcopy(before)
+            apply_update(after, update)
+            self._replace(before, after)
+            return project(after if return_document else before, projection)
+        if not upsert:
+            return None
+        doc = upsert_seed(filter)
+        apply_update(doc, update, inserting=True)
+        doc.setdefault("_id", ObjectId())
+        self._add(doc)
+        return project(doc, projection) if return_document else None
+
+    async def find_one_and_delete(self, filter: dict, projection: Optional[dict] = None):
+        await asyncio.sleep(0)
+        targets = self._matching(filter)
+        if not targets:
+            return None
+        self._remove(targets[0])
+        return project(targets[0], projection)
+
+    async def replace_one(self, filter: dict, replacement: dict, upsert: bool = False) -> UpdateResult:
+        await asyncio.sleep(0)
+        targets = self._matching(filter)[:1]
+        if targets:
+            new = copy.deepcopy(replacement)
+            new["_id"] = targets[0]["_id"]
+            self._replace(targets[0], new)
+            return UpdateResult({"n": 1, "nModified": 1, "ok": 1.0, "updatedExisting": True}, True)
+        if upsert:
+            doc = {**upsert_seed(filter), **copy.deepcopy(replacement)}
+            doc.setdefault("_id", ObjectId())
+            self._add(doc)
+            return UpdateResult({"n": 1, "nModified": 0, "ok": 1.0, "upserted": doc["_id"]}, True)
+        return UpdateResult({"n": 0, "nModified": 0, "ok": 1.0}, True)
+
+    async def delete_one(self, filter: dict) -> DeleteResult:
+        await asyncio.sleep(0)
+        targets = self._matching(filter)[:1]
+        for doc in targets:
+            self._remove(doc)
+        return DeleteResult({"n": len(targets), "ok": 1.0}, True)
+
+    async def delete_many(self, filter: dict) -> DeleteResult:
+        await asyncio.sleep(0)
+        targets = self._matching(filter)
+        for doc in targets:
+            self._remove(doc)
+        return DeleteResult({"n": len(targets), "ok": 1.0}, True)
+
+    async def bulk_write(self, requests: list, ordered: bool = True) -> BulkWriteResult:
+        await asyncio.sleep(0)
+        result = {
+            "writeErrors": [], "writeConcernErrors": [], "nInserted": 0, "nUpserted": 0,
+            "nMatched": 0, "nModified": 0, "nRemoved": 0, "upserted": [],
+        }
+        for index, request in enumerate(requests):
+            try:
+                if isinstance(request, InsertOne):
+                    self._add(self._prepare_insert(request._doc))
+                    result["nInserted"] += 1
+                elif isinstance(request, UpdateOne):
+                    outcome = self._update(request._filter, request._doc, request._upsert, many=False)
+                    if "upserted" in outcome.raw_result:
+                        result["nUpserted"] += 1
+                        result["upserted"].append({"index": index, "_id": outcome.upserted_id})
+                    else:
+                        result["nMatched"] += outcome.matched_count
+                        result["nModified"] += outcome.modified_count
+                elif isinstance(request, ReplaceOne):
+                    targets = self._matching(request._filter)[:1]
+                    if targets:
+                        new = {**copy.deepcopy(request._doc), "_id": targets[0]["_id"]}
+                        self._replace(targets[0], new)
+                        result["nMatched"] += 1
+                        result["nModified"] += int(new != targets[0])
+                    elif request._upsert:
+                        doc = {**upsert_seed(request._filter), **copy.deepcopy(request._doc)}
+                        doc.setdefault("_id", ObjectId())
+                        self._add(doc)
+                        result["nUpserted"] += 1
+                        result["upserted"].append({"index": index, "_id": doc["_id"]})
+                elif isinstance(request, DeleteOne):
+                    targets = self._matching(request._filter)[:1]
+                    for doc in targets:
+                        self._remove(doc)
+                    result["nRemoved"] += len(targets)
+                else:
+                    raise NotImplementedError(f"Unsupported bulk operation {type(request).__name__}")
+            except DuplicateKeyError as e:
+                result["writeErrors"].append({"index": index, "code": 11000, "errmsg": str(e)})
+                if ordered:
+                    break
+        if result["writeErrors"]:
+            raise BulkWriteError(result)
+        return BulkWriteResult(result, True)
+
+    def aggregate(self, pipeline: List[dict]) -> MemoryAggregation:
+        return MemoryAggregation(self, pipeline)
+
+    async def create_indexes(self, indexes: list) -> List[str]:
+        await asyncio.sleep(0)
+        names = []
+        for model in indexes:
+            spec = model.document
+            name = spec["name"]
+            self._indexes[name] = list(spec["key"].items())
+            if spec.get("unique") and name not in self._unique:
+                entries = {}
+                for doc in self._docs.values():
+                    key = self._unique_key(name, doc)
+                    if key in entries:
+                        del self._indexes[name]
+                        raise DuplicateKeyError(f"E11000 duplicate key error collection: {self.name} index: {name}")
+                    entries[key] = doc["_id"]
+                self._unique[name] = entries
+            names.append(name)
+        return names
+
+    async def drop(self):
+        await asyncio.sleep(0)
+        self._docs.clear()
+        for entries in self._unique.values():
+            entries.clear()
+
+class MemoryDatabase:
+    """Dict of MemoryCollection objects addressable like a Motor database."""
+
+    def __init__(self, name: str = "memory"):
+        self.name = name
+        self._collections: Dict[str, MemoryCollection] = {}
+
+    def __getitem__(self, name: str) -> MemoryCollection:
+        if name not in self._collections:
+            self._collections[name] = MemoryCollection(name)
+        return self._collections[name]
+
+    def __getattr__(self, name: str) -> MemoryCollection:
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self[name]
+
+    async def list_collection_names(self) -> List[str]:
+        return [name for name, collection in self._collections.items() if collection._docs]
+
+    async def command(self, command, **kwargs):
+        if command == "ping" or command == {"ping": 1}:
+            return {"ok": 1.0}
+        raise NotImplementedError(f"Unsupported command {command}")
@@ -0,0 +1,128 @@
+"""In-memory inverted index over menu items for GET /api/menu/search.
+
+Text is normalized for Spanish: lowercased, accents folded (café -> cafe),
+a few stopwords dropped and words reduced by a light stemmer that strips
+plural and gender endings (asadas/asado -> asad). Every query word has to
+match an indexed term exactly or as a prefix, so partial input such as
+"risot" still finds "Risotto". Matches in nombre weigh more than matches in
+categoria or descripcion.
+"""
+import bisect
+import math
+import re
+import unicodedata
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+FIELD_WEIGHTS = {"nombre": 3.0, "categoria": 2.0, "descripcion": 1.0}
+# A prefix-only match counts for less than an exact term match.
+PREFIX_WEIGHT = 0.5
+
+STOPWORDS = {
+    "a", "al", "con", "de", "del", "el", "en", "la", "las", "lo", "los",
+    "o", "para", "por", "u", "un", "una", "y",
+}
+
+TOKEN_RE = re.compile(r"\w+")
+
+def fold(text: str) -> str:
+    decomposed = unicodedata.normalize("NFKD", text.lower())
+    return "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+
+def stem(word: str) -> str:
+    if len(word) > 4 and word.endswith("es") and word[-3] not in "aeiou":
+        word = word[:-2]
+    elif len(word) > 3 and word.endswith("s"):
+        word = word[:-1]
+    if len(word) > 4 and word[-1] in "aeo":
+        word = word[:-1]
+    return word
+
+def tokenize(text: str) -> List[str]:
+    return [word for word in TOKEN_RE.findall(fold(text)) if word not in STOPWORDS]
+
+class MenuSearchIndex:
+    def __init__(self):
+        self._postings: Dict[str, Dict[str, float]] = defaultdict(dict)
+        self._doc_terms: Dict[str, Set[str]] = {}
+        self._items: Dict[str, dict] = {}
+        self._sorted_terms: Optional[List[str]] = None
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def rebuild(self, items: Iterable[dict]):
+        self._postings.clear()
+        self._doc_terms.clear()
+        self._items.clear()
+        for item in items:
+            self.add(item)
+
+    def add(self, item: dict):
+        """Index ``item``, replacing any previous version with the same id."""
+        item_id = item["id"]
+        self.remove(item_id)
+        weights: Dict[str, float] = defaultdict(float)
+        for field, weight in FIELD_WEIGHTS.items():
+            for word in tokenize(item.get(field) or ""):
+                weights[stem(word)] += weight
+        for term, weight in weights.items():
+            self._postings[term][item_id] = weight
+        self._doc_terms[item_id] = set(weights)
+        self._items[item_id] = item
+        self._sorted_terms = None
+
+    def remove(self, item_id: str):
+        for term in self._doc_terms.pop(item_id, ()):
+            postings = self._postings[term]
+            postings.pop(item_id, None)
+            if not postings:
+                del self._postings[term]
+        if self._items.pop(item_id, None) is not None:
+            self._sorted_terms = None
+
+    def _terms_with_prefix(self, prefix: str) -> List[str]:
+        if self._sorted_terms is None:
+            self._sorted_terms = sorted(self._postings)
+        start = bisect.bisect_left(self._sorted_terms, prefix)
+        end = bisect.bisect_left(self._sorted_terms, prefix + "\uffff")
+        return self._sorted_terms[start:end]
+
+    def _match_word(self, word: str) -> Dict[str, float]:
+        scores: Dict[str, float] = defaultdict(float)
+        exact = stem(word)
+        terms = set(self._terms_with_prefix(word))
+        if exact in self._postings:
+            terms.add(exact)
+        for term in terms:
+            postings = self._postings[term]
+            idf = math.log(1 + len(self._items) / len(postings))
+            factor = 1.0 if term == exact else PREFIX_WEIGHT
+            for item_id, weight in postings.items():
+                scores[item_id] = max(scores[item_id], weight * idf * factor)
+        return scores
+
+    def search(self, query: str, sin_tacc: Optional[bool] = None, destacado: Optional[bool] = None,
+               limit: int = 20) -> List[dict]:
+        words = tokenize(query)
+        if not words:
+            return []
+        totals: Optional[Dict[str, float]] = None
+        for word in words:
+            scores = self._match_word(word)
+            if totals is None:
+                totals = dict(scores)
+            else:
+                totals = {item_id: total + scores[item_id] for item_id, total in totals.items() if item_id in scores}
+            if not totals:
+                return []
+        ranked: List[Tuple[float, str, str]] = []
+        for item_id, score in totals.items():
+            item = self._items[item_id]
+            if sin_tacc is not None and item.get("sin_tacc") != sin_tacc:
+                continue
+            if destacado is not None and item.get("destacado") != destacado:
+                continue
+            ranked.append((-score, item.get("nombre", ""), item_id))
+        ranked.sort()
+        return [self._items[item_id] for _, _, item_id in ranked[:limit]]
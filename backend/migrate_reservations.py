@@ -0,0 +1,98 @@
+"""Migrate stored reservations to native BSON dates.
+
+Older reservations keep ``created_at`` as an ISO string and have no
+``slot_at``. This walks ``reservations`` and every archive month in ``_id``
+order, in batches, and sets both as datetimes. Progress is checkpointed in
+the ``migrations`` collection after every batch, so an interrupted run picks
+up where it stopped; documents whose fecha/hora cannot be parsed are
+reported and left as they are.
+
+The server runs the same migration on startup (see
+``migrate_reservation_dates`` in server.py); this script is for running it
+ahead of a deploy, or for a dry run.
+
+    python migrate_reservations.py
+    python migrate_reservations.py --batch-size 1000 --dry-run
+    python migrate_reservations.py --restart
+"""
+import argparse
+import asyncio
+import os
+import sys
+from pathlib import Path
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, UpdateOne
+
+from reservation_time import date_fields
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+MIGRATION_ID = "reservation_dates"
+ARCHIVE_PREFIX = "reservations_archive_"
+
+async def migrate_collection(db, name: str, batch_size: int, dry_run: bool, restart: bool, report=print) -> dict:
+    checkpoint_id = f"{MIGRATION_ID}:{name}"
+    checkpoint = None if restart else await db.migrations.find_one({"_id": checkpoint_id})
+    last_id = (checkpoint or {}).get("last_id")
+    totals = {"scanned": 0, "migrated": 0, "invalid": 0}
+    while True:
+        query = {"_id": {"$gt": last_id}} if last_id is not None else {}
+        batch = await db[name].find(
+            query, {"_id": 1, "id": 1, "fecha": 1, "hora": 1, "created_at": 1, "slot_at": 1}
+        ).sort("_id", ASCENDING).limit(batch_size).to_list(batch_size)
+        if not batch:
+            break
+        operations = []
+        for doc in batch:
+            try:
+                update = date_fields(doc)
+            except (KeyError, TypeError, ValueError) as e:
+                totals["invalid"] += 1
+                report(f"   {name}: skipping {doc.get('id', doc['_id'])}: {e}")
+                continue
+            if update:
+                # Matching on the old created_at keeps a concurrent write from
+                # being overwritten with stale values.
+                operations.append(UpdateOne({"_id": doc["_id"], "created_at": doc.get("created_at")}, {"$set": update}))
+        if operations and not dry_run:
+            result = await db[name].bulk_write(operations, ordered=False)
+            totals["migrated"] += result.modified_count
+        else:
+            totals["migrated"] += len(operations)
+        totals["scanned"] += len(batch)
+        last_id = batch[-1]["_id"]
+        if not dry_run:
+            await db.migrations.update_one({"_id": checkpoint_id}, {"$set": {"last_id": last_id}}, upsert=True)
+        if len(batch) < batch_size:
+            break
+    return totals
+
+async def run(args) -> int:
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'], tz_aware=True)
+    db = client[os.environ['DB_NAME']]
+    try:
+        names = ["reservations"] + sorted(
+            name for name in await db.list_collection_names() if name.startswith(ARCHIVE_PREFIX)
+        )
+        invalid = 0
+        for name in names:
+            totals = await migrate_collection(db, name, args.batch_size, args.dry_run, args.restart)
+            invalid += totals["invalid"]
+            verb = "would migrate" if args.dry_run else "migrated"
+            print(f"{name}: scanned {totals['scanned']}, {verb} {totals['migrated']}, invalid {totals['invalid']}")
+    finally:
+        client.close()
+    return 1 if invalid else 0
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=500, help="Documents read and written per batch")
+    parser.add_argument("--dry-run", action="store_true", help="Count what would change without writing")
+    parser.add_argument("--restart", action="store_true", help="Ignore saved progress and scan everything again")
+    return asyncio.run(run(parser.parse_args()))
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,263 @@
+"""Opt-in per-request sampling profiler.
+
+``ProfilingMiddleware`` profiles a request when an admin sends the
+``X-Profile`` header, or at random for a ``sample_rate`` fraction of all
+requests. While at least one request is being profiled, a ``Sampler``
+thread wakes every ``interval`` seconds and records, for each profiled
+request, either the stack it is running on the event loop or, when its task
+is suspended, the chain of coroutines it is awaiting; the latter ends in an
+``<await>`` frame, which is time spent waiting on MongoDB or the network
+rather than on the CPU. Samples are weighted by the wall time since the
+previous one.
+
+Each profile is written in speedscope's JSON format to a ``ProfileStore``,
+a directory that keeps only the newest ``max_files`` profiles, and can be
+converted to collapsed stacks for flamegraph.pl and similar tools. When the
+middleware is not installed there is no overhead at all; when it is, an
+unprofiled request costs a header lookup and, with a sample rate, one
+random number.
+
+Work a handler hands to other threads (Motor's executor, sync
+dependencies) or to other tasks (streaming response bodies) is seen only
+as the ``<await>`` of the request that waits for it.
+"""
+import asyncio
+import json
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from files import write_atomic
+
+FrameKey = Tuple[str, str, int]
+AWAIT_FRAME: FrameKey = ("<await>", "", 0)
+PROFILE_ID_RE = re.compile(r"^\d+-[0-9a-f]{8}$")
+SPEEDSCOPE_SCHEMA = "https://www.speedscope.app/file-format-schema.json"
+
+logger = logging.getLogger(__name__)
+
+def frame_key(frame) -> FrameKey:
+    code = frame.f_code
+    return getattr(code, "co_qualname", code.co_name), code.co_filename, code.co_firstlineno
+
+def running_stack(leaf, root) -> Optional[List]:
+    """Frames from ``root`` down to ``leaf``, or None if ``root`` is not on the stack."""
+    frames = []
+    while leaf is not None:
+        frames.append(leaf)
+        if leaf is root:
+            return frames[::-1]
+        leaf = leaf.f_back
+    return None
+
+def awaiting_stack(coro, root) -> Optional[List]:
+    """Frames of the coroutines a suspended task is awaiting, starting at ``root``."""
+    frames = []
+    while coro is not None:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None)
+        if frame is None:
+            break
+        frames.append(frame)
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None)
+    if root not in frames:
+        return None
+    return frames[frames.index(root):]
+
+class ProfileSession:
+    def __init__(self, root, task: asyncio.Task, thread_id: int):
+        self.root = root
+        self.task = task
+        self.thread_id = thread_id
+        self.started = time.perf_counter()
+        self._last = self.started
+        # stack -> seconds
+        self.samples: Dict[Tuple[FrameKey, ...], float] = {}
+
+    def sample(self, leaf, now: float):
+        weight, self._last = now - self._last, now
+        stack = running_stack(leaf, self.root)
+        if stack is None:
+            stack = awaiting_stack(self.task.get_coro(), self.root)
+            if stack is None:
+                return
+            keys = tuple(frame_key(frame) for frame in stack) + (AWAIT_FRAME,)
+        else:
+            keys = tuple(frame_key(frame) for frame in stack)
+        self.samples[keys] = self.samples.get(keys, 0.0) + weight
+
+    def to_speedscope(self, name: str) -> dict:
+        frames: List[FrameKey] = []
+        indexes: Dict[FrameKey, int] = {}
+        samples, weights = [], []
+        for stack, seconds in self.samples.items():
+            sample = []
+            for key in stack:
+                if key not in indexes:
+                    indexes[key] = len(frames)
+                    frames.append(key)
+                sample.append(indexes[key])
+            samples.append(sample)
+            weights.append(round(seconds * 1000, 3))
+        return {
+            "$schema": SPEEDSCOPE_SCHEMA,
+            "name": name,
+            "exporter": "calandria-profiling",
+            "activeProfileIndex": 0,
+            "shared": {"frames": [{"name": n, "file": f, "line": line} if f else {"name": n} for n, f, line in frames]},
+            "profiles": [{
+                "type": "sampled",
+                "name": name,
+                "unit": "milliseconds",
+                "startValue": 0,
+                "endValue": round(sum(weights), 3),
+                "samples": samples,
+                "weights": weights,
+            }],
+        }
+
+class Sampler:
+    """One background thread shared by every request being profiled.
+
+    The thread only runs while at least one session is active.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._sessions: set = set()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self, root, task: asyncio.Task) -> ProfileSession:
+        session = ProfileSession(root, task, threading.get_ident())
+        with self._lock:
+            self._sessions.add(session)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="profiling-sampler", daemon=True)
+                self._thread.start()
+        return session
+
+    def stop(self, session: ProfileSession):
+        with self._lock:
+            self._sessions.discard(session)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._sessions:
+                    self._thread = None
+                    return
+                sessions = list(self._sessions)
+            frames = sys._current_frames()
+            now = time.perf_counter()
+            for session in sessions:
+                session.sample(frames.get(session.thread_id), now)
+
+class ProfileStore:
+    """Speedscope files in ``root``, pruned to the newest ``max_files``."""
+
+    def __init__(self, root: Path, max_files: int):
+        self.root = root
+        self.max_files = max_files
+
+    def _files(self) -> List[Path]:
+        if not self.root.is_dir():
+            return []
+        return sorted(self.root.glob("*.speedscope.json"), reverse=True)
+
+    def save(self, profile: dict) -> str:
+        self.root.mkdir(parents=True, exist_ok=True)
+        profile_id = f"{time.time_ns() // 1_000_000}-{uuid.uuid4().hex[:8]}"
+        write_atomic(self.root / f"{profile_id}.speedscope.json", json.dumps(profile).encode())
+        for stale in self._files()[self.max_files:]:
+            stale.unlink(missing_ok=True)
+        return profile_id
+
+    def path(self, profile_id: str) -> Optional[Path]:
+        if not PROFILE_ID_RE.match(profile_id):
+            return None
+        path = self.root / f"{profile_id}.speedscope.json"
+        return path if path.is_file() else None
+
+    def list(self) -> List[dict]:
+        profiles = []
+        for path in self._files():
+            try:
+                name = json.loads(path.read_bytes())["name"]
+            except (OSError, ValueError, KeyError):
+                continue
+            profile_id = path.name[:-len(".speedscope.json")]
+            created_ms = int(profile_id.split("-")[0])
+            profiles.append({"id": profile_id, "name": name, "created_at": created_ms / 1000, "bytes": path.stat().st_size})
+        return profiles
+
+    def collapsed(self, profile_id: str) -> Optional[str]:
+        """The profile as collapsed stacks, one ``frame;frame;frame weight_us`` line per stack."""
+        path = self.path(profile_id)
+        if path is None:
+            return None
+        profile = json.loads(path.read_bytes())
+        labels = [
+            f"{frame['name']} ({os.path.basename(frame['file'])}:{frame['line']})" if "file" in frame else frame["name"]
+            for frame in profile["shared"]["frames"]
+        ]
+        labels = [label.replace(";", ":") for label in labels]
+        sampled = profile["profiles"][0]
+        lines = [
+            ";".join(labels[index] for index in sample) + f" {round(weight * 1000)}"
+            for sample, weight in zip(sampled["samples"], sampled["weights"])
+        ]
+        return "".join(line + "\n" for line in lines)
+
+class ProfilingMiddleware:
+    """Pure ASGI middleware, so the handler runs in the same task it samples."""
+
+    def __init__(self, app, sampler: Sampler, store: ProfileStore, authorize: Callable[[Optional[str]], bool],
+                 sample_rate: float = 0.0):
+        self.app = app
+        self.sampler = sampler
+        self.store = store
+        self.authorize = authorize
+        self.sample_rate = sample_rate
+
+    def _selected(self, scope) -> bool:
+        if self.sample_rate and random.random() < self.sample_rate:
+            return True
+        headers = dict(scope["headers"])
+        if b"x-profile" not in headers:
+            return False
+        authorization = headers.get(b"authorization")
+        return self.authorize(authorization.decode("latin-1") if authorization else None)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._selected(scope):
+            await self.app(scope, receive, send)
+            return
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        session = self.sampler.start(sys._getframe(), asyncio.current_task())
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            self.sampler.stop(session)
+            elapsed_ms = (time.perf_counter() - session.started) * 1000
+            # The query string is left out: the events stream carries the
+            # admin token in it.
+            name = f"{scope['method']} {scope['path']} {status} {elapsed_ms:.1f}ms"
+            try:
+                await asyncio.to_thread(self.store.save, session.to_speedscope(name))
+            except Exception as e:
+                logger.error("Could not save profile for %s: %s", name, e)
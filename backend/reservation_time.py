@@ -0,0 +1,47 @@
+"""Conversions between a reservation's local fecha/hora and stored BSON dates.
+
+Reservations keep ``fecha`` (YYYY-MM-DD) and ``hora`` (HH:MM) as entered, in
+the restaurant's local time, and additionally store ``slot_at``: the same
+instant as a UTC datetime. Range filters, sorts and archival run on
+``slot_at`` so MongoDB can answer them from an index; ``created_at`` is
+stored as a datetime as well instead of an ISO string.
+"""
+import os
+from datetime import datetime, time, timedelta, timezone
+from typing import Optional
+from zoneinfo import ZoneInfo
+
+RESTAURANT_TZ = ZoneInfo(os.environ.get('RESTAURANT_TZ', 'America/Argentina/San_Luis'))
+
+def day_start(fecha: str) -> datetime:
+    """UTC instant of local midnight on ``fecha``; raises ValueError if malformed."""
+    day = datetime.strptime(fecha, "%Y-%m-%d").date()
+    return datetime.combine(day, time(), RESTAURANT_TZ).astimezone(timezone.utc)
+
+def day_end(fecha: str) -> datetime:
+    """UTC instant of local midnight after ``fecha`` (exclusive upper bound)."""
+    day = datetime.strptime(fecha, "%Y-%m-%d").date() + timedelta(days=1)
+    return datetime.combine(day, time(), RESTAURANT_TZ).astimezone(timezone.utc)
+
+def slot_datetime(fecha: str, hora: str) -> datetime:
+    """UTC instant of the ``fecha``/``hora`` slot; raises ValueError if either is malformed."""
+    local = datetime.strptime(f"{fecha} {hora}", "%Y-%m-%d %H:%M")
+    return local.replace(tzinfo=RESTAURANT_TZ).astimezone(timezone.utc)
+
+def as_utc(value) -> datetime:
+    """``created_at`` as an aware UTC datetime, whether stored as a date or an ISO string."""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+def date_fields(doc: dict) -> Optional[dict]:
+    """The ``$set`` that brings a stored reservation up to native dates, or None if it already is."""
+    update = {}
+    created_at = doc.get("created_at")
+    if isinstance(created_at, str):
+        update["created_at"] = as_utc(created_at)
+    if not isinstance(doc.get("slot_at"), datetime):
+        update["slot_at"] = slot_datetime(doc["fecha"], doc["hora"])
+    return update or None
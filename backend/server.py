@@ -1,28 +1,97 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, File, Header, Request, Response, Query, UploadFile
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
+from fastapi.responses import FileResponse, StreamingResponse
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, DESCENDING, DeleteOne, IndexModel, InsertOne, ReplaceOne, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
 import os
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field, ConfigDict
-from typing import List, Optional
+from pydantic import BaseModel, Field, ConfigDict, TypeAdapter
+from contextlib import asynccontextmanager
+from typing import Annotated, Dict, List, Literal, Optional, Tuple, Type, Union
 import uuid
-from datetime import datetime, timezone
+import httpx
+from datetime import date, datetime, timedelta, timezone
 import hashlib
+import hmac
+import asyncio
+import time
+import base64
+import json
+import csv
+import io
+import math
+import ipaddress
+from collections import OrderedDict
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+from compression import CompressionMiddleware, compress, negotiate
+from image_store import VARIANTS, ImageStore, InvalidImage
+from menu_search import MenuSearchIndex
+from metrics import MetricsMiddleware, MongoMetricsListener, metrics_registry
+from migrate_reservations import MIGRATION_ID as RESERVATION_DATES_MIGRATION_ID, migrate_collection
+from profiling import ProfileStore, ProfilingMiddleware, Sampler
+from reservation_time import as_utc, day_end, day_start, slot_datetime
+from table_assignment import TableLayout, minutes, pack, restore
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() == 'true'
+COMPRESSION_ENABLED = os.environ.get('COMPRESSION_ENABLED', 'true').lower() == 'true'
+# Per-request profiling: requests from an admin carrying X-Profile, plus a
+# PROFILE_SAMPLE_RATE fraction of all requests, are profiled into PROFILE_DIR.
+PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED', 'false').lower() == 'true'
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', '0'))
+profile_store = ProfileStore(
+    root=Path(os.environ.get('PROFILE_DIR', str(ROOT_DIR / 'profiles'))),
+    max_files=int(os.environ.get('PROFILE_MAX_FILES', '50')),
+)
+
+def mongo_client_options() -> dict:
+    """Pool, timeout and compression settings for the Motor client, from .env."""
+    settings = {
+        'maxPoolSize': ('MONGO_MAX_POOL_SIZE', int, '100'),
+        'minPoolSize': ('MONGO_MIN_POOL_SIZE', int, '10'),
+        'maxIdleTimeMS': ('MONGO_MAX_IDLE_TIME_MS', int, None),
+        'waitQueueTimeoutMS': ('MONGO_WAIT_QUEUE_TIMEOUT_MS', int, None),
+        'connectTimeoutMS': ('MONGO_CONNECT_TIMEOUT_MS', int, '5000'),
+        'serverSelectionTimeoutMS': ('MONGO_SERVER_SELECTION_TIMEOUT_MS', int, '5000'),
+        'socketTimeoutMS': ('MONGO_SOCKET_TIMEOUT_MS', int, None),
+        'compressors': ('MONGO_COMPRESSORS', str, None),
+    }
+    options = {}
+    for option, (setting, cast, default) in settings.items():
+        value = os.environ.get(setting, default)
+        if value:
+            options[option] = cast(value)
+    return options
+
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+client = AsyncIOMotorClient(
+    mongo_url,
+    tz_aware=True,
+    event_listeners=[MongoMetricsListener()] if METRICS_ENABLED else [],
+    **mongo_client_options()
+)
 db = client[os.environ['DB_NAME']]
 
-app = FastAPI()
 api_router = APIRouter(prefix="/api")
 security = HTTPBearer()
 
+# Branches served by this deployment. Every menu item and reservation
+# belongs to one; public routes pick it with ?sucursal= and default to the
+# first, admin routes use the branch of the logged-in admin.
+SUCURSALES = [s.strip() for s in os.environ.get('SUCURSALES', 'villa-mercedes').split(',') if s.strip()]
+DEFAULT_SUCURSAL = SUCURSALES[0]
+
 class MenuItem(BaseModel):
     model_config = ConfigDict(extra="ignore")
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -30,16 +99,21 @@ class MenuItem(BaseModel):
     descripcion: str
     precio: float
     categoria: str
-    imagen_url: str
+    imagen_url: Optional[str] = None
+    imagen: Optional[str] = None
     destacado: bool = False
     sin_tacc: bool = False
+    sucursal: str = DEFAULT_SUCURSAL
+
+menu_list_adapter = TypeAdapter(List[MenuItem])
 
 class MenuItemCreate(BaseModel):
     nombre: str
     descripcion: str
     precio: float
     categoria: str
-    imagen_url: str
+    imagen_url: Optional[str] = None
+    imagen: Optional[str] = None
     destacado: bool = False
     sin_tacc: bool = False
 
@@ -49,9 +123,47 @@ class MenuItemUpdate(BaseModel):
     precio: Optional[float] = None
     categoria: Optional[str] = None
     imagen_url: Optional[str] = None
+    imagen: Optional[str] = None
     destacado: Optional[bool] = None
     sin_tacc: Optional[bool] = None
 
+class MenuBulkCreate(BaseModel):
+    op: Literal["create"]
+    item: MenuItemCreate
+
+class MenuBulkUpdate(BaseModel):
+    op: Literal["update"]
+    id: str
+    item: MenuItemUpdate
+
+class MenuBulkDelete(BaseModel):
+    op: Literal["delete"]
+    id: str
+
+class MenuBulkRequest(BaseModel):
+    ordered: bool = True
+    operations: List[Annotated[Union[MenuBulkCreate, MenuBulkUpdate, MenuBulkDelete], Field(discriminator="op")]]
+
+class MenuBulkResult(BaseModel):
+    index: int
+    op: str
+    id: str
+    status: Literal["ok", "not_found", "error", "skipped"]
+    error: Optional[str] = None
+
+class MenuBulkResponse(BaseModel):
+    inserted: int
+    modified: int
+    deleted: int
+    results: List[MenuBulkResult]
+
+class ImageInfo(BaseModel):
+    hash: str
+    variants: Dict[str, str]
+
+class ImageIngest(BaseModel):
+    url: str
+
 class Reservation(BaseModel):
     model_config = ConfigDict(extra="ignore")
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -61,8 +173,12 @@ class Reservation(BaseModel):
     hora: str
     cantidad_personas: int
     estado: str = "pendiente"
+    sucursal: str = DEFAULT_SUCURSAL
+    mesas: List[str] = []
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
+reservation_list_adapter = TypeAdapter(List[Reservation])
+
 class ReservationCreate(BaseModel):
     nombre_cliente: str
     telefono: str
@@ -70,8 +186,72 @@ class ReservationCreate(BaseModel):
     hora: str
     cantidad_personas: int
 
+Estado = Literal["pendiente", "confirmada", "cancelada", "expirada"]
+
 class ReservationUpdate(BaseModel):
+    estado: Estado
+
+class ReservationFilter(BaseModel):
+    estado: Optional[Estado] = None
+    fecha_desde: Optional[str] = None
+    fecha_hasta: Optional[str] = None
+
+class ReservationBulkUpdate(BaseModel):
+    """One estado change applied to ``ids`` or to every reservation matching ``filter``."""
+    estado: Estado
+    ids: Optional[List[str]] = None
+    filter: Optional[ReservationFilter] = None
+
+class ReservationBulkResponse(BaseModel):
     estado: str
+    modified: int
+    sin_cupo: List[str] = []
+    not_found: List[str] = []
+
+class StatsBucket(BaseModel):
+    reservas: int = 0
+    personas: int = 0
+
+class ReservationDayStats(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    sucursal: str
+    fecha: str
+    reservas: int = 0
+    personas: int = 0
+    por_estado: Dict[str, StatsBucket] = {}
+    por_hora: Dict[str, Dict[str, StatsBucket]] = {}
+
+class SlotAvailability(BaseModel):
+    hora: str
+    capacidad: int
+    ocupados: int
+    disponibles: int
+
+class Table(BaseModel):
+    id: str = Field(min_length=1)
+    capacidad: int = Field(ge=1)
+
+class TableCombination(BaseModel):
+    """Tables staff push together; capacidad defaults to the sum of theirs."""
+    mesas: List[str] = Field(min_length=2)
+    capacidad: Optional[int] = Field(None, ge=1)
+
+class TableLayoutConfig(BaseModel):
+    mesas: List[Table] = []
+    combinaciones: List[TableCombination] = []
+    version: int = 0
+
+class TableAssignment(BaseModel):
+    id: str
+    hora: str
+    cantidad_personas: int
+    mesas: List[str]
+
+class TablePlan(BaseModel):
+    fecha: str
+    layout_version: int
+    asignaciones: List[TableAssignment] = []
+    sin_mesa: List[str] = []
 
 class AdminLogin(BaseModel):
     username: str
@@ -80,45 +260,1456 @@ class AdminLogin(BaseModel):
 class AdminToken(BaseModel):
     token: str
     username: str
+    sucursal: str
+
+class EventsTicket(BaseModel):
+    ticket: str
+    expires_in: int
+
+# List endpoints encode Mongo documents straight to JSON, reading only the
+# schema's fields, instead of validating every row into a model and having
+# FastAPI serialize it again. FAST_SERIALIZATION=false restores validation.
+FAST_SERIALIZATION = os.environ.get('FAST_SERIALIZATION', 'true').lower() == 'true'
+MENU_PROJECTION = {"_id": 0, **{field: 1 for field in MenuItem.model_fields}}
+RESERVATION_PROJECTION = {"_id": 0, **{field: 1 for field in Reservation.model_fields}}
+
+def json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def dumps(value) -> bytes:
+    if orjson:
+        return orjson.dumps(value)
+    return json.dumps(value, default=json_default, ensure_ascii=False, separators=(',', ':')).encode()
+
+def serialize_list(docs: List[dict], adapter: Optional[TypeAdapter]) -> bytes:
+    # Sparse (fields=) results cannot be validated against the full model.
+    if FAST_SERIALIZATION or adapter is None:
+        return dumps(docs)
+    return adapter.dump_json(adapter.validate_python(docs))
+
+def sparse_fields(fields: Optional[str], model: Type[BaseModel], required: Tuple[str, ...]) -> Optional[Tuple[str, ...]]:
+    """Parse a ``fields=a,b`` parameter into the sorted field names to project, or None for all."""
+    if not fields:
+        return None
+    requested = {field.strip() for field in fields.split(',') if field.strip()}
+    unknown = requested - set(model.model_fields)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+    return tuple(sorted(requested | set(required)))
+
+def fields_projection(fields: Tuple[str, ...]) -> dict:
+    return {"_id": 0, **{field: 1 for field in fields}}
+
+# (categoria, sparse fields) of a cached GET /api/menu body.
+MenuKey = Tuple[Optional[str], Optional[Tuple[str, ...]]]
+
+class MenuCache:
+    """Serialized GET /api/menu bodies keyed by categoria and fields.
+
+    Every menu write bumps ``version``; a fill that started before the bump
+    is discarded instead of stored, so a slow read can never re-cache a menu
+    that a concurrent write already replaced. ``ttl`` bounds staleness on
+    workers that did not see the write themselves. Each entry also keeps
+    the body compressed in every encoding asked for so far, so it is
+    compressed once rather than per request.
+
+    Keys come from public query parameters, so at most ``max_entries``
+    are kept, least recently used first out, and a key's fill lock only
+    exists while a request is filling or waiting on it.
+    """
+
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.version = 0
+        # key -> (etag, {encoding or None: body}, stored_at)
+        self._entries: "OrderedDict[MenuKey, Tuple[str, Dict[Optional[str], bytes], float]]" = OrderedDict()
+        self._locks: Dict[MenuKey, asyncio.Lock] = {}
+
+    def get(self, key: MenuKey, encoding: Optional[str] = None) -> Optional[Tuple[str, bytes]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        etag, bodies, stored_at = entry
+        if self.ttl > 0 and time.monotonic() - stored_at > self.ttl:
+            self._entries.pop(key, None)
+            return None
+        self._entries.move_to_end(key)
+        body = bodies.get(encoding)
+        return (etag, body) if body is not None else None
+
+    def put(self, key: MenuKey, version: int, body: bytes) -> Tuple[str, bytes]:
+        etag = '"%s"' % hashlib.sha256(body).hexdigest()[:32]
+        if version == self.version:
+            self._entries[key] = (etag, {None: body}, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return etag, body
+
+    def put_encoded(self, key: MenuKey, etag: str, encoding: str, body: bytes):
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] == etag:
+            entry[1][encoding] = body
+
+    @asynccontextmanager
+    async def lock(self, key: MenuKey):
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        try:
+            async with lock:
+                yield
+        finally:
+            if not lock.locked() and self._locks.get(key) is lock:
+                del self._locks[key]
+
+    def invalidate(self):
+        self.version += 1
+        self._entries.clear()
+
+MENU_CACHE_TTL = float(os.environ.get('MENU_CACHE_TTL', '60'))
+MENU_CACHE_MAX_ENTRIES = int(os.environ.get('MENU_CACHE_MAX_ENTRIES', '64'))
+menu_caches = {
+    sucursal: MenuCache(ttl=MENU_CACHE_TTL, max_entries=MENU_CACHE_MAX_ENTRIES) for sucursal in SUCURSALES
+}
+
+menu_indexes = {sucursal: MenuSearchIndex() for sucursal in SUCURSALES}
+menu_index_locks = {sucursal: asyncio.Lock() for sucursal in SUCURSALES}
+menu_index_built_at = {sucursal: 0.0 for sucursal in SUCURSALES}
+
+async def refresh_menu_index(sucursal: str, max_age: Optional[float] = None):
+    """Rebuild the branch's search index unless a rebuild began after this call.
+
+    ``menu_index_built_at`` is when the last rebuild started reading, so
+    callers that queue up behind one rebuild share it rather than scanning
+    the menu once each, and a rebuild that began after a write has seen it.
+    With ``max_age``, any index younger than that is kept.
+    """
+    requested = time.monotonic()
+    async with menu_index_locks[sucursal]:
+        built_at = menu_index_built_at[sucursal]
+        if built_at >= requested or (max_age is not None and time.monotonic() - built_at <= max_age):
+            return
+        started = time.monotonic()
+        items = await db.menu.find({"sucursal": sucursal}, MENU_PROJECTION).to_list(None)
+        menu_indexes[sucursal].rebuild(items)
+        menu_index_built_at[sucursal] = started
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in candidates or etag in candidates
+
+RESERVATIONS_PAGE_SIZE = int(os.environ.get('RESERVATIONS_PAGE_SIZE', '50'))
+RESERVATIONS_MAX_PAGE_SIZE = int(os.environ.get('RESERVATIONS_MAX_PAGE_SIZE', '500'))
+
+# Menu pictures are stored under IMAGE_DIR by content hash and served as
+# pre-resized WebP variants; MenuItem.imagen holds the hash.
+image_store = ImageStore(
+    root=Path(os.environ.get('IMAGE_DIR', str(ROOT_DIR / 'images'))),
+    max_bytes=int(os.environ.get('IMAGE_MAX_BYTES', str(10 * 1024 * 1024))),
+    workers=int(os.environ.get('IMAGE_WORKERS', '2')),
+    quality=int(os.environ.get('IMAGE_QUALITY', '80')),
+)
+IMAGE_FETCH_TIMEOUT = float(os.environ.get('IMAGE_FETCH_TIMEOUT', '15'))
+
+def image_info(image_hash: str) -> ImageInfo:
+    return ImageInfo(hash=image_hash, variants={size: f"/api/images/{image_hash}/{size}" for size in VARIANTS})
+
+def check_menu_image(data: dict, creating: bool, prefix: str = ""):
+    if creating and not data.get("imagen") and not data.get("imagen_url"):
+        raise HTTPException(status_code=400, detail=f"{prefix}imagen or imagen_url is required")
+    if data.get("imagen") and not image_store.exists(data["imagen"]):
+        raise HTTPException(status_code=400, detail=f"{prefix}Unknown image {data['imagen']}")
+
+async def fetch_image(http: httpx.AsyncClient, url: str) -> bytes:
+    """Download ``url``, giving up once it exceeds the store's size limit."""
+    async with http.stream("GET", url) as response:
+        response.raise_for_status()
+        chunks, size = [], 0
+        async for chunk in response.aiter_bytes():
+            size += len(chunk)
+            if size > image_store.max_bytes:
+                raise InvalidImage(f"Image larger than {image_store.max_bytes} bytes")
+            chunks.append(chunk)
+    return b"".join(chunks)
+
+def encode_cursor(doc: dict) -> str:
+    created_at = doc.get('created_at')
+    if isinstance(created_at, datetime):
+        created_at = created_at.isoformat()
+    raw = json.dumps([created_at, doc.get('id')], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        created_at, res_id = json.loads(raw)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(created_at, str) or not isinstance(res_id, str):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    try:
+        return as_utc(created_at), res_id
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+MENU_BULK_MAX_OPERATIONS = int(os.environ.get('MENU_BULK_MAX_OPERATIONS', '1000'))
+
+RESERVATIONS_SORT = [("created_at", DESCENDING), ("id", DESCENDING)]
+
+# Idempotency-Key results are kept this long before the TTL index drops them.
+IDEMPOTENCY_TTL_SECONDS = int(os.environ.get('IDEMPOTENCY_TTL_SECONDS', str(24 * 3600)))
+
+COLLECTION_INDEXES = {
+    "menu": [
+        IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+        IndexModel([("sucursal", ASCENDING), ("categoria", ASCENDING)], name="sucursal_categoria"),
+    ],
+    "reservation_stats": [
+        IndexModel([("sucursal", ASCENDING), ("fecha", ASCENDING)], name="sucursal_fecha"),
+    ],
+    "idempotency_keys": [
+        IndexModel([("key", ASCENDING)], unique=True, name="key_unique"),
+        IndexModel([("created_at", ASCENDING)], expireAfterSeconds=IDEMPOTENCY_TTL_SECONDS, name="created_at_ttl"),
+    ],
+    "slot_occupancy": [
+        IndexModel([("sucursal", ASCENDING), ("fecha", ASCENDING)], name="sucursal_fecha"),
+        IndexModel([("fecha", ASCENDING)], name="fecha"),
+    ],
+    "table_plans": [
+        IndexModel([("fecha", ASCENDING)], name="fecha"),
+    ],
+    # Branch-scoped lookups lead with sucursal; the expiry sweeper and
+    # archival run across branches on the slot_at indexes.
+    "reservations": [
+        IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+        IndexModel([("sucursal", ASCENDING), ("fecha", ASCENDING), ("hora", ASCENDING), ("estado", ASCENDING)],
+                   name="sucursal_fecha_hora_estado"),
+        IndexModel([("sucursal", ASCENDING)] + RESERVATIONS_SORT, name="sucursal_created_at_id"),
+        IndexModel([("sucursal", ASCENDING), ("estado", ASCENDING)] + RESERVATIONS_SORT,
+                   name="sucursal_estado_created_at_id"),
+        IndexModel([("sucursal", ASCENDING), ("slot_at", ASCENDING)], name="sucursal_slot_at"),
+        IndexModel([("slot_at", ASCENDING)], name="slot_at"),
+        IndexModel([("estado", ASCENDING), ("slot_at", ASCENDING)], name="estado_slot_at"),
+    ],
+}
+
+# (handler, collection, filter, sort) for every lookup a handler issues.
+QUERY_SHAPES = [
+    ("get_menu", "menu", {"sucursal": DEFAULT_SUCURSAL}, None),
+    ("get_menu?categoria", "menu", {"sucursal": DEFAULT_SUCURSAL, "categoria": "Brunch"}, None),
+    ("update_menu_item", "menu", {"id": "probe", "sucursal": DEFAULT_SUCURSAL}, None),
+    ("delete_menu_item", "menu", {"id": "probe", "sucursal": DEFAULT_SUCURSAL}, None),
+    ("get_reservations", "reservations", {"sucursal": DEFAULT_SUCURSAL}, RESERVATIONS_SORT),
+    ("get_reservations?estado", "reservations", {"sucursal": DEFAULT_SUCURSAL, "estado": "pendiente"},
+     RESERVATIONS_SORT),
+    ("update_reservation", "reservations", {"id": "probe", "sucursal": DEFAULT_SUCURSAL}, None),
+    ("get_reservations?fecha", "reservations",
+     {"sucursal": DEFAULT_SUCURSAL, "slot_at": {"$gte": datetime(2000, 1, 1, tzinfo=timezone.utc)}},
+     RESERVATIONS_SORT),
+    ("get_availability", "slot_occupancy", {"sucursal": DEFAULT_SUCURSAL, "fecha": "2000-01-01"}, None),
+    ("get_reservation_stats", "reservation_stats", {"sucursal": DEFAULT_SUCURSAL}, [("fecha", ASCENDING)]),
+    ("expire_pending_reservations", "reservations",
+     {"estado": "pendiente", "slot_at": {"$lt": datetime(2000, 1, 1, tzinfo=timezone.utc)}}, None),
+    ("archive_reservations", "reservations", {"slot_at": {"$lt": datetime(2000, 1, 1, tzinfo=timezone.utc)}},
+     [("slot_at", ASCENDING)]),
+    ("archive_old_reservations", "reservations",
+     {"sucursal": DEFAULT_SUCURSAL, "slot_at": {"$lt": datetime(2000, 1, 1, tzinfo=timezone.utc)}},
+     [("slot_at", ASCENDING)]),
+]
+
+async def ensure_indexes():
+    for name, indexes in COLLECTION_INDEXES.items():
+        try:
+            await db[name].create_indexes(indexes)
+        except OperationFailure as e:
+            logger.error("Could not create indexes on %s: %s", name, e)
+
+def plan_stages(plan) -> List[str]:
+    stages = []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        for value in plan.values():
+            stages.extend(plan_stages(value))
+    elif isinstance(plan, list):
+        for value in plan:
+            stages.extend(plan_stages(value))
+    return stages
+
+async def explain_query_shapes() -> List[dict]:
+    report = []
+    for handler, collection, query, sort in QUERY_SHAPES:
+        cursor = db[collection].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        plan = (await cursor.explain()).get("queryPlanner", {}).get("winningPlan", {})
+        stages = plan_stages(plan)
+        report.append({
+            "handler": handler,
+            "collection": collection,
+            "stages": stages,
+            "collscan": "COLLSCAN" in stages,
+        })
+    return report
+
+def parse_slot_capacities(value: str) -> Dict[str, int]:
+    capacities = {}
+    for entry in value.split(','):
+        if '=' in entry:
+            hora, covers = entry.split('=', 1)
+            capacities[hora.strip()] = int(covers)
+    return capacities
+
+def default_slots() -> str:
+    return ','.join(f"{minutes // 60:02d}:{minutes % 60:02d}" for minutes in range(12 * 60, 24 * 60, 30))
+
+# Estados whose covers hold a place in their slot.
+OCCUPYING_ESTADOS = {"pendiente", "confirmada"}
+RESERVATION_SLOTS = [h.strip() for h in os.environ.get('RESERVATION_SLOTS', default_slots()).split(',') if h.strip()]
+SLOT_CAPACITY = int(os.environ.get('SLOT_CAPACITY', '40'))
+SLOT_CAPACITY_OVERRIDES = parse_slot_capacities(os.environ.get('SLOT_CAPACITY_OVERRIDES', ''))
+
+def slot_capacity(hora: str) -> int:
+    return SLOT_CAPACITY_OVERRIDES.get(hora, SLOT_CAPACITY)
+
+def slot_key(sucursal: str, fecha: str, hora: str) -> str:
+    return f"{sucursal}|{fecha}|{hora}"
+
+async def reserve_covers(sucursal: str, fecha: str, hora: str, covers: int) -> bool:
+    """Atomically add ``covers`` to a slot unless that would exceed its capacity.
+
+    The capacity check is part of the update filter, so concurrent bookings
+    cannot both pass it. A full slot makes the upsert collide with the
+    existing document; that collision is retried once without upsert to tell
+    it apart from two first bookings racing to create the counter.
+    """
+    capacity = slot_capacity(hora)
+    if covers > capacity:
+        return False
+    key = slot_key(sucursal, fecha, hora)
+    flt = {"_id": key, "ocupados": {"$lte": capacity - covers}}
+    inc = {"$inc": {"ocupados": covers}}
+    try:
+        await db.slot_occupancy.update_one(
+            flt, {**inc, "$setOnInsert": {"sucursal": sucursal, "fecha": fecha, "hora": hora}}, upsert=True
+        )
+        return True
+    except DuplicateKeyError:
+        result = await db.slot_occupancy.update_one(flt, inc)
+        return result.modified_count == 1
+
+async def release_covers(sucursal: str, fecha: str, hora: str, covers: int):
+    await db.slot_occupancy.update_one({"_id": slot_key(sucursal, fecha, hora)}, {"$inc": {"ocupados": -covers}})
+
+async def rebuild_slot_occupancy(sucursal: Optional[str] = None) -> int:
+    """Recount slot counters from the reservations, for one branch or, by default, all of them."""
+    scope = {"sucursal": sucursal} if sucursal else {}
+    pipeline = [
+        {"$match": {**scope, "estado": {"$in": sorted(OCCUPYING_ESTADOS)}}},
+        {"$group": {
+            "_id": {"sucursal": "$sucursal", "fecha": "$fecha", "hora": "$hora"},
+            "ocupados": {"$sum": "$cantidad_personas"},
+        }},
+    ]
+    rows = await db.reservations.aggregate(pipeline).to_list(None)
+    docs = [
+        {"_id": slot_key(**row["_id"]), **row["_id"], "ocupados": row["ocupados"]}
+        for row in rows
+    ]
+    if docs:
+        await db.slot_occupancy.bulk_write(
+            [ReplaceOne({"_id": doc["_id"]}, doc, upsert=True) for doc in docs], ordered=False
+        )
+    await db.slot_occupancy.delete_many({**scope, "_id": {"$nin": [doc["_id"] for doc in docs]}})
+    return len(docs)
+
+# Once a branch has saved a table layout, its confirmed reservations are
+# seated at tables for TABLE_TURN_MINUTES from their hora. Each day's
+# assignments are one table_plans document, the source of truth for the
+# mesas copied onto the reservations.
+TABLE_ESTADOS = {"confirmada"}
+TABLE_TURN_MINUTES = int(os.environ.get('TABLE_TURN_MINUTES', '90'))
+TABLE_PLAN_RETRIES = 5
+
+def table_plan_id(sucursal: str, fecha: str) -> str:
+    return f"{sucursal}|{fecha}"
+
+async def load_table_layout(sucursal: str) -> TableLayout:
+    doc = await db.table_layouts.find_one({"_id": sucursal})
+    if doc is None:
+        return TableLayout([])
+    return TableLayout(doc["mesas"], doc["combinaciones"], doc["version"])
+
+def plan_entry(doc: dict) -> Optional[dict]:
+    """A reservation as a table plan entry, or None if its hora cannot be seated."""
+    try:
+        minutes(doc["hora"])
+    except (TypeError, ValueError):
+        return None
+    return {"id": doc["id"], "hora": doc["hora"], "cantidad_personas": doc["cantidad_personas"], "mesas": []}
+
+def plan_booking(entry: dict) -> Tuple[str, int, int]:
+    return entry["id"], minutes(entry["hora"]), entry["cantidad_personas"]
+
+async def update_table_plan(sucursal: str, fecha: str, seat: List[dict], unseat: List[str],
+                            repack: bool = False) -> Tuple[Dict[str, List[str]], List[str]]:
+    """Seat the ``seat`` reservations and free the tables of ``unseat`` in one day's plan.
+
+    Returns the tables given to each seated reservation and the ids no table
+    could take. New parties are placed around those already seated; if one
+    does not fit, the whole day is packed again and that result kept only if
+    everyone seated before still has a table. A day with no plan yet, or
+    whose plan predates the branch's current layout, is packed from its
+    confirmed reservations; ``repack`` forces that.
+
+    The plan is replaced only if its version has not changed since it was
+    read, so two workers confirming parties for the same evening cannot give
+    them the same table: the loser reads the plan again and retries.
+    """
+    layout = await load_table_layout(sucursal)
+    if not layout:
+        return {}, []
+    key = table_plan_id(sucursal, fecha)
+    seat_ids = {doc["id"] for doc in seat}
+    skip = seat_ids | set(unseat)
+    for _ in range(TABLE_PLAN_RETRIES):
+        stored = await db.table_plans.find_one({"_id": key})
+        if stored is None or repack:
+            docs = await db.reservations.find(
+                {"sucursal": sucursal, "fecha": fecha, "estado": {"$in": sorted(TABLE_ESTADOS)}},
+                {"_id": 0, "id": 1, "hora": 1, "cantidad_personas": 1, "mesas": 1}
+            ).to_list(None)
+            previous = {doc["id"]: doc.get("mesas") or [] for doc in docs}
+            entries = [entry for entry in map(plan_entry, docs) if entry and entry["id"] not in skip]
+        else:
+            previous = {entry["id"]: entry["mesas"] for entry in stored["asignaciones"]}
+            entries = [entry for entry in stored["asignaciones"] if entry["id"] not in skip]
+        if stored is None or repack or stored["layout_version"] != layout.version:
+            plan, _ = pack(layout, map(plan_booking, entries), TABLE_TURN_MINUTES)
+        else:
+            plan = restore(layout, (
+                (entry["id"], minutes(entry["hora"]), entry["cantidad_personas"], entry["mesas"])
+                for entry in entries if entry["mesas"]
+            ), TABLE_TURN_MINUTES)
+
+        arrivals = [entry for entry in map(plan_entry, seat) if entry]
+        arrivals.sort(key=lambda entry: (minutes(entry["hora"]), -entry["cantidad_personas"], entry["id"]))
+        rejected = [entry["id"] for entry in arrivals if plan.place(*plan_booking(entry)) is None]
+        if rejected:
+            repacked, unseated = pack(layout, map(plan_booking, entries + arrivals), TABLE_TURN_MINUTES)
+            unseated = set(unseated)
+            if not unseated & set(plan.assignments) and not unseated >= set(rejected):
+                plan = repacked
+                rejected = [res_id for res_id in rejected if res_id in unseated]
+        arrival_ids = {entry["id"] for entry in arrivals}
+        rejected += [doc["id"] for doc in seat if doc["id"] not in arrival_ids]
+
+        asignaciones = []
+        for entry in entries + [entry for entry in arrivals if entry["id"] not in rejected]:
+            assignment = plan.assignments.get(entry["id"])
+            asignaciones.append({**entry, "mesas": list(assignment[2]) if assignment else []})
+        plan_doc = {
+            "_id": key, "sucursal": sucursal, "fecha": fecha, "layout_version": layout.version,
+            "version": stored["version"] + 1 if stored else 1, "asignaciones": asignaciones,
+        }
+        if stored is None:
+            try:
+                await db.table_plans.insert_one(plan_doc)
+            except DuplicateKeyError:
+                continue
+        else:
+            result = await db.table_plans.replace_one({"_id": key, "version": stored["version"]}, plan_doc)
+            if result.matched_count == 0:
+                continue
+
+        mesas = {entry["id"]: entry["mesas"] for entry in asignaciones}
+        updates = [UpdateOne({"id": res_id}, {"$set": {"mesas": tables}})
+                   for res_id, tables in mesas.items() if previous.get(res_id) != tables]
+        updates += [UpdateOne({"id": res_id}, {"$set": {"mesas": []}}) for res_id in unseat]
+        if updates:
+            await db.reservations.bulk_write(updates, ordered=False)
+        return {res_id: mesas[res_id] for res_id in seat_ids if res_id in mesas}, rejected
+    raise HTTPException(status_code=503, detail="Table plan is busy, try again", headers={"Retry-After": "1"})
+
+RESERVATION_FIELDS = list(Reservation.model_fields)
+EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', '500'))
+# Export rows are sent in chunks of about this many bytes: one chunk per row
+# would mean one send, and one compressor flush, per row.
+EXPORT_CHUNK_BYTES = int(os.environ.get('EXPORT_CHUNK_BYTES', str(64 * 1024)))
+
+def stats_key(value: str) -> str:
+    # Field names in the rollup documents may not contain dots or start with $.
+    return value.replace('.', ':').lstrip('$') or '_'
+
+def stats_increment(hora: str, estado: str, personas: int, sign: int) -> Dict[str, int]:
+    hora, estado = stats_key(hora), stats_key(estado)
+    return {
+        f"por_estado.{estado}.reservas": sign,
+        f"por_estado.{estado}.personas": sign * personas,
+        f"por_hora.{hora}.{estado}.reservas": sign,
+        f"por_hora.{hora}.{estado}.personas": sign * personas,
+    }
+
+def stats_id(sucursal: str, fecha: str) -> str:
+    return f"{sucursal}|{fecha}"
+
+async def apply_reservation_stats(sucursal: str, fecha: str, increment: Dict[str, int]):
+    # The rollups are derived data: a failed update is logged rather than
+    # failing the booking, and POST /api/reservations/stats/rebuild repairs it.
+    try:
+        await db.reservation_stats.update_one(
+            {"_id": stats_id(sucursal, fecha)},
+            {"$inc": increment, "$setOnInsert": {"sucursal": sucursal, "fecha": fecha}},
+            upsert=True
+        )
+    except Exception as e:
+        logger.error("Could not update reservation stats for %s %s: %s", sucursal, fecha, e)
+
+async def record_reservation_created(doc: dict):
+    increment = stats_increment(doc["hora"], doc["estado"], doc["cantidad_personas"], 1)
+    increment.update({"reservas": 1, "personas": doc["cantidad_personas"]})
+    await apply_reservation_stats(doc["sucursal"], doc["fecha"], increment)
+
+async def record_estado_change(doc: dict, old_estado: str, new_estado: str):
+    if old_estado == new_estado:
+        return
+    increment = stats_increment(doc["hora"], old_estado, doc["cantidad_personas"], -1)
+    increment.update(stats_increment(doc["hora"], new_estado, doc["cantidad_personas"], 1))
+    await apply_reservation_stats(doc["sucursal"], doc["fecha"], increment)
+
+async def rebuild_reservation_stats(sucursal: str, fecha_desde: Optional[str], fecha_hasta: Optional[str]) -> int:
+    match = reservation_filter(sucursal, None, fecha_desde, fecha_hasta)
+    pipeline = [
+        {"$match": match},
+        {"$group": {
+            "_id": {"fecha": "$fecha", "hora": "$hora", "estado": "$estado"},
+            "reservas": {"$sum": 1},
+            "personas": {"$sum": "$cantidad_personas"},
+        }},
+    ]
+    days: Dict[str, dict] = {}
+    for collection in await reservation_collections(fecha_desde, fecha_hasta):
+        async for row in collection.aggregate(pipeline):
+            fecha, hora, estado = row["_id"]["fecha"], stats_key(row["_id"]["hora"]), stats_key(row["_id"]["estado"])
+            day = days.setdefault(fecha, {"_id": stats_id(sucursal, fecha), "sucursal": sucursal, "fecha": fecha,
+                                          "reservas": 0, "personas": 0, "por_estado": {}, "por_hora": {}})
+            day["reservas"] += row["reservas"]
+            day["personas"] += row["personas"]
+            for bucket in (day["por_estado"].setdefault(estado, {"reservas": 0, "personas": 0}),
+                           day["por_hora"].setdefault(hora, {}).setdefault(estado, {"reservas": 0, "personas": 0})):
+                bucket["reservas"] += row["reservas"]
+                bucket["personas"] += row["personas"]
+    if days:
+        await db.reservation_stats.bulk_write(
+            [ReplaceOne({"_id": doc["_id"]}, doc, upsert=True) for doc in days.values()], ordered=False
+        )
+    stale = {
+        "sucursal": sucursal,
+        "_id": {"$nin": [doc["_id"] for doc in days.values()]},
+        **fecha_filter(fecha_desde, fecha_hasta),
+    }
+    await db.reservation_stats.delete_many(stale)
+    return len(days)
+
+def fecha_filter(fecha_desde: Optional[str], fecha_hasta: Optional[str]) -> dict:
+    query = {}
+    if fecha_desde or fecha_hasta:
+        query["fecha"] = {}
+        if fecha_desde:
+            query["fecha"]["$gte"] = fecha_desde
+        if fecha_hasta:
+            query["fecha"]["$lte"] = fecha_hasta
+    return query
+
+def reservation_filter(sucursal: str, estado: Optional[str], fecha_desde: Optional[str],
+                       fecha_hasta: Optional[str]) -> dict:
+    """Reservations filter; the fecha range is matched on ``slot_at`` so it can use an index."""
+    query = {"sucursal": sucursal}
+    if estado:
+        query["estado"] = estado
+    try:
+        if fecha_desde or fecha_hasta:
+            query["slot_at"] = {}
+            if fecha_desde:
+                query["slot_at"]["$gte"] = day_start(fecha_desde)
+            if fecha_hasta:
+                query["slot_at"]["$lt"] = day_end(fecha_hasta)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="fecha_desde and fecha_hasta must be YYYY-MM-DD")
+    return query
+
+def export_row(doc: dict) -> dict:
+    row = {field: doc.get(field) for field in RESERVATION_FIELDS}
+    if isinstance(row["created_at"], datetime):
+        row["created_at"] = row["created_at"].isoformat()
+    return row
+
+async def stream_reservations_ndjson(cursor):
+    chunk = bytearray()
+    async for doc in cursor:
+        chunk += dumps(export_row(doc)) + b"\n"
+        if len(chunk) >= EXPORT_CHUNK_BYTES:
+            yield bytes(chunk)
+            chunk.clear()
+    if chunk:
+        yield bytes(chunk)
+
+async def stream_reservations_csv(cursor):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=RESERVATION_FIELDS)
+    writer.writeheader()
+    async for doc in cursor:
+        row = export_row(doc)
+        row["mesas"] = "+".join(row["mesas"] or [])
+        writer.writerow(row)
+        if buffer.tell() >= EXPORT_CHUNK_BYTES:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+# Reservations dated more than ARCHIVE_AFTER_DAYS ago are moved out of the
+# hot collection into one reservations_archive_YYYY_MM collection per month.
+ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', '90'))
+ARCHIVE_BATCH_SIZE = int(os.environ.get('ARCHIVE_BATCH_SIZE', '500'))
+ARCHIVE_INTERVAL_SECONDS = float(os.environ.get('ARCHIVE_INTERVAL_SECONDS', '3600'))
+ARCHIVE_PREFIX = "reservations_archive_"
+ARCHIVE_MONTH_PATTERN = r"^\d{4}-\d{2}$"
+ARCHIVE_INDEXES = [
+    index for index in COLLECTION_INDEXES["reservations"]
+    if index.document["name"] in ("id_unique", "sucursal_created_at_id", "sucursal_estado_created_at_id",
+                                  "sucursal_slot_at")
+]
+archive_collections_ready: set = set()
+
+def archive_collection(month: str) -> str:
+    return ARCHIVE_PREFIX + month.replace("-", "_")
+
+def archive_cutoff() -> str:
+    return (date.today() - timedelta(days=ARCHIVE_AFTER_DAYS)).isoformat()
+
+async def archive_months() -> List[str]:
+    names = await db.list_collection_names()
+    return sorted(name[len(ARCHIVE_PREFIX):].replace("_", "-") for name in names if name.startswith(ARCHIVE_PREFIX))
+
+async def reservation_collections(fecha_desde: Optional[str], fecha_hasta: Optional[str]) -> list:
+    """The hot collection plus every archive month overlapping the range."""
+    collections = [db.reservations]
+    for month in await archive_months():
+        if (not fecha_desde or month >= fecha_desde[:7]) and (not fecha_hasta or month <= fecha_hasta[:7]):
+            collections.append(db[archive_collection(month)])
+    return collections
+
+async def archive_reservations(cutoff: str, sucursal: Optional[str] = None) -> int:
+    """Move reservations dated before ``cutoff`` to their archive month, in batches.
+
+    A batch is upserted into the archive before it is deleted from the hot
+    collection, so an interrupted run loses nothing and the next run simply
+    repeats the upserts. ``sucursal`` limits the run to one branch.
+    """
+    moved = 0
+    scope = {"sucursal": sucursal} if sucursal else {}
+    before_cutoff = {**scope, "slot_at": {"$lt": day_start(cutoff)}}
+    while True:
+        batch = await db.reservations.find(before_cutoff, {"_id": 0}).sort(
+            "slot_at", ASCENDING
+        ).limit(ARCHIVE_BATCH_SIZE).to_list(ARCHIVE_BATCH_SIZE)
+        if not batch:
+            break
+        by_month: Dict[str, List[dict]] = {}
+        for doc in batch:
+            by_month.setdefault(doc["fecha"][:7], []).append(doc)
+        for month, docs in by_month.items():
+            name = archive_collection(month)
+            if name not in archive_collections_ready:
+                await db[name].create_indexes(ARCHIVE_INDEXES)
+                archive_collections_ready.add(name)
+            await db[name].bulk_write([ReplaceOne({"id": doc["id"]}, doc, upsert=True) for doc in docs], ordered=False)
+        await db.reservations.delete_many({"id": {"$in": [doc["id"] for doc in batch]}, **before_cutoff})
+        moved += len(batch)
+        if len(batch) < ARCHIVE_BATCH_SIZE:
+            break
+    # Past slots can no longer be booked; their counters and table plans
+    # only take memory.
+    await db.slot_occupancy.delete_many({**scope, "fecha": {"$lt": cutoff}})
+    await db.table_plans.delete_many({**scope, "fecha": {"$lt": cutoff}})
+    return moved
+
+async def run_archival():
+    while True:
+        try:
+            moved = await archive_reservations(archive_cutoff())
+            if moved:
+                logger.info("Archived %d reservations", moved)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error("Reservation archival failed: %s", e)
+        await asyncio.sleep(ARCHIVE_INTERVAL_SECONDS)
+
+class GroupCommitQueue:
+    """Coalesces concurrent inserts into one collection into insert_many batches.
+
+    A batch is flushed once it reaches ``max_batch`` documents or ``max_wait``
+    seconds after its first document was queued, whichever comes first. Each
+    caller's ``insert`` returns only after its own document was acknowledged,
+    and raises that document's write error if it failed.
+    """
+
+    def __init__(self, collection: str, max_batch: int, max_wait: float):
+        self.collection = collection
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._pending: List[Tuple[dict, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._flushes: set = set()
+
+    async def insert(self, doc: dict):
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((doc, future))
+        if len(self._pending) >= self.max_batch:
+            self._flush_pending()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.max_wait, self._flush_pending)
+        await future
+
+    def _flush_pending(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.create_task(self._write(batch))
+            self._flushes.add(task)
+            task.add_done_callback(self._flushes.discard)
+
+    async def _write(self, batch: List[Tuple[dict, asyncio.Future]]):
+        errors = {}
+        try:
+            await db[self.collection].insert_many([doc for doc, _ in batch], ordered=False)
+        except BulkWriteError as e:
+            for error in e.details.get("writeErrors", []):
+                if error.get("code") == 11000:
+                    errors[error["index"]] = DuplicateKeyError(error["errmsg"], error["code"])
+                else:
+                    errors[error["index"]] = OperationFailure(error["errmsg"], error.get("code"))
+            # A write concern error means the batch was not confirmed durable,
+            # so no caller in it may report success.
+            if e.details.get("writeConcernErrors"):
+                errors = {i: e for i in range(len(batch))}
+        except Exception as e:
+            errors = {i: e for i in range(len(batch))}
+        for index, (_, future) in enumerate(batch):
+            if future.done():
+                continue
+            if index in errors:
+                future.set_exception(errors[index])
+            else:
+                future.set_result(None)
+
+    async def drain(self):
+        self._flush_pending()
+        if self._flushes:
+            await asyncio.gather(*self._flushes, return_exceptions=True)
+
+reservation_queue = GroupCommitQueue(
+    "reservations",
+    max_batch=int(os.environ.get('RESERVATION_BATCH_SIZE', '100')),
+    max_wait=float(os.environ.get('RESERVATION_BATCH_WAIT_MS', '5')) / 1000,
+) if os.environ.get('RESERVATION_GROUP_COMMIT', 'false').lower() == 'true' else None
+
+async def insert_reservation(doc: dict):
+    if reservation_queue:
+        await reservation_queue.insert(doc)
+    else:
+        await db.reservations.insert_one(doc)
+
+# A claim still pending after this long belongs to a worker that died
+# mid-request and may be taken over by a retry.
+IDEMPOTENCY_CLAIM_SECONDS = float(os.environ.get('IDEMPOTENCY_CLAIM_SECONDS', '30'))
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+
+class IdempotencyCache:
+    """LRU of completed ``Idempotency-Key`` results: key -> (fingerprint, doc).
+
+    Retries usually land on the worker that served the first attempt, so
+    most replays are answered here without a round trip to
+    ``idempotency_keys``. ``locks`` collapse concurrent duplicates within the
+    worker; the unique index on the collection does it across workers.
+    """
+
+    def __init__(self, max_keys: int, ttl: float):
+        self.max_keys = max_keys
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[str, dict, float]]" = OrderedDict()
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    def get(self, key: str) -> Optional[Tuple[str, dict]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        fingerprint, doc, stored_at = entry
+        if time.monotonic() - stored_at > self.ttl:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return fingerprint, doc
+
+    def put(self, key: str, fingerprint: str, doc: dict):
+        self._entries[key] = (fingerprint, doc, time.monotonic())
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.max_keys:
+            self._entries.popitem(last=False)
+
+    @asynccontextmanager
+    async def lock(self, key: str):
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        try:
+            async with lock:
+                yield
+        finally:
+            if not lock.locked() and self._locks.get(key) is lock:
+                del self._locks[key]
+
+idempotency_cache = IdempotencyCache(
+    max_keys=int(os.environ.get('IDEMPOTENCY_CACHE_SIZE', '1000')),
+    ttl=IDEMPOTENCY_TTL_SECONDS,
+)
+
+def request_fingerprint(payload: BaseModel) -> str:
+    return hashlib.sha256(payload.model_dump_json().encode()).hexdigest()
+
+def idempotent_replay(key: str, fingerprint: str, stored_fingerprint: str, doc: dict) -> dict:
+    if stored_fingerprint != fingerprint:
+        raise HTTPException(status_code=422, detail="Idempotency-Key was already used with a different request body")
+    idempotency_cache.put(key, fingerprint, doc)
+    return doc
+
+async def claim_idempotency_key(key: str, fingerprint: str) -> Optional[dict]:
+    """Claim ``key`` for this request, or return the stored result of an earlier one.
+
+    Raises 409 while another worker still holds a live claim on the key.
+    """
+    now = datetime.now(timezone.utc)
+    try:
+        await db.idempotency_keys.insert_one({
+            "key": key, "fingerprint": fingerprint, "estado": "pending", "created_at": now,
+        })
+        return None
+    except DuplicateKeyError:
+        pass
+    existing = await db.idempotency_keys.find_one({"key": key}, {"_id": 0})
+    if existing is None:
+        # Expired between the insert and the lookup; the retry will claim it.
+        raise HTTPException(status_code=409, detail="Request with this Idempotency-Key is in progress",
+                            headers={"Retry-After": "1"})
+    if existing["estado"] == "done":
+        return idempotent_replay(key, fingerprint, existing["fingerprint"], existing["response"])
+    stale = now - timedelta(seconds=IDEMPOTENCY_CLAIM_SECONDS)
+    taken_over = await db.idempotency_keys.update_one(
+        {"key": key, "estado": "pending", "created_at": {"$lt": stale}},
+        {"$set": {"fingerprint": fingerprint, "created_at": now}}
+    )
+    if taken_over.modified_count:
+        return None
+    raise HTTPException(status_code=409, detail="Request with this Idempotency-Key is in progress",
+                        headers={"Retry-After": "1"})
+
+async def complete_idempotency_key(key: str, fingerprint: str, doc: dict):
+    await db.idempotency_keys.update_one(
+        {"key": key},
+        {"$set": {"estado": "done", "response": doc, "created_at": datetime.now(timezone.utc)}}
+    )
+    idempotency_cache.put(key, fingerprint, doc)
+
+async def release_idempotency_key(key: str):
+    await db.idempotency_keys.delete_one({"key": key, "estado": "pending"})
+
+class TokenBucketLimiter:
+    """Per-key token buckets refilled at ``rate`` tokens/second up to ``burst``.
+
+    Buckets are kept in LRU order and the least recently used ones are
+    dropped past ``max_keys``, so a scan from many addresses cannot grow
+    memory without bound.
+    """
+
+    def __init__(self, rate: float, burst: int, max_keys: int = 10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+
+    def acquire(self, key: str) -> float:
+        """Take one token for ``key``; return 0 or the seconds until one is available."""
+        now = time.monotonic()
+        tokens, updated = self._buckets.pop(key, (float(self.burst), now))
+        tokens = min(float(self.burst), tokens + (now - updated) * self.rate)
+        retry_after = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            retry_after = (1 - tokens) / self.rate
+        self._buckets[key] = (tokens, now)
+        if len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return retry_after
+
+def rate_limiter(setting: str, default: str) -> Optional[TokenBucketLimiter]:
+    """Build a limiter from a ``<requests>/<seconds>`` setting; ``0`` disables it."""
+    value = os.environ.get(setting, default)
+    if value in ('', '0'):
+        return None
+    count, seconds = value.split('/')
+    return TokenBucketLimiter(rate=int(count) / float(seconds), burst=int(count))
+
+RATE_LIMITERS = {
+    "menu": rate_limiter('RATE_LIMIT_MENU', '120/60'),
+    "reservations": rate_limiter('RATE_LIMIT_RESERVATIONS', '10/60'),
+    "menu_search": rate_limiter('RATE_LIMIT_MENU_SEARCH', '120/60'),
+    "seed": rate_limiter('RATE_LIMIT_SEED', '5/60'),
+}
+# Requests from these networks are taken to come through our own ingress,
+# which appends the address it saw to X-Forwarded-For. Rate limits key on
+# the right-most address in that header outside these networks, so clients
+# behind the ingress are not all counted as the ingress itself, and a
+# client cannot dodge its limit by sending a forged header.
+TRUSTED_PROXIES = [
+    ipaddress.ip_network(network.strip())
+    for network in os.environ.get(
+        'TRUSTED_PROXIES', '127.0.0.0/8,::1/128,10.0.0.0/8,172.16.0.0/12,192.168.0.0/16,fc00::/7'
+    ).split(',')
+    if network.strip()
+]
+
+def is_trusted_proxy(host: str) -> bool:
+    try:
+        address = ipaddress.ip_address(host)
+    except ValueError:
+        return False
+    return any(address in network for network in TRUSTED_PROXIES)
+
+def client_address(request: Request) -> str:
+    host = request.client.host if request.client else "unknown"
+    if not is_trusted_proxy(host):
+        return host
+    hops = [hop.strip() for hop in request.headers.get("x-forwarded-for", "").split(",") if hop.strip()]
+    for hop in reversed(hops):
+        if not is_trusted_proxy(hop):
+            return hop
+    return hops[0] if hops else host
+
+# Public requests allowed in flight at once. Kept below the Motor pool size
+# so admin routes, which are not capped, always find a free connection.
+MAX_PUBLIC_CONCURRENCY = int(os.environ.get('MAX_PUBLIC_CONCURRENCY', '64'))
+public_in_flight = 0
+
+def public_endpoint(route: str):
+    limiter = RATE_LIMITERS[route]
+
+    async def admission_control(request: Request):
+        global public_in_flight
+        if limiter:
+            retry_after = limiter.acquire(client_address(request))
+            if retry_after:
+                raise HTTPException(
+                    status_code=429,
+                    detail="Too many requests",
+                    headers={"Retry-After": str(math.ceil(retry_after))}
+                )
+        if MAX_PUBLIC_CONCURRENCY and public_in_flight >= MAX_PUBLIC_CONCURRENCY:
+            raise HTTPException(status_code=503, detail="Server busy", headers={"Retry-After": "1"})
+        public_in_flight += 1
+        try:
+            yield
+        finally:
+            public_in_flight -= 1
+
+    return Depends(admission_control)
+
+class EventBroker:
+    """Fans reservation events out to the connected admin dashboards.
+
+    Each subscriber gets a bounded queue. A subscriber that falls behind has
+    its queue replaced by a single ``resync`` event, telling the dashboard to
+    refetch, instead of making publishers wait on it.
+    """
+
+    def __init__(self, queue_size: int):
+        self.queue_size = queue_size
+        self._subscribers: set = set()
+
+    def subscribe(self) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self._subscribers.discard(queue)
+
+    def publish(self, event: dict):
+        for queue in self._subscribers:
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait({"type": "resync"})
+
+EVENTS_QUEUE_SIZE = int(os.environ.get('EVENTS_QUEUE_SIZE', '100'))
+reservation_events = {sucursal: EventBroker(queue_size=EVENTS_QUEUE_SIZE) for sucursal in SUCURSALES}
+# "handlers" publishes from this worker's write handlers; "change_stream"
+# tails a Mongo change stream instead, so every worker sees every write
+# (requires a replica set).
+RESERVATION_EVENTS_SOURCE = os.environ.get('RESERVATION_EVENTS_SOURCE', 'handlers')
+EVENTS_KEEPALIVE_SECONDS = float(os.environ.get('EVENTS_KEEPALIVE_SECONDS', '15'))
+
+def reservation_event(event_type: str, reservation: dict) -> dict:
+    reservation = {field: reservation.get(field) for field in RESERVATION_FIELDS}
+    if isinstance(reservation["created_at"], datetime):
+        reservation["created_at"] = reservation["created_at"].isoformat()
+    return {"type": event_type, "reservation": reservation}
+
+def broadcast_reservation_event(event_type: str, reservation: dict):
+    broker = reservation_events.get(reservation.get("sucursal"))
+    if broker:
+        broker.publish(reservation_event(event_type, reservation))
+
+def publish_reservation_event(event_type: str, reservation: dict):
+    if RESERVATION_EVENTS_SOURCE == "handlers":
+        broadcast_reservation_event(event_type, reservation)
+
+async def watch_reservation_changes():
+    pipeline = [{"$match": {"operationType": {"$in": ["insert", "update", "replace"]}}}]
+    while True:
+        try:
+            async with db.reservations.watch(pipeline, full_document="updateLookup") as stream:
+                async for change in stream:
+                    document = change.get("fullDocument")
+                    if document:
+                        event_type = "created" if change["operationType"] == "insert" else "updated"
+                        broadcast_reservation_event(event_type, document)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error("Reservation change stream failed, retrying: %s", e)
+            for broker in reservation_events.values():
+                broker.publish({"type": "resync"})
+            await asyncio.sleep(5)
+
+async def stream_reservation_events(broker: EventBroker, queue: asyncio.Queue):
+    try:
+        yield "retry: 3000\n\n"
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), timeout=EVENTS_KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            yield f"event: {event['type']}\ndata: {dumps(event).decode()}\n\n"
+    finally:
+        broker.unsubscribe(queue)
+
+RESERVATION_BULK_MAX_IDS = int(os.environ.get('RESERVATION_BULK_MAX_IDS', '1000'))
+RESERVATION_BULK_BATCH_SIZE = int(os.environ.get('RESERVATION_BULK_BATCH_SIZE', '500'))
+# Pending reservations still unconfirmed this long after their slot started
+# are moved to EXPIRED_ESTADO by the sweeper, every EXPIRY_INTERVAL_SECONDS.
+EXPIRED_ESTADO = "expirada"
+EXPIRY_GRACE_MINUTES = float(os.environ.get('EXPIRY_GRACE_MINUTES', '120'))
+EXPIRY_INTERVAL_SECONDS = float(os.environ.get('EXPIRY_INTERVAL_SECONDS', '300'))
+
+async def transition_batch(query: dict, estado: str, limit: int) -> Tuple[List[dict], List[str], int]:
+    """Move up to ``limit`` reservations matching ``query`` to ``estado``.
+
+    Returns the reservations that changed, the ids left alone because their
+    slot or the table plan had no room for them, and how many matching
+    reservations were read. Slot counters, table plans, daily stats and
+    events are updated once per batch rather than once per reservation.
+    """
+    # $and rather than a merged dict: query may pin estado itself.
+    docs = await db.reservations.find(
+        {"$and": [query, {"estado": {"$ne": estado}}]}, {"_id": 0}
+    ).limit(limit).to_list(limit)
+    now_occupying = estado in OCCUPYING_ESTADOS
+    sin_cupo, by_estado = [], {}
+    for doc in docs:
+        if now_occupying and doc["estado"] not in OCCUPYING_ESTADOS:
+            if not await reserve_covers(doc["sucursal"], doc["fecha"], doc["hora"], doc["cantidad_personas"]):
+                sin_cupo.append(doc["id"])
+                continue
+        by_estado.setdefault(doc["estado"], []).append(doc)
+
+    seating = estado in TABLE_ESTADOS
+    if seating:
+        by_day: Dict[Tuple[str, str], List[dict]] = {}
+        for group in by_estado.values():
+            for doc in group:
+                by_day.setdefault((doc["sucursal"], doc["fecha"]), []).append(doc)
+        no_table, placed = set(), {}
+        try:
+            for (sucursal, fecha), day_docs in by_day.items():
+                seated, rejected = await update_table_plan(sucursal, fecha, day_docs, [])
+                placed[(sucursal, fecha)] = list(seated)
+                no_table.update(rejected)
+                for doc in day_docs:
+                    doc["mesas"] = seated.get(doc["id"], [])
+        except Exception:
+            # Nothing has changed estado yet: free the tables taken for the
+            # days already seated and the covers reserved above.
+            for (sucursal, fecha), ids in placed.items():
+                if ids:
+                    await update_table_plan(sucursal, fecha, [], ids)
+            if now_occupying:
+                for old_estado, group in by_estado.items():
+                    if old_estado not in OCCUPYING_ESTADOS:
+                        for doc in group:
+                            await release_covers(doc["sucursal"], doc["fecha"], doc["hora"], doc["cantidad_personas"])
+            raise
+        if no_table:
+            for old_estado, group in by_estado.items():
+                for doc in group:
+                    if doc["id"] in no_table:
+                        sin_cupo.append(doc["id"])
+                        if now_occupying and old_estado not in OCCUPYING_ESTADOS:
+                            await release_covers(doc["sucursal"], doc["fecha"], doc["hora"], doc["cantidad_personas"])
+                by_estado[old_estado] = [doc for doc in group if doc["id"] not in no_table]
+
+    changed, released, stats, unseat = [], {}, {}, {}
+    for old_estado, group in by_estado.items():
+        # The operation id tells apart the reservations this call moved from
+        # ones a concurrent request moved first, so each transition is
+        # counted exactly once.
+        operation = str(uuid.uuid4())
+        result = await db.reservations.update_many(
+            {"id": {"$in": [doc["id"] for doc in group]}, "estado": old_estado},
+            {"$set": {"estado": estado, "estado_op": operation}}
+        )
+        if result.modified_count != len(group):
+            moved = {doc["id"] for doc in await db.reservations.find(
+                {"id": {"$in": [doc["id"] for doc in group]}, "estado_op": operation}, {"_id": 0, "id": 1}
+            ).to_list(None)}
+            for doc in group:
+                if doc["id"] not in moved and now_occupying and old_estado not in OCCUPYING_ESTADOS:
+                    await release_covers(doc["sucursal"], doc["fecha"], doc["hora"], doc["cantidad_personas"])
+            lost = [doc["id"] for doc in group if doc["id"] not in moved]
+            if seating and lost:
+                # Tables were taken for these; give them back unless the
+                # request that moved them first also confirmed them.
+                confirmed = {doc["id"] for doc in await db.reservations.find(
+                    {"id": {"$in": lost}, "estado": {"$in": sorted(TABLE_ESTADOS)}}, {"_id": 0, "id": 1}
+                ).to_list(None)}
+                for doc in group:
+                    if doc["id"] in lost and doc["id"] not in confirmed:
+                        unseat.setdefault((doc["sucursal"], doc["fecha"]), []).append(doc["id"])
+            group = [doc for doc in group if doc["id"] in moved]
+        for doc in group:
+            if old_estado in TABLE_ESTADOS and not seating:
+                unseat.setdefault((doc["sucursal"], doc["fecha"]), []).append(doc["id"])
+                doc["mesas"] = []
+            if old_estado in OCCUPYING_ESTADOS and not now_occupying:
+                slot = (doc["sucursal"], doc["fecha"], doc["hora"])
+                released[slot] = released.get(slot, 0) + doc["cantidad_personas"]
+            increment = stats.setdefault((doc["sucursal"], doc["fecha"]), {})
+            for sign, counted_estado in ((-1, old_estado), (1, estado)):
+                for field, value in stats_increment(doc["hora"], counted_estado, doc["cantidad_personas"], sign).items():
+                    increment[field] = increment.get(field, 0) + value
+            doc["estado"] = estado
+            changed.append(doc)
+    for (sucursal, fecha, hora), covers in released.items():
+        await release_covers(sucursal, fecha, hora, covers)
+    for (sucursal, fecha), ids in unseat.items():
+        await update_table_plan(sucursal, fecha, [], ids)
+    for (sucursal, fecha), increment in stats.items():
+        await apply_reservation_stats(sucursal, fecha, increment)
+    for doc in changed:
+        publish_reservation_event("updated", doc)
+    return changed, sin_cupo, len(docs)
+
+async def transition_reservations(query: dict, estado: str) -> Tuple[int, List[str]]:
+    modified, sin_cupo = 0, []
+    while True:
+        batch_query = {"$and": [query, {"id": {"$nin": sin_cupo}}]} if sin_cupo else query
+        changed, skipped, read = await transition_batch(batch_query, estado, RESERVATION_BULK_BATCH_SIZE)
+        modified += len(changed)
+        sin_cupo.extend(skipped)
+        if read < RESERVATION_BULK_BATCH_SIZE:
+            return modified, sin_cupo
+
+async def expire_pending_reservations() -> int:
+    cutoff = datetime.now(timezone.utc) - timedelta(minutes=EXPIRY_GRACE_MINUTES)
+    modified, _ = await transition_reservations({"estado": "pendiente", "slot_at": {"$lt": cutoff}}, EXPIRED_ESTADO)
+    return modified
+
+async def run_expiry_sweeper():
+    while True:
+        try:
+            expired = await expire_pending_reservations()
+            if expired:
+                logger.info("Expired %d pending reservations", expired)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error("Reservation expiry sweep failed: %s", e)
+        await asyncio.sleep(EXPIRY_INTERVAL_SECONDS)
+
+class ReadinessProbe:
+    """Caches the result of a Mongo ping for ``ttl`` seconds.
+
+    Orchestrators poll readiness often; the cache keeps those polls from
+    adding a round trip each, and the lock keeps concurrent polls down to a
+    single ping.
+    """
+
+    def __init__(self, ttl: float, timeout: float):
+        self.ttl = ttl
+        self.timeout = timeout
+        self.warmed_up = False
+        self._ok = False
+        self._error: Optional[str] = None
+        self._checked_at = 0.0
+        self._lock = asyncio.Lock()
+
+    async def check(self) -> Tuple[bool, Optional[str]]:
+        if not self.warmed_up:
+            return False, "starting"
+        async with self._lock:
+            if time.monotonic() - self._checked_at > self.ttl:
+                try:
+                    await asyncio.wait_for(db.command("ping"), timeout=self.timeout)
+                    self._ok, self._error = True, None
+                except Exception as e:
+                    self._ok, self._error = False, str(e) or type(e).__name__
+                self._checked_at = time.monotonic()
+        return self._ok, self._error
+
+readiness = ReadinessProbe(
+    ttl=float(os.environ.get('READINESS_CACHE_SECONDS', '2')),
+    timeout=float(os.environ.get('READINESS_TIMEOUT_SECONDS', '1')),
+)
 
 def hash_password(password: str) -> str:
     return hashlib.sha256(password.encode()).hexdigest()
 
-def verify_admin_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
-    admin_token = "admin_la_calandria_2024"
-    if credentials.credentials != admin_token:
+def parse_admin_credentials(value: str) -> Dict[str, Tuple[str, str]]:
+    """``username:sucursal:sha256(password)`` entries -> {username: (sucursal, password hash)}."""
+    credentials = {}
+    for entry in value.split(','):
+        if not entry.strip():
+            continue
+        username, sucursal, password_hash = entry.strip().split(':')
+        if sucursal not in SUCURSALES:
+            raise ValueError(f"ADMIN_CREDENTIALS: {username} belongs to unknown sucursal {sucursal}")
+        credentials[username] = (sucursal, password_hash)
+    return credentials
+
+# Each admin login manages a single branch.
+ADMIN_CREDENTIALS = parse_admin_credentials(
+    os.environ.get('ADMIN_CREDENTIALS', f"admin:{DEFAULT_SUCURSAL}:{hash_password('calandria2024')}")
+)
+# Required, like MONGO_URL: anyone who knows the secret can mint admin
+# tokens, so it must not have a default in the source.
+ADMIN_TOKEN_SECRET = os.environ['ADMIN_TOKEN_SECRET']
+
+def admin_token(username: str, sucursal: str) -> str:
+    return hmac.new(ADMIN_TOKEN_SECRET.encode(), f"{username}:{sucursal}".encode(), hashlib.sha256).hexdigest()
+
+# token -> sucursal of the admin it was issued to.
+ADMIN_TOKENS = {admin_token(username, sucursal): sucursal for username, (sucursal, _) in ADMIN_CREDENTIALS.items()}
+
+def verify_admin_token(credentials: HTTPAuthorizationCredentials = Depends(security)) -> str:
+    sucursal = ADMIN_TOKENS.get(credentials.credentials)
+    if sucursal is None:
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    return sucursal
+
+# EventSource cannot send an Authorization header, so the events stream
+# takes a ticket in its query string instead of the admin token. URLs end up
+# in proxy and access logs; a ticket only opens the stream of one branch and
+# expires after EVENTS_TICKET_SECONDS, while the admin token never does.
+EVENTS_TICKET_SECONDS = int(os.environ.get('EVENTS_TICKET_SECONDS', '60'))
+
+def events_ticket_signature(sucursal: str, expires: int) -> str:
+    return hmac.new(ADMIN_TOKEN_SECRET.encode(), f"events:{sucursal}:{expires}".encode(), hashlib.sha256).hexdigest()
+
+def events_ticket(sucursal: str) -> str:
+    expires = int(time.time()) + EVENTS_TICKET_SECONDS
+    return f"{sucursal}:{expires}:{events_ticket_signature(sucursal, expires)}"
+
+def verify_events_ticket(ticket: str = Query(...)) -> str:
+    parts = ticket.rsplit(":", 2)
+    if len(parts) != 3 or not parts[1].isdigit():
         raise HTTPException(status_code=401, detail="Invalid credentials")
-    return credentials.credentials
+    sucursal, expires, signature = parts[0], int(parts[1]), parts[2]
+    if (
+        sucursal not in reservation_events
+        or expires < time.time()
+        or not hmac.compare_digest(signature, events_ticket_signature(sucursal, expires))
+    ):
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    return sucursal
+
+def is_admin_authorization(authorization: Optional[str]) -> bool:
+    scheme, _, token = (authorization or "").partition(" ")
+    return scheme.lower() == "bearer" and token in ADMIN_TOKENS
+
+def current_sucursal(sucursal: Optional[str] = Query(None)) -> str:
+    if sucursal is None:
+        return DEFAULT_SUCURSAL
+    if sucursal not in SUCURSALES:
+        raise HTTPException(status_code=404, detail="Unknown sucursal")
+    return sucursal
 
 @api_router.post("/admin/login", response_model=AdminToken)
 async def admin_login(login: AdminLogin):
-    if login.username == "admin" and login.password == "calandria2024":
-        return AdminToken(token="admin_la_calandria_2024", username="admin")
+    entry = ADMIN_CREDENTIALS.get(login.username)
+    if entry and hmac.compare_digest(entry[1], hash_password(login.password)):
+        sucursal = entry[0]
+        return AdminToken(token=admin_token(login.username, sucursal), username=login.username, sucursal=sucursal)
     raise HTTPException(status_code=401, detail="Invalid credentials")
 
-@api_router.get("/menu", response_model=List[MenuItem])
-async def get_menu(categoria: Optional[str] = None):
-    query = {}
-    if categoria and categoria != "Todos":
-        query["categoria"] = categoria
-    menu_items = await db.menu.find(query, {"_id": 0}).to_list(1000)
-    return menu_items
+async def load_menu_body(sucursal: str, key: MenuKey, encoding: Optional[str]) -> Tuple[str, bytes]:
+    """The menu body for ``key``, encoded with ``encoding``, and the ETag of its identity body."""
+    menu_cache = menu_caches[sucursal]
+    cached = menu_cache.get(key, encoding)
+    if cached:
+        return cached
+    async with menu_cache.lock(key):
+        cached = menu_cache.get(key, encoding)
+        if cached:
+            return cached
+        identity = menu_cache.get(key)
+        if identity is None:
+            version = menu_cache.version
+            categoria, fields = key
+            query = {"sucursal": sucursal, "categoria": categoria} if categoria else {"sucursal": sucursal}
+            projection = fields_projection(fields) if fields else MENU_PROJECTION
+            menu_items = await db.menu.find(query, projection).to_list(1000)
+            identity = menu_cache.put(
+                key, version, serialize_list(menu_items, None if fields else menu_list_adapter)
+            )
+        if encoding is None:
+            return identity
+        etag, body = identity
+        encoded = await asyncio.to_thread(compress, body, encoding, True)
+        menu_cache.put_encoded(key, etag, encoding, encoded)
+        return etag, encoded
+
+@api_router.get("/menu", response_model=List[MenuItem], dependencies=[public_endpoint("menu")])
+async def get_menu(
+    request: Request,
+    categoria: Optional[str] = None,
+    fields: Optional[str] = None,
+    sucursal: str = Depends(current_sucursal)
+):
+    key = (categoria if categoria and categoria != "Todos" else None, sparse_fields(fields, MenuItem, ("id",)))
+    encoding = negotiate(request.headers.get("accept-encoding")) if COMPRESSION_ENABLED else None
+    etag, body = await load_menu_body(sucursal, key, encoding)
+    if encoding:
+        # Each encoding is a distinct representation and needs its own ETag.
+        etag = f'{etag[:-1]}-{encoding}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type="application/json", headers=headers)
+
+@api_router.get("/menu/search", response_model=List[MenuItem], dependencies=[public_endpoint("menu_search")])
+async def search_menu(
+    q: str = Query(..., min_length=1, max_length=100),
+    sin_tacc: Optional[bool] = None,
+    destacado: Optional[bool] = None,
+    limit: int = Query(20, ge=1, le=100),
+    sucursal: str = Depends(current_sucursal)
+):
+    # Writes on this worker update the index in place; the periodic rebuild
+    # picks up writes handled by other workers.
+    if MENU_CACHE_TTL > 0 and time.monotonic() - menu_index_built_at[sucursal] > MENU_CACHE_TTL:
+        await refresh_menu_index(sucursal, max_age=MENU_CACHE_TTL)
+    results = menu_indexes[sucursal].search(q, sin_tacc=sin_tacc, destacado=destacado, limit=limit)
+    return Response(content=dumps(results), media_type="application/json")
 
 @api_router.post("/menu", response_model=MenuItem)
-async def create_menu_item(item: MenuItemCreate, token: str = Depends(verify_admin_token)):
-    menu_item = MenuItem(**item.model_dump())
+async def create_menu_item(item: MenuItemCreate, sucursal: str = Depends(verify_admin_token)):
+    check_menu_image(item.model_dump(), creating=True)
+    menu_item = MenuItem(**item.model_dump(), sucursal=sucursal)
     doc = menu_item.model_dump()
     await db.menu.insert_one(doc)
+    menu_caches[sucursal].invalidate()
+    menu_indexes[sucursal].add(menu_item.model_dump())
     return menu_item
 
+@api_router.post("/menu/bulk", response_model=MenuBulkResponse)
+async def bulk_menu_write(batch: MenuBulkRequest, sucursal: str = Depends(verify_admin_token)):
+    if not batch.operations:
+        raise HTTPException(status_code=400, detail="No operations")
+    if len(batch.operations) > MENU_BULK_MAX_OPERATIONS:
+        raise HTTPException(status_code=400, detail=f"At most {MENU_BULK_MAX_OPERATIONS} operations per batch")
+    
+    # bulk_write only reports totals, so look up the targeted ids once to
+    # report a not_found status for each update and delete.
+    target_ids = [op.id for op in batch.operations if op.op != "create"]
+    existing = set()
+    if target_ids:
+        docs = await db.menu.find(
+            {"id": {"$in": target_ids}, "sucursal": sucursal}, {"_id": 0, "id": 1}
+        ).to_list(None)
+        existing = {doc["id"] for doc in docs}
+    
+    requests, results = [], []
+    for index, operation in enumerate(batch.operations):
+        if operation.op == "create":
+            check_menu_image(operation.item.model_dump(), creating=True, prefix=f"Operation {index}: ")
+            menu_item = MenuItem(**operation.item.model_dump(), sucursal=sucursal)
+            requests.append(InsertOne(menu_item.model_dump()))
+            results.append(MenuBulkResult(index=index, op="create", id=menu_item.id, status="ok"))
+            continue
+        if operation.op == "update":
+            update_data = {k: v for k, v in operation.item.model_dump().items() if v is not None}
+            if not update_data:
+                raise HTTPException(status_code=400, detail=f"Operation {index}: No data to update")
+            check_menu_image(update_data, creating=False, prefix=f"Operation {index}: ")
+            requests.append(UpdateOne({"id": operation.id, "sucursal": sucursal}, {"$set": update_data}))
+        else:
+            requests.append(DeleteOne({"id": operation.id, "sucursal": sucursal}))
+        status = "ok" if operation.id in existing else "not_found"
+        if operation.op == "delete":
+            existing.discard(operation.id)
+        results.append(MenuBulkResult(index=index, op=operation.op, id=operation.id, status=status))
+    
+    try:
+        details = (await db.menu.bulk_write(requests, ordered=batch.ordered)).bulk_api_result
+    except BulkWriteError as e:
+        details = e.details
+        failed = {error["index"]: error["errmsg"] for error in details.get("writeErrors", [])}
+        for index, message in failed.items():
+            results[index].status = "error"
+            results[index].error = message
+        if batch.ordered and failed:
+            for result in results[min(failed) + 1:]:
+                result.status = "skipped"
+    
+    menu_caches[sucursal].invalidate()
+    await refresh_menu_index(sucursal)
+    return MenuBulkResponse(
+        inserted=details["nInserted"],
+        modified=details["nModified"],
+        deleted=details["nRemoved"],
+        results=results
+    )
+
 @api_router.put("/menu/{item_id}", response_model=MenuItem)
-async def update_menu_item(item_id: str, item: MenuItemUpdate, token: str = Depends(verify_admin_token)):
+async def update_menu_item(item_id: str, item: MenuItemUpdate, sucursal: str = Depends(verify_admin_token)):
     update_data = {k: v for k, v in item.model_dump().items() if v is not None}
     if not update_data:
         raise HTTPException(status_code=400, detail="No data to update")
+    check_menu_image(update_data, creating=False)
     
     result = await db.menu.find_one_and_update(
-        {"id": item_id},
+        {"id": item_id, "sucursal": sucursal},
         {"$set": update_data},
         return_document=True
     )
@@ -126,51 +1717,424 @@ async def update_menu_item(item_id: str, item: MenuItemUpdate, token: str = Depe
     if not result:
         raise HTTPException(status_code=404, detail="Menu item not found")
     
+    menu_caches[sucursal].invalidate()
     result.pop("_id", None)
-    return MenuItem(**result)
+    menu_item = MenuItem(**result)
+    menu_indexes[sucursal].add(menu_item.model_dump())
+    return menu_item
 
 @api_router.delete("/menu/{item_id}")
-async def delete_menu_item(item_id: str, token: str = Depends(verify_admin_token)):
-    result = await db.menu.delete_one({"id": item_id})
+async def delete_menu_item(item_id: str, sucursal: str = Depends(verify_admin_token)):
+    result = await db.menu.delete_one({"id": item_id, "sucursal": sucursal})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Menu item not found")
+    menu_caches[sucursal].invalidate()
+    menu_indexes[sucursal].remove(item_id)
     return {"message": "Menu item deleted"}
 
+@api_router.post("/images", response_model=ImageInfo)
+async def upload_image(file: UploadFile = File(...), token: str = Depends(verify_admin_token)):
+    data = await file.read(image_store.max_bytes + 1)
+    try:
+        return image_info(await image_store.save(data))
+    except InvalidImage as e:
+        raise HTTPException(status_code=400, detail=f"Invalid image: {e}")
+
+@api_router.post("/images/ingest", response_model=ImageInfo)
+async def ingest_image(source: ImageIngest, token: str = Depends(verify_admin_token)):
+    try:
+        async with httpx.AsyncClient(timeout=IMAGE_FETCH_TIMEOUT, follow_redirects=True) as http:
+            data = await fetch_image(http, source.url)
+        return image_info(await image_store.save(data))
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=502, detail=f"Could not fetch image: {e}")
+    except InvalidImage as e:
+        raise HTTPException(status_code=400, detail=f"Invalid image: {e}")
+
+@api_router.post("/menu/images/ingest")
+async def ingest_menu_images(sucursal: str = Depends(verify_admin_token)):
+    """Store the imagen_url of every menu item that has no stored image yet."""
+    items = await db.menu.find(
+        {"sucursal": sucursal, "imagen": None, "imagen_url": {"$ne": None}}, {"_id": 0, "id": 1, "imagen_url": 1}
+    ).to_list(None)
+    ingested, failed = 0, {}
+    slots = asyncio.Semaphore(4)
+
+    async def ingest(http: httpx.AsyncClient, item: dict):
+        nonlocal ingested
+        async with slots:
+            try:
+                image_hash = await image_store.save(await fetch_image(http, item["imagen_url"]))
+            except (httpx.HTTPError, InvalidImage) as e:
+                failed[item["id"]] = str(e)
+                return
+        await db.menu.update_one({"id": item["id"]}, {"$set": {"imagen": image_hash}})
+        ingested += 1
+
+    async with httpx.AsyncClient(timeout=IMAGE_FETCH_TIMEOUT, follow_redirects=True) as http:
+        await asyncio.gather(*(ingest(http, item) for item in items))
+    if ingested:
+        menu_caches[sucursal].invalidate()
+        await refresh_menu_index(sucursal)
+    return {"ingested": ingested, "failed": failed}
+
+@api_router.get("/images/{image_hash}/{size}")
+async def get_image(image_hash: str, size: str):
+    path = image_store.variant_path(image_hash, size)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    # The URL names the content, so the response never changes.
+    return FileResponse(path, media_type="image/webp",
+                        headers={"Cache-Control": "public, max-age=31536000, immutable"})
+
 @api_router.get("/reservations", response_model=List[Reservation])
-async def get_reservations(token: str = Depends(verify_admin_token)):
-    reservations = await db.reservations.find({}, {"_id": 0}).to_list(1000)
-    for res in reservations:
-        if isinstance(res.get('created_at'), str):
-            res['created_at'] = datetime.fromisoformat(res['created_at'])
-    return reservations
-
-@api_router.post("/reservations", response_model=Reservation)
-async def create_reservation(reservation: ReservationCreate):
-    res = Reservation(**reservation.model_dump())
+async def get_reservations(
+    estado: Optional[str] = None,
+    fecha_desde: Optional[str] = None,
+    fecha_hasta: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(RESERVATIONS_PAGE_SIZE, ge=1, le=RESERVATIONS_MAX_PAGE_SIZE),
+    archive: Optional[str] = Query(None, pattern=ARCHIVE_MONTH_PATTERN),
+    fields: Optional[str] = None,
+    sucursal: str = Depends(verify_admin_token)
+):
+    # id and created_at are always returned: the next-page cursor is built from them.
+    selected = sparse_fields(fields, Reservation, ("id", "created_at"))
+    query = reservation_filter(sucursal, estado, fecha_desde, fecha_hasta)
+    if cursor:
+        created_at, res_id = decode_cursor(cursor)
+        query["$or"] = [
+            {"created_at": {"$lt": created_at}},
+            {"created_at": created_at, "id": {"$lt": res_id}},
+        ]
+    
+    collection = db[archive_collection(archive)] if archive else db.reservations
+    projection = fields_projection(selected) if selected else RESERVATION_PROJECTION
+    reservations = await collection.find(query, projection).sort(
+        RESERVATIONS_SORT
+    ).limit(limit + 1).to_list(limit + 1)
+    headers = {}
+    if len(reservations) > limit:
+        reservations = reservations[:limit]
+        headers["X-Next-Cursor"] = encode_cursor(reservations[-1])
+    return Response(
+        content=serialize_list(reservations, None if selected else reservation_list_adapter),
+        media_type="application/json",
+        headers=headers
+    )
+
+@api_router.get("/reservations/stats", response_model=List[ReservationDayStats])
+async def get_reservation_stats(
+    fecha_desde: Optional[str] = Query(None, alias="from"),
+    fecha_hasta: Optional[str] = Query(None, alias="to"),
+    sucursal: str = Depends(verify_admin_token)
+):
+    query = {"sucursal": sucursal, **fecha_filter(fecha_desde, fecha_hasta)}
+    days = await db.reservation_stats.find(query, {"_id": 0}).sort("fecha", ASCENDING).to_list(None)
+    return days
+
+@api_router.post("/reservations/stats/rebuild")
+async def rebuild_stats(
+    fecha_desde: Optional[str] = Query(None, alias="from"),
+    fecha_hasta: Optional[str] = Query(None, alias="to"),
+    sucursal: str = Depends(verify_admin_token)
+):
+    days = await rebuild_reservation_stats(sucursal, fecha_desde, fecha_hasta)
+    return {"message": "Reservation stats rebuilt", "days": days}
+
+@api_router.get("/reservations/export")
+async def export_reservations(
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    estado: Optional[str] = None,
+    fecha_desde: Optional[str] = None,
+    fecha_hasta: Optional[str] = None,
+    archive: Optional[str] = Query(None, pattern=ARCHIVE_MONTH_PATTERN),
+    sucursal: str = Depends(verify_admin_token)
+):
+    query = reservation_filter(sucursal, estado, fecha_desde, fecha_hasta)
+    collection = db[archive_collection(archive)] if archive else db.reservations
+    cursor = collection.find(query, RESERVATION_PROJECTION).sort("fecha", ASCENDING).batch_size(EXPORT_BATCH_SIZE)
+    if format == "csv":
+        body, media_type = stream_reservations_csv(cursor), "text/csv; charset=utf-8"
+    else:
+        body, media_type = stream_reservations_ndjson(cursor), "application/x-ndjson"
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="reservations.{format}"'}
+    )
+
+@api_router.get("/reservations/archive")
+async def list_reservation_archives(token: str = Depends(verify_admin_token)):
+    return {"months": await archive_months()}
+
+@api_router.post("/reservations/archive")
+async def archive_old_reservations(sucursal: str = Depends(verify_admin_token)):
+    if ARCHIVE_AFTER_DAYS <= 0:
+        raise HTTPException(status_code=400, detail="Archival is disabled")
+    cutoff = archive_cutoff()
+    return {"archived": await archive_reservations(cutoff, sucursal), "cutoff": cutoff}
+
+@api_router.post("/reservations/events/ticket", response_model=EventsTicket)
+async def reservation_events_ticket(sucursal: str = Depends(verify_admin_token)):
+    return EventsTicket(ticket=events_ticket(sucursal), expires_in=EVENTS_TICKET_SECONDS)
+
+@api_router.get("/reservations/events")
+async def reservation_events_stream(sucursal: str = Depends(verify_events_ticket)):
+    broker = reservation_events[sucursal]
+    return StreamingResponse(
+        stream_reservation_events(broker, broker.subscribe()),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+async def store_reservation(reservation: ReservationCreate, sucursal: str) -> dict:
+    res = Reservation(**reservation.model_dump(), sucursal=sucursal)
+    if res.cantidad_personas < 1:
+        raise HTTPException(status_code=400, detail="cantidad_personas must be at least 1")
+    try:
+        slot_at = slot_datetime(res.fecha, res.hora)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="fecha must be YYYY-MM-DD and hora HH:MM")
+    # Capacity is counted per slot, so a hora outside the list would get a
+    # counter of its own and sidestep the limit.
+    if res.hora not in RESERVATION_SLOTS:
+        raise HTTPException(status_code=400, detail=f"hora must be one of {', '.join(RESERVATION_SLOTS)}")
+    if not await reserve_covers(sucursal, res.fecha, res.hora, res.cantidad_personas):
+        raise HTTPException(status_code=409, detail="No availability for the requested slot")
     doc = res.model_dump()
-    doc['created_at'] = doc['created_at'].isoformat()
-    await db.reservations.insert_one(doc)
-    return res
+    doc['slot_at'] = slot_at
+    try:
+        await insert_reservation(doc)
+    except Exception:
+        await release_covers(sucursal, res.fecha, res.hora, res.cantidad_personas)
+        raise
+    doc.pop("_id", None)
+    await record_reservation_created(doc)
+    publish_reservation_event("created", doc)
+    return doc
+
+@api_router.post("/reservations", response_model=Reservation, dependencies=[public_endpoint("reservations")])
+async def create_reservation(reservation: ReservationCreate, response: Response,
+                             idempotency_key: Optional[str] = Header(None),
+                             sucursal: str = Depends(current_sucursal)):
+    if idempotency_key is None:
+        return await store_reservation(reservation, sucursal)
+    if not idempotency_key or len(idempotency_key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+        raise HTTPException(status_code=400, detail="Invalid Idempotency-Key")
+
+    # Keys are scoped per branch so the same client key sent to two
+    # branches books in both.
+    key = f"{sucursal}:{idempotency_key}"
+    fingerprint = request_fingerprint(reservation)
+    async with idempotency_cache.lock(key):
+        cached = idempotency_cache.get(key)
+        if cached is None:
+            stored = await claim_idempotency_key(key, fingerprint)
+        else:
+            stored = idempotent_replay(key, fingerprint, *cached)
+        if stored is not None:
+            response.headers["Idempotent-Replayed"] = "true"
+            return stored
+        try:
+            doc = await store_reservation(reservation, sucursal)
+        except BaseException:
+            await release_idempotency_key(key)
+            raise
+        await complete_idempotency_key(key, fingerprint, doc)
+        return doc
+
+@api_router.post("/reservations/estado", response_model=ReservationBulkResponse)
+async def bulk_update_reservations(update: ReservationBulkUpdate, sucursal: str = Depends(verify_admin_token)):
+    if (update.ids is None) == (update.filter is None):
+        raise HTTPException(status_code=400, detail="Provide either ids or filter")
+    not_found = []
+    if update.ids is not None:
+        if len(update.ids) > RESERVATION_BULK_MAX_IDS:
+            raise HTTPException(status_code=400, detail=f"At most {RESERVATION_BULK_MAX_IDS} ids per request")
+        query = {"id": {"$in": update.ids}, "sucursal": sucursal}
+        found = await db.reservations.find(query, {"_id": 0, "id": 1}).to_list(None)
+        not_found = sorted(set(update.ids) - {doc["id"] for doc in found})
+    else:
+        # An empty filter would match, and transition, every reservation in the branch.
+        if not update.filter.model_dump(exclude_none=True):
+            raise HTTPException(status_code=400, detail="filter needs at least one of estado, fecha_desde, fecha_hasta")
+        query = reservation_filter(sucursal, update.filter.estado, update.filter.fecha_desde,
+                                   update.filter.fecha_hasta)
+    modified, sin_cupo = await transition_reservations(query, update.estado)
+    return ReservationBulkResponse(estado=update.estado, modified=modified, sin_cupo=sin_cupo, not_found=not_found)
 
 @api_router.put("/reservations/{reservation_id}", response_model=Reservation)
-async def update_reservation(reservation_id: str, update: ReservationUpdate, token: str = Depends(verify_admin_token)):
+async def update_reservation(reservation_id: str, update: ReservationUpdate,
+                             sucursal: str = Depends(verify_admin_token)):
     result = await db.reservations.find_one_and_update(
-        {"id": reservation_id},
+        {"id": reservation_id, "sucursal": sucursal},
         {"$set": {"estado": update.estado}},
-        return_document=True
+        return_document=ReturnDocument.BEFORE
     )
     
     if not result:
         raise HTTPException(status_code=404, detail="Reservation not found")
     
+    was_occupying = result["estado"] in OCCUPYING_ESTADOS
+    now_occupying = update.estado in OCCUPYING_ESTADOS
+    if was_occupying and not now_occupying:
+        await release_covers(sucursal, result["fecha"], result["hora"], result["cantidad_personas"])
+    elif now_occupying and not was_occupying:
+        if not await reserve_covers(sucursal, result["fecha"], result["hora"], result["cantidad_personas"]):
+            await db.reservations.update_one(
+                {"id": reservation_id, "estado": update.estado},
+                {"$set": {"estado": result["estado"]}}
+            )
+            raise HTTPException(status_code=409, detail="No availability for the requested slot")
+
+    if update.estado in TABLE_ESTADOS and result["estado"] not in TABLE_ESTADOS:
+        seated, rejected = {}, [reservation_id]
+        try:
+            seated, rejected = await update_table_plan(sucursal, result["fecha"], [result], [])
+        finally:
+            if rejected:
+                await db.reservations.update_one(
+                    {"id": reservation_id, "estado": update.estado},
+                    {"$set": {"estado": result["estado"]}}
+                )
+                if now_occupying and not was_occupying:
+                    await release_covers(sucursal, result["fecha"], result["hora"], result["cantidad_personas"])
+        if rejected:
+            raise HTTPException(status_code=409, detail="No table available for the requested party")
+        result["mesas"] = seated.get(reservation_id, [])
+    elif result["estado"] in TABLE_ESTADOS and update.estado not in TABLE_ESTADOS:
+        await update_table_plan(sucursal, result["fecha"], [], [reservation_id])
+        result["mesas"] = []
+    
+    await record_estado_change(result, result["estado"], update.estado)
+    result["estado"] = update.estado
     result.pop("_id", None)
-    if isinstance(result.get('created_at'), str):
-        result['created_at'] = datetime.fromisoformat(result['created_at'])
+    publish_reservation_event("updated", result)
     return Reservation(**result)
 
-@api_router.post("/seed")
-async def seed_data():
-    existing = await db.menu.count_documents({})
+@api_router.get("/availability", response_model=List[SlotAvailability])
+async def get_availability(fecha: str, sucursal: str = Depends(current_sucursal)):
+    counters = await db.slot_occupancy.find(
+        {"sucursal": sucursal, "fecha": fecha}, {"_id": 0, "hora": 1, "ocupados": 1}
+    ).to_list(1000)
+    ocupados = {doc["hora"]: doc["ocupados"] for doc in counters}
+    slots = []
+    for hora in RESERVATION_SLOTS:
+        capacidad = slot_capacity(hora)
+        taken = ocupados.get(hora, 0)
+        slots.append(SlotAvailability(
+            hora=hora, capacidad=capacidad, ocupados=taken, disponibles=max(capacidad - taken, 0)
+        ))
+    return slots
+
+@api_router.post("/availability/rebuild")
+async def rebuild_availability(sucursal: str = Depends(verify_admin_token)):
+    slots = await rebuild_slot_occupancy(sucursal)
+    return {"message": "Availability rebuilt", "slots": slots}
+
+@api_router.get("/tables", response_model=TableLayoutConfig)
+async def get_table_layout(sucursal: str = Depends(verify_admin_token)):
+    doc = await db.table_layouts.find_one({"_id": sucursal}, {"_id": 0})
+    return TableLayoutConfig(**doc) if doc else TableLayoutConfig()
+
+@api_router.put("/tables", response_model=TableLayoutConfig)
+async def save_table_layout(layout: TableLayoutConfig, sucursal: str = Depends(verify_admin_token)):
+    """Replace the branch's tables; each day's plan is repacked for the new layout the next time it is used."""
+    ids = [mesa.id for mesa in layout.mesas]
+    if len(set(ids)) != len(ids):
+        raise HTTPException(status_code=400, detail="Duplicate table ids")
+    for combination in layout.combinaciones:
+        unknown = sorted(set(combination.mesas) - set(ids))
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown tables in combination: {', '.join(unknown)}")
+        if len(set(combination.mesas)) != len(combination.mesas):
+            raise HTTPException(status_code=400, detail="A combination lists the same table twice")
+    doc = await db.table_layouts.find_one_and_update(
+        {"_id": sucursal},
+        {
+            "$set": {
+                "mesas": [mesa.model_dump() for mesa in layout.mesas],
+                "combinaciones": [combination.model_dump() for combination in layout.combinaciones],
+            },
+            "$inc": {"version": 1},
+        },
+        projection={"_id": 0}, upsert=True, return_document=ReturnDocument.AFTER
+    )
+    return TableLayoutConfig(**doc)
+
+async def table_plan_response(sucursal: str, fecha: str, repack: bool) -> TablePlan:
+    try:
+        date.fromisoformat(fecha)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="fecha must be YYYY-MM-DD")
+    if not await load_table_layout(sucursal):
+        raise HTTPException(status_code=404, detail="No table layout configured")
+    await update_table_plan(sucursal, fecha, [], [], repack=repack)
+    doc = await db.table_plans.find_one({"_id": table_plan_id(sucursal, fecha)}, {"_id": 0})
+    return TablePlan(
+        fecha=fecha,
+        layout_version=doc["layout_version"],
+        asignaciones=[entry for entry in doc["asignaciones"] if entry["mesas"]],
+        sin_mesa=[entry["id"] for entry in doc["asignaciones"] if not entry["mesas"]],
+    )
+
+@api_router.get("/tables/plan", response_model=TablePlan)
+async def get_table_plan(fecha: str, sucursal: str = Depends(verify_admin_token)):
+    return await table_plan_response(sucursal, fecha, repack=False)
+
+@api_router.post("/tables/plan/rebuild", response_model=TablePlan)
+async def rebuild_table_plan(fecha: str, sucursal: str = Depends(verify_admin_token)):
+    """Seat the day's confirmed reservations again from scratch, e.g. once cancellations leave gaps."""
+    return await table_plan_response(sucursal, fecha, repack=True)
+
+@api_router.get("/admin/indexes")
+async def get_index_report(token: str = Depends(verify_admin_token)):
+    report = await explain_query_shapes()
+    return {
+        "queries": report,
+        "collscans": [entry["handler"] for entry in report if entry["collscan"]],
+    }
+
+@api_router.get("/admin/profiles")
+async def list_profiles(token: str = Depends(verify_admin_token)):
+    return {"enabled": PROFILING_ENABLED, "profiles": await asyncio.to_thread(profile_store.list)}
+
+@api_router.get("/admin/profiles/{profile_id}")
+async def get_profile(
+    profile_id: str,
+    format: str = Query("speedscope", pattern="^(speedscope|collapsed)$"),
+    token: str = Depends(verify_admin_token)
+):
+    if format == "collapsed":
+        body = await asyncio.to_thread(profile_store.collapsed, profile_id)
+        if body is None:
+            raise HTTPException(status_code=404, detail="Profile not found")
+        return Response(content=body, media_type="text/plain; charset=utf-8")
+    path = profile_store.path(profile_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(path, media_type="application/json", filename=path.name)
+
+@api_router.get("/health/live")
+async def health_live():
+    return {"status": "ok"}
+
+@api_router.get("/health/ready")
+async def health_ready(response: Response):
+    ok, error = await readiness.check()
+    if not ok:
+        response.status_code = 503
+        return {"status": "unavailable", "detail": error}
+    return {"status": "ok"}
+
+@api_router.get("/metrics")
+async def get_metrics():
+    return Response(content=metrics_registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@api_router.post("/seed", dependencies=[public_endpoint("seed")])
+async def seed_data(sucursal: str = Depends(current_sucursal)):
+    existing = await db.menu.count_documents({"sucursal": sucursal})
     if existing > 0:
         return {"message": "Database already seeded"}
     
@@ -257,17 +2221,114 @@ async def seed_data():
         }
     ]
     
-    await db.menu.insert_many(seed_menu)
+    await db.menu.insert_many([{**item, "sucursal": sucursal} for item in seed_menu])
+    menu_caches[sucursal].invalidate()
+    await refresh_menu_index(sucursal)
     return {"message": "Database seeded successfully", "items": len(seed_menu)}
 
+SUCURSAL_MIGRATION_ID = "sucursal_backfill"
+
+async def backfill_sucursal():
+    """Assign DEFAULT_SUCURSAL to data stored before branches existed; runs once."""
+    if await db.migrations.find_one({"_id": SUCURSAL_MIGRATION_ID}):
+        return
+    legacy = {"sucursal": {"$exists": False}}
+    backfill = {"$set": {"sucursal": DEFAULT_SUCURSAL}}
+    await db.menu.update_many(legacy, backfill)
+    for collection in await reservation_collections(None, None):
+        await collection.update_many(legacy, backfill)
+    # Counters and rollups are keyed by branch now; rebuild them rather
+    # than rewriting their ids.
+    await db.reservation_stats.delete_many(legacy)
+    await rebuild_reservation_stats(DEFAULT_SUCURSAL, None, None)
+    await rebuild_slot_occupancy()
+    await db.migrations.update_one(
+        {"_id": SUCURSAL_MIGRATION_ID}, {"$set": {"completed_at": datetime.now(timezone.utc)}}, upsert=True
+    )
+
+async def migrate_reservation_dates():
+    """Store created_at and slot_at as datetimes on older reservations; runs once.
+
+    Keyset pagination and every slot_at range filter assume BSON dates, so
+    the server must not serve reservations stored before slot_at existed.
+    This is migrate_reservations.py's migration, checkpointed the same way;
+    documents whose fecha/hora cannot be parsed are logged and left as they are.
+    """
+    if await db.migrations.find_one({"_id": RESERVATION_DATES_MIGRATION_ID}):
+        return
+    batch_size = int(os.environ.get('MIGRATION_BATCH_SIZE', '500'))
+    invalid = 0
+    for collection in await reservation_collections(None, None):
+        totals = await migrate_collection(
+            db, collection.name, batch_size, dry_run=False, restart=False, report=logger.error
+        )
+        invalid += totals["invalid"]
+        if totals["migrated"]:
+            logger.info("Migrated %d reservations in %s to native dates", totals["migrated"], collection.name)
+    if invalid:
+        logger.error("%d reservations have an unparseable fecha/hora and no slot_at; "
+                     "they are left out of date filters until fixed by hand", invalid)
+    await db.migrations.update_one(
+        {"_id": RESERVATION_DATES_MIGRATION_ID}, {"$set": {"completed_at": datetime.now(timezone.utc)}}, upsert=True
+    )
+
+background_tasks: set = set()
+
+async def warm_up_mongo():
+    # Concurrent pings make the driver open that many pooled connections now
+    # instead of on the first requests after a deploy.
+    connections = int(os.environ.get('MONGO_WARMUP_CONNECTIONS', os.environ.get('MONGO_MIN_POOL_SIZE', '10')))
+    await asyncio.gather(*(db.command("ping") for _ in range(max(connections, 1))))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await warm_up_mongo()
+    await migrate_reservation_dates()
+    await backfill_sucursal()
+    await ensure_indexes()
+    for sucursal in SUCURSALES:
+        await refresh_menu_index(sucursal)
+    if RESERVATION_EVENTS_SOURCE == "change_stream":
+        background_tasks.add(asyncio.create_task(watch_reservation_changes()))
+    if EXPIRY_INTERVAL_SECONDS > 0:
+        background_tasks.add(asyncio.create_task(run_expiry_sweeper()))
+    if ARCHIVE_AFTER_DAYS > 0 and ARCHIVE_INTERVAL_SECONDS > 0:
+        background_tasks.add(asyncio.create_task(run_archival()))
+    readiness.warmed_up = True
+    yield
+    readiness.warmed_up = False
+    for task in background_tasks:
+        task.cancel()
+    if reservation_queue:
+        await reservation_queue.drain()
+    image_store.close()
+    client.close()
+
+app = FastAPI(lifespan=lifespan)
 app.include_router(api_router)
 
+if METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware)
+
+if PROFILING_ENABLED:
+    app.add_middleware(
+        ProfilingMiddleware,
+        sampler=Sampler(interval=float(os.environ.get('PROFILE_INTERVAL_MS', '5')) / 1000),
+        store=profile_store,
+        authorize=is_admin_authorization,
+        sample_rate=PROFILE_SAMPLE_RATE,
+    )
+
+if COMPRESSION_ENABLED:
+    app.add_middleware(CompressionMiddleware, minimum_size=int(os.environ.get('COMPRESSION_MIN_BYTES', '500')))
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Next-Cursor", "Idempotent-Replayed"],
 )
 
 logging.basicConfig(
@@ -276,6 +2337,3 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
\ No newline at end of file
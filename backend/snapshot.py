@@ -0,0 +1,208 @@
+"""Back up and restore the menu, reservations and table layouts.
+
+A snapshot is one gzip-compressed file of BSON frames: a header with the
+collections and their index definitions, then batches of documents, then a
+footer with per-collection counts. Collections are dumped concurrently by
+streaming their cursors as raw BSON, so documents are never decoded or
+re-encoded on the way to disk. A restore inserts the batches with parallel
+``insert_many`` calls and builds the indexes only once the data is in.
+
+    python snapshot.py dump calandria.snap
+    python snapshot.py dump full.snap --collections menu reservations reservation_stats
+    python snapshot.py restore calandria.snap --db calandria_staging --drop
+
+By default the dump holds menu, reservations, table_layouts and every
+reservations_archive_YYYY_MM month, so a restore keeps the archived history.
+The dump is not a point-in-time copy: writes made while it runs may or may
+not be included. reservation_stats, slot_occupancy and table_plans are
+derived data and are not dumped by default: rebuild the first two after a
+restore with POST /api/reservations/stats/rebuild and POST
+/api/availability/rebuild; table plans are rebuilt as each day is next used.
+"""
+import argparse
+import asyncio
+import gzip
+import os
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List
+
+import bson
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import IndexModel
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+SNAPSHOT_FORMAT = "calandria-snapshot"
+SNAPSHOT_VERSION = 1
+DEFAULT_COLLECTIONS = ["menu", "reservations", "table_layouts"]
+ARCHIVE_PREFIX = "reservations_archive_"
+RAW = CodecOptions(document_class=RawBSONDocument, tz_aware=True)
+# Index options carried over from index_information(); the rest (v, ns, ...)
+# are server bookkeeping.
+INDEX_OPTIONS = ("unique", "sparse", "expireAfterSeconds", "partialFilterExpression", "collation")
+
+async def default_collections(db) -> List[str]:
+    names = await db.list_collection_names()
+    return DEFAULT_COLLECTIONS + sorted(name for name in names if name.startswith(ARCHIVE_PREFIX))
+
+async def index_specs(collection) -> List[dict]:
+    specs = []
+    for name, info in (await collection.index_information()).items():
+        if name == "_id_":
+            continue
+        spec = {"name": name, "key": [list(pair) for pair in info["key"]]}
+        spec.update({option: info[option] for option in INDEX_OPTIONS if option in info})
+        specs.append(spec)
+    return specs
+
+async def dump_collection(db, name: str, frames: asyncio.Queue, frame_size: int) -> int:
+    count = 0
+    batch: List[RawBSONDocument] = []
+    async for doc in db.get_collection(name, codec_options=RAW).find({}, batch_size=frame_size):
+        batch.append(doc)
+        if len(batch) == frame_size:
+            await frames.put(bson.encode({"collection": name, "docs": batch}))
+            count += len(batch)
+            batch = []
+    if batch:
+        await frames.put(bson.encode({"collection": name, "docs": batch}))
+        count += len(batch)
+    return count
+
+async def write_frames(path: str, frames: asyncio.Queue, level: int):
+    with gzip.open(path, "wb", compresslevel=level) as fh:
+        while True:
+            frame = await frames.get()
+            if frame is None:
+                return
+            await asyncio.to_thread(fh.write, frame)
+
+async def dump(db, path: str, names: List[str], frame_size: int, level: int) -> Dict[str, int]:
+    frames: asyncio.Queue = asyncio.Queue(maxsize=16)
+    writer = asyncio.create_task(write_frames(path, frames, level))
+    try:
+        await frames.put(bson.encode({
+            "format": SNAPSHOT_FORMAT,
+            "version": SNAPSHOT_VERSION,
+            "created_at": datetime.now(timezone.utc),
+            "collections": {name: {"indexes": await index_specs(db[name])} for name in names},
+        }))
+        counts = await asyncio.gather(*(dump_collection(db, name, frames, frame_size) for name in names))
+        counts = dict(zip(names, counts))
+        await frames.put(bson.encode({"counts": counts}))
+    finally:
+        await frames.put(None)
+        await writer
+    return counts
+
+def read_frames(path: str):
+    with gzip.open(path, "rb") as fh:
+        yield from bson.decode_file_iter(fh, codec_options=RAW)
+
+async def restore(db, path: str, drop: bool, jobs: int) -> Dict[str, int]:
+    frames = read_frames(path)
+    header = await asyncio.to_thread(next, frames, None)
+    if header is None or header.get("format") != SNAPSHOT_FORMAT:
+        raise SystemExit(f"{path} is not a snapshot")
+    if header["version"] > SNAPSHOT_VERSION:
+        raise SystemExit(f"{path} was written by a newer version ({header['version']})")
+    collections = header["collections"]
+    for name in collections:
+        if drop:
+            await db[name].drop()
+        elif await db[name].estimated_document_count():
+            raise SystemExit(f"Collection {name} is not empty; pass --drop to replace it")
+
+    restored = {name: 0 for name in collections}
+    slots = asyncio.Semaphore(jobs)
+    tasks, failures = [], []
+
+    def settled(task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            failures.append(task.exception())
+
+    async def insert(name: str, docs: list):
+        try:
+            await db[name].insert_many(docs, ordered=False)
+            restored[name] += len(docs)
+        finally:
+            slots.release()
+
+    footer = None
+    # Stop reading at the first failed batch; the error is raised below,
+    # once the batches already in flight have finished.
+    while not failures:
+        frame = await asyncio.to_thread(next, frames, None)
+        if frame is None:
+            break
+        if "counts" in frame:
+            footer = frame["counts"]
+            break
+        await slots.acquire()
+        task = asyncio.create_task(insert(frame["collection"], list(frame["docs"])))
+        tasks.append(task)
+        task.add_done_callback(settled)
+    await asyncio.gather(*tasks, return_exceptions=True)
+    if failures:
+        raise failures[0]
+
+    for name, info in collections.items():
+        indexes = [
+            IndexModel([tuple(pair) for pair in spec["key"]], **{k: v for k, v in spec.items() if k != "key"})
+            for spec in info["indexes"]
+        ]
+        if indexes:
+            await db[name].create_indexes(indexes)
+
+    if footer is None:
+        raise SystemExit(f"{path} is truncated; restored {restored}")
+    mismatched = {name: (restored[name], footer[name]) for name in restored if restored[name] != footer.get(name)}
+    if mismatched:
+        raise SystemExit(f"Restored counts differ from the snapshot: {mismatched}")
+    return restored
+
+async def run(args):
+    client = AsyncIOMotorClient(args.url or os.environ['MONGO_URL'], tz_aware=True)
+    db = client[args.db or os.environ['DB_NAME']]
+    start = time.perf_counter()
+    try:
+        if args.command == "dump":
+            names = args.collections or await default_collections(db)
+            counts = await dump(db, args.path, names, args.frame_size, args.level)
+        else:
+            counts = await restore(db, args.path, args.drop, args.jobs)
+    finally:
+        client.close()
+    elapsed = time.perf_counter() - start
+    for name, count in counts.items():
+        print(f"{name}: {count} documents")
+    print(f"{args.command} of {args.path} took {elapsed:.2f}s")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="MongoDB URL (default: MONGO_URL)")
+    parser.add_argument("--db", help="Database name (default: DB_NAME)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    dump_parser = commands.add_parser("dump", help="Write a snapshot")
+    dump_parser.add_argument("path")
+    dump_parser.add_argument("--collections", nargs="+",
+                             help="Collections to dump (default: the ones listed above)")
+    dump_parser.add_argument("--frame-size", type=int, default=1000, help="Documents per frame")
+    dump_parser.add_argument("--level", type=int, default=6, help="gzip compression level (1-9)")
+
+    restore_parser = commands.add_parser("restore", help="Load a snapshot")
+    restore_parser.add_argument("path")
+    restore_parser.add_argument("--drop", action="store_true", help="Drop the collections before restoring")
+    restore_parser.add_argument("--jobs", type=int, default=4, help="insert_many calls in flight")
+
+    asyncio.run(run(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
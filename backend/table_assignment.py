@@ -0,0 +1,105 @@
+"""Assigns confirmed reservations to tables.
+
+A ``TableLayout`` lists a branch's tables and the combinations staff may
+push together for larger parties. Single tables and combinations are both
+"resources", sorted by capacity. A ``DayPlan`` holds one day's assignments:
+each reservation occupies one resource from its hora for ``duration``
+minutes, and a table can serve several reservations a day as long as their
+intervals do not overlap.
+
+``DayPlan.place`` seats one party best-fit: the smallest resource that fits
+it and whose tables are all free for the whole interval, so six people
+never take a ten-top while a six-top is free. ``pack`` seats a whole day
+the same way in order of arrival, larger parties first within a slot, and
+``restore`` rebuilds a stored plan before a change is applied to it.
+It is a greedy heuristic, not an exact packing: a party once seated is
+never moved, so a booking it turns away could occasionally still fit
+after reshuffling by hand. Free checks are a bisect into each table's
+sorted intervals, so a few hundred bookings over a few dozen tables pack
+in milliseconds.
+"""
+import bisect
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+Resource = Tuple[int, Tuple[str, ...]]
+
+def minutes(hora: str) -> int:
+    """Minutes since midnight of an HH:MM hora; raises ValueError if malformed."""
+    parsed = datetime.strptime(hora, "%H:%M")
+    return parsed.hour * 60 + parsed.minute
+
+class TableLayout:
+    def __init__(self, mesas: Sequence[dict], combinaciones: Sequence[dict] = (), version: int = 0):
+        self.version = version
+        self.capacities: Dict[str, int] = {mesa["id"]: mesa["capacidad"] for mesa in mesas}
+        resources = [(capacity, (table,)) for table, capacity in self.capacities.items()]
+        for combination in combinaciones:
+            tables = tuple(combination["mesas"])
+            capacity = combination.get("capacidad") or sum(self.capacities[table] for table in tables)
+            resources.append((capacity, tables))
+        # Smallest capacity first; among equals, fewer tables to move.
+        resources.sort(key=lambda resource: (resource[0], len(resource[1]), resource[1]))
+        self.resources: List[Resource] = resources
+        self._capacities = [capacity for capacity, _ in resources]
+
+    def __bool__(self) -> bool:
+        return bool(self.capacities)
+
+    def candidates(self, covers: int) -> List[Resource]:
+        """Resources that seat ``covers``, best fit first."""
+        return self.resources[bisect.bisect_left(self._capacities, covers):]
+
+class DayPlan:
+    def __init__(self, layout: TableLayout, duration: int):
+        self.layout = layout
+        self.duration = duration
+        # table -> sorted [(start, end, reservation id)]
+        self._busy: Dict[str, List[Tuple[int, int, str]]] = {table: [] for table in layout.capacities}
+        # reservation id -> (start, covers, tables)
+        self.assignments: Dict[str, Tuple[int, int, Tuple[str, ...]]] = {}
+
+    def _free(self, table: str, start: int, end: int) -> bool:
+        intervals = self._busy[table]
+        index = bisect.bisect_left(intervals, (start,))
+        if index < len(intervals) and intervals[index][0] < end:
+            return False
+        return index == 0 or intervals[index - 1][1] <= start
+
+    def occupy(self, res_id: str, start: int, covers: int, tables: Sequence[str]) -> bool:
+        """Record an existing assignment; False if its tables are unknown or taken."""
+        end = start + self.duration
+        if not all(table in self._busy and self._free(table, start, end) for table in tables):
+            return False
+        for table in tables:
+            bisect.insort(self._busy[table], (start, end, res_id))
+        self.assignments[res_id] = (start, covers, tuple(tables))
+        return True
+
+    def place(self, res_id: str, start: int, covers: int) -> Optional[Tuple[str, ...]]:
+        """Seat a party on the best-fitting free resource; None if nothing fits."""
+        end = start + self.duration
+        for _, tables in self.layout.candidates(covers):
+            if all(self._free(table, start, end) for table in tables):
+                for table in tables:
+                    bisect.insort(self._busy[table], (start, end, res_id))
+                self.assignments[res_id] = (start, covers, tables)
+                return tables
+        return None
+
+def restore(layout: TableLayout, assignments: Iterable[Tuple[str, int, int, Sequence[str]]],
+            duration: int) -> DayPlan:
+    """Rebuild a stored plan from ``(id, start, covers, tables)``; assignments that no longer fit are left out."""
+    plan = DayPlan(layout, duration)
+    for res_id, start, covers, tables in assignments:
+        plan.occupy(res_id, start, covers, tables)
+    return plan
+
+def pack(layout: TableLayout, bookings: Iterable[Tuple[str, int, int]], duration: int) -> Tuple[DayPlan, List[str]]:
+    """Seat ``(id, start, covers)`` bookings from scratch; returns the plan and the ids left unseated."""
+    plan = DayPlan(layout, duration)
+    unseated = []
+    for res_id, start, covers in sorted(bookings, key=lambda booking: (booking[1], -booking[2], booking[0])):
+        if plan.place(res_id, start, covers) is None:
+            unseated.append(res_id)
+    return plan, unseated
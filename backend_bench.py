@@ -0,0 +1,275 @@
+"""Concurrent latency benchmark for the La Calandria API.
+
+By default the FastAPI app in backend/server.py is driven in-process through
+httpx's ASGI transport, with the Motor handle swapped for the in-memory
+stand-in from backend/memory_db.py, so no MongoDB (or network) is needed.
+With --url the same scenarios run against a live server instead.
+
+For every route it reports p50/p95/p99 latency and requests per second.
+--json saves the results; --baseline compares p95 against a saved run and
+exits non-zero when a route regressed by more than --tolerance.
+
+    python backend_bench.py --requests 500 --concurrency 32
+    python backend_bench.py --url http://localhost:8001 --routes menu
+    python backend_bench.py --json baseline.json
+    python backend_bench.py --baseline baseline.json --tolerance 0.25
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import math
+import os
+import sys
+import time
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+import httpx
+
+BACKEND_DIR = Path(__file__).parent / "backend"
+CATEGORIES = ['Brunch', 'Sushi', 'Parrilla', 'Cafetería', 'Sin TACC']
+HORAS = ['13:00', '20:00', '20:30', '21:00', '21:30', '22:00']
+
+@dataclass
+class BenchContext:
+    token: str = ""
+    menu_ids: List[str] = field(default_factory=list)
+    created_menu_ids: List[str] = field(default_factory=list)
+    reservation_ids: List[str] = field(default_factory=list)
+    menu_etag: str = ""
+
+    @property
+    def auth(self) -> Dict[str, str]:
+        return {"Authorization": f"Bearer {self.token}"}
+
+@dataclass
+class Route:
+    name: str
+    method: str
+    path: Callable[[BenchContext, int], str]
+    body: Optional[Callable[[BenchContext, int], dict]] = None
+    headers: Optional[Callable[[BenchContext, int], Dict[str, str]]] = None
+    auth: bool = False
+    expect: Tuple[int, ...] = (200,)
+    collect: Optional[Callable[[BenchContext, httpx.Response], None]] = None
+
+def menu_item(i: int) -> dict:
+    return {
+        "nombre": f"Plato bench {i}",
+        "descripcion": "Plato generado por el benchmark",
+        "precio": 1000 + i,
+        "categoria": CATEGORIES[i % len(CATEGORIES)],
+        "imagen_url": "https://images.pexels.com/photos/376464/pexels-photo-376464.jpeg",
+    }
+
+def reservation(i: int) -> dict:
+    fecha = date.today() + timedelta(days=1 + i % 60)
+    return {
+        "nombre_cliente": f"Cliente bench {i}",
+        "telefono": "2657000000",
+        "fecha": fecha.isoformat(),
+        "hora": HORAS[i % len(HORAS)],
+        "cantidad_personas": 2,
+    }
+
+def pick(ids: List[str], i: int) -> str:
+    return ids[i % len(ids)]
+
+ROUTES = [
+    Route("POST /api/admin/login", "POST", lambda ctx, i: "/api/admin/login",
+          body=lambda ctx, i: {"username": "admin", "password": "calandria2024"}),
+    Route("GET /api/menu", "GET", lambda ctx, i: "/api/menu"),
+    Route("GET /api/menu?categoria", "GET",
+          lambda ctx, i: f"/api/menu?categoria={CATEGORIES[i % len(CATEGORIES)]}"),
+    Route("GET /api/menu (If-None-Match)", "GET", lambda ctx, i: "/api/menu",
+          headers=lambda ctx, i: {"If-None-Match": ctx.menu_etag}, expect=(304,)),
+    Route("GET /api/menu (identity)", "GET", lambda ctx, i: "/api/menu",
+          headers=lambda ctx, i: {"Accept-Encoding": "identity"}),
+    Route("GET /api/menu?fields", "GET", lambda ctx, i: "/api/menu?fields=id,nombre,categoria"),
+    Route("GET /api/menu/search", "GET",
+          lambda ctx, i: f"/api/menu/search?q={['cafe', 'risot', 'panqueques', 'parrilla sin'][i % 4]}"),
+    Route("POST /api/menu", "POST", lambda ctx, i: "/api/menu", body=lambda ctx, i: menu_item(i), auth=True,
+          collect=lambda ctx, response: ctx.created_menu_ids.append(response.json()["id"])),
+    Route("PUT /api/menu/{id}", "PUT", lambda ctx, i: f"/api/menu/{pick(ctx.menu_ids, i)}",
+          body=lambda ctx, i: {"precio": 2000 + i}, auth=True),
+    Route("POST /api/menu/bulk", "POST", lambda ctx, i: "/api/menu/bulk", auth=True,
+          body=lambda ctx, i: {"operations": [
+              {"op": "update", "id": item_id, "item": {"precio": 3000 + i}} for item_id in ctx.menu_ids
+          ]}),
+    Route("POST /api/reservations", "POST", lambda ctx, i: "/api/reservations",
+          body=lambda ctx, i: reservation(i)),
+    Route("POST /api/reservations (retry)", "POST", lambda ctx, i: "/api/reservations",
+          body=lambda ctx, i: reservation(i % 10), headers=lambda ctx, i: {"Idempotency-Key": f"bench-{i % 10}"}),
+    Route("GET /api/reservations", "GET", lambda ctx, i: "/api/reservations", auth=True),
+    Route("PUT /api/reservations/{id}", "PUT",
+          lambda ctx, i: f"/api/reservations/{pick(ctx.reservation_ids, i)}",
+          body=lambda ctx, i: {"estado": "confirmada" if i % 2 else "pendiente"}, auth=True),
+    Route("POST /api/reservations/estado", "POST", lambda ctx, i: "/api/reservations/estado", auth=True,
+          body=lambda ctx, i: {"estado": "confirmada" if i % 2 else "pendiente",
+                               "ids": [pick(ctx.reservation_ids, i + k) for k in range(20)]}),
+    Route("GET /api/reservations/export", "GET", lambda ctx, i: "/api/reservations/export?format=csv",
+          auth=True),
+    Route("GET /api/reservations/stats", "GET", lambda ctx, i: "/api/reservations/stats", auth=True),
+    Route("POST /api/reservations/stats/rebuild", "POST", lambda ctx, i: "/api/reservations/stats/rebuild",
+          auth=True),
+    Route("POST /api/reservations/archive", "POST", lambda ctx, i: "/api/reservations/archive", auth=True),
+    Route("GET /api/availability", "GET",
+          lambda ctx, i: f"/api/availability?fecha={reservation(i)['fecha']}"),
+    Route("POST /api/availability/rebuild", "POST", lambda ctx, i: "/api/availability/rebuild", auth=True),
+    Route("GET /api/admin/indexes", "GET", lambda ctx, i: "/api/admin/indexes", auth=True),
+    Route("GET /api/health/ready", "GET", lambda ctx, i: "/api/health/ready"),
+    Route("GET /api/metrics", "GET", lambda ctx, i: "/api/metrics"),
+    Route("POST /api/seed", "POST", lambda ctx, i: "/api/seed"),
+    Route("DELETE /api/menu/{id}", "DELETE", lambda ctx, i: f"/api/menu/{ctx.created_menu_ids[i]}", auth=True),
+]
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    rank = max(math.ceil(pct / 100 * len(sorted_values)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+async def prepare(client: httpx.AsyncClient, ctx: BenchContext, reservations: int):
+    response = await client.post("/api/admin/login", json={"username": "admin", "password": "calandria2024"})
+    response.raise_for_status()
+    ctx.token = response.json()["token"]
+    await client.post("/api/seed")
+    response = await client.get("/api/menu")
+    ctx.menu_ids = [item["id"] for item in response.json()]
+    ctx.menu_etag = response.headers.get("etag", "")
+    for i in range(reservations):
+        response = await client.post("/api/reservations", json=reservation(i))
+        if response.status_code == 200:
+            ctx.reservation_ids.append(response.json()["id"])
+
+async def run_route(client: httpx.AsyncClient, route: Route, ctx: BenchContext,
+                    total: int, concurrency: int) -> dict:
+    latencies: List[float] = []
+    errors = 0
+    counter = itertools.count()
+
+    async def worker():
+        nonlocal errors
+        while True:
+            i = next(counter)
+            if i >= total:
+                return
+            headers = dict(ctx.auth) if route.auth else {}
+            if route.headers:
+                headers.update(route.headers(ctx, i))
+            body = route.body(ctx, i) if route.body else None
+            start = time.perf_counter()
+            response = await client.request(route.method, route.path(ctx, i), json=body, headers=headers)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code not in route.expect:
+                errors += 1
+            elif route.collect:
+                route.collect(ctx, response)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "count": len(latencies),
+        "errors": errors,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "rps": len(latencies) / elapsed if elapsed else 0.0,
+    }
+
+def in_process_client():
+    os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+    os.environ.setdefault('DB_NAME', 'bench')
+    os.environ.setdefault('ADMIN_TOKEN_SECRET', 'bench')
+    os.environ.setdefault('SLOT_CAPACITY', '100000')
+    # Every simulated client shares one address, so per-client limits and
+    # load shedding would only measure the limiter.
+    for setting in ('RATE_LIMIT_MENU', 'RATE_LIMIT_MENU_SEARCH', 'RATE_LIMIT_RESERVATIONS', 'RATE_LIMIT_SEED',
+                    'MAX_PUBLIC_CONCURRENCY'):
+        os.environ.setdefault(setting, '0')
+    sys.path.insert(0, str(BACKEND_DIR))
+    import server
+    from memory_db import MemoryDatabase
+    server.db = MemoryDatabase()
+    transport = httpx.ASGITransport(app=server.app)
+    return server.app, httpx.AsyncClient(transport=transport, base_url="http://bench")
+
+async def run(args) -> Dict[str, dict]:
+    names = {route.name for route in ROUTES if not args.routes or any(r in route.name for r in args.routes)}
+    if "DELETE /api/menu/{id}" in names:
+        # Deletes consume the items created by the POST /api/menu phase.
+        names.add("POST /api/menu")
+    routes = [route for route in ROUTES if route.name in names]
+
+    results = {}
+    ctx = BenchContext()
+    if args.url:
+        app, client = None, httpx.AsyncClient(base_url=args.url, timeout=30)
+    else:
+        app, client = in_process_client()
+
+    async with client:
+        lifespan = app.router.lifespan_context(app) if app else None
+        if lifespan:
+            await lifespan.__aenter__()
+        try:
+            await prepare(client, ctx, args.reservations)
+            for route in routes:
+                results[route.name] = await run_route(client, route, ctx, args.requests, args.concurrency)
+        finally:
+            if lifespan:
+                await lifespan.__aexit__(None, None, None)
+    return results
+
+def print_report(results: Dict[str, dict]):
+    header = f"{'route':<36} {'count':>6} {'errors':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'req/s':>9}"
+    print(header)
+    print("-" * len(header))
+    for name, stats in results.items():
+        print(f"{name:<36} {stats['count']:>6} {stats['errors']:>6} {stats['p50_ms']:>9.2f} "
+              f"{stats['p95_ms']:>9.2f} {stats['p99_ms']:>9.2f} {stats['rps']:>9.1f}")
+
+def find_regressions(results: Dict[str, dict], baseline: Dict[str, dict], tolerance: float) -> List[str]:
+    regressions = []
+    for name, stats in results.items():
+        previous = baseline.get(name)
+        if previous and stats["p95_ms"] > previous["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {previous['p95_ms']:.2f} ms -> {stats['p95_ms']:.2f} ms")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="Benchmark a running server instead of the in-process app")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per route")
+    parser.add_argument("--concurrency", type=int, default=16, help="Concurrent requests in flight")
+    parser.add_argument("--reservations", type=int, default=200, help="Reservations created before the run")
+    parser.add_argument("--routes", nargs="*", help="Only run routes whose name contains one of these")
+    parser.add_argument("--json", help="Write the results to this file")
+    parser.add_argument("--baseline", help="Compare p95 latencies against a previous --json file")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed p95 regression ratio")
+    args = parser.parse_args()
+
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    results = asyncio.run(run(args))
+    print_report(results)
+
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, indent=2))
+    failed = [name for name, stats in results.items() if stats["errors"]]
+    if failed:
+        print(f"\n❌ Unexpected status codes on: {', '.join(failed)}")
+    if args.baseline:
+        regressions = find_regressions(results, json.loads(Path(args.baseline).read_text()), args.tolerance)
+        for regression in regressions:
+            print(f"❌ Regression - {regression}")
+        failed += regressions
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,9 @@
 import requests
 import sys
 import json
+import struct
+import time
+import zlib
 from datetime import datetime, timedelta
 
 class LaCalandriaAPITester:
@@ -12,12 +15,14 @@ class LaCalandriaAPITester:
         self.tests_passed = 0
         self.created_items = []  # Track created items for cleanup
 
-    def run_test(self, name, method, endpoint, expected_status, data=None, auth_required=False):
+    def run_test(self, name, method, endpoint, expected_status, data=None, auth_required=False, extra_headers=None):
         """Run a single API test"""
         url = f"{self.api_url}/{endpoint}"
         headers = {'Content-Type': 'application/json'}
         if auth_required and self.token:
             headers['Authorization'] = f'Bearer {self.token}'
+        if extra_headers:
+            headers.update(extra_headers)
 
         self.tests_run += 1
         print(f"\n🔍 Testing {name}...")
@@ -68,7 +73,7 @@ class LaCalandriaAPITester:
         )
         if success and 'token' in response:
             self.token = response['token']
-            print(f"   Token obtained: {self.token}")
+            print(f"   Token obtained: {self.token} (sucursal {response.get('sucursal')})")
             return True
         return False
 
@@ -106,6 +111,16 @@ class LaCalandriaAPITester:
             return True
         return False
 
+    def test_unknown_sucursal(self):
+        """Test that public routes reject a branch that is not configured"""
+        success, _ = self.run_test(
+            "Get Menu (Unknown Sucursal)",
+            "GET",
+            "menu?sucursal=no-existe",
+            404
+        )
+        return success
+
     def test_get_menu_by_category(self):
         """Test getting menu items by category"""
         categories = ['Brunch', 'Sushi', 'Parrilla', 'Cafetería', 'Sin TACC']
@@ -125,6 +140,54 @@ class LaCalandriaAPITester:
         
         return all_passed
 
+    def test_get_menu_not_modified(self):
+        """Test that a revalidated menu request returns 304"""
+        response = requests.get(f"{self.api_url}/menu", timeout=10)
+        etag = response.headers.get('ETag')
+        if not etag:
+            print("❌ Menu response has no ETag")
+            return False
+
+        success, _ = self.run_test(
+            "Get Menu (If-None-Match)",
+            "GET",
+            "menu",
+            304,
+            extra_headers={'If-None-Match': etag}
+        )
+        return success
+
+    def test_get_menu_sparse_fields(self):
+        """Test that fields= returns only the requested columns plus id"""
+        success, response = self.run_test(
+            "Get Menu (fields)",
+            "GET",
+            "menu?fields=nombre,categoria",
+            200
+        )
+        if not success or not isinstance(response, list):
+            return False
+        extra = {key for item in response for key in item} - {"id", "nombre", "categoria"}
+        if extra:
+            print(f"❌ Unexpected fields: {sorted(extra)}")
+            return False
+        invalid, _ = self.run_test("Get Menu (unknown field)", "GET", "menu?fields=precio_secreto", 400)
+        return invalid
+
+    def test_search_menu(self):
+        """Test accent-insensitive menu search"""
+        success, response = self.run_test(
+            "Search Menu (cafe)",
+            "GET",
+            "menu/search?q=cafe",
+            200
+        )
+        if success and isinstance(response, list):
+            names = [item['nombre'] for item in response]
+            print(f"   Found {names}")
+            return any('Café' in name for name in names)
+        return False
+
     def test_create_menu_item(self):
         """Test creating a new menu item"""
         test_item = {
@@ -151,6 +214,41 @@ class LaCalandriaAPITester:
             return True
         return False
 
+    def test_upload_image(self):
+        """Test uploading an image and fetching its WebP card variant"""
+        def chunk(kind, data):
+            return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+        width, height = 64, 48
+        rows = b"".join(b"\x00" + b"\xc8\x64\x32" * width for _ in range(height))
+        png = (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+               + chunk(b"IDAT", zlib.compress(rows)) + chunk(b"IEND", b""))
+
+        self.tests_run += 1
+        print("\n🔍 Testing Upload Image...")
+        try:
+            response = requests.post(
+                f"{self.api_url}/images",
+                files={"file": ("test.png", png, "image/png")},
+                headers={"Authorization": f"Bearer {self.token}"},
+                timeout=10
+            )
+            if response.status_code != 200:
+                print(f"❌ Failed - Expected 200, got {response.status_code}")
+                return False
+            variant = requests.get(f"{self.base_url}{response.json()['variants']['card']}", timeout=10)
+            if variant.status_code != 200 or variant.headers.get('content-type') != 'image/webp':
+                print(f"❌ Failed - Variant returned {variant.status_code} {variant.headers.get('content-type')}")
+                return False
+            if 'immutable' not in variant.headers.get('cache-control', ''):
+                print(f"❌ Failed - Cache-Control: {variant.headers.get('cache-control')}")
+                return False
+            self.tests_passed += 1
+            print("✅ Passed - Status: 200")
+            return True
+        except Exception as e:
+            print(f"❌ Failed - Error: {str(e)}")
+            return False
+
     def test_update_menu_item(self):
         """Test updating a menu item"""
         if not self.created_items:
@@ -173,6 +271,35 @@ class LaCalandriaAPITester:
         )
         return success
 
+    def test_bulk_menu_write(self):
+        """Test a mixed batch of menu writes"""
+        operations = [
+            {"op": "create", "item": {
+                "nombre": "Test Bulk",
+                "descripcion": "Plato creado en lote",
+                "precio": 1000.0,
+                "categoria": "Brunch",
+                "imagen_url": "https://images.pexels.com/photos/376464/pexels-photo-376464.jpeg"
+            }},
+            {"op": "update", "id": "missing-item", "item": {"precio": 1.0}},
+        ]
+        success, response = self.run_test(
+            "Bulk Menu Write",
+            "POST",
+            "menu/bulk",
+            200,
+            data={"ordered": False, "operations": operations},
+            auth_required=True
+        )
+        if not success:
+            return False
+        statuses = [result['status'] for result in response.get('results', [])]
+        if statuses != ['ok', 'not_found']:
+            print(f"❌ Unexpected statuses: {statuses}")
+            return False
+        self.created_items.append(response['results'][0]['id'])
+        return True
+
     def test_create_reservation(self):
         """Test creating a reservation"""
         tomorrow = (datetime.now() + timedelta(days=1)).strftime('%Y-%m-%d')
@@ -198,6 +325,196 @@ class LaCalandriaAPITester:
             return True
         return False
 
+    def test_create_reservation_off_slot(self):
+        """Test that a hora outside the reservation slots is rejected"""
+        tomorrow = (datetime.now() + timedelta(days=1)).strftime('%Y-%m-%d')
+        success, _ = self.run_test(
+            "Create Reservation Off Slot",
+            "POST",
+            "reservations",
+            400,
+            data={"nombre_cliente": "Fuera de Turno", "telefono": "2657123456", "fecha": tomorrow,
+                  "hora": "20:01", "cantidad_personas": 2}
+        )
+        return success
+
+    def test_create_reservation_idempotent(self):
+        """Test that a retried reservation with the same Idempotency-Key is not inserted twice"""
+        tomorrow = (datetime.now() + timedelta(days=1)).strftime('%Y-%m-%d')
+        reservation_data = {
+            "nombre_cliente": "Reintento Test",
+            "telefono": "2657123456",
+            "fecha": tomorrow,
+            "hora": "21:00",
+            "cantidad_personas": 2
+        }
+        key = {"Idempotency-Key": f"test-{datetime.now().timestamp()}"}
+        first_ok, first = self.run_test(
+            "Create Reservation (Idempotency-Key)", "POST", "reservations", 200,
+            data=reservation_data, extra_headers=key
+        )
+        retry_ok, retry = self.run_test(
+            "Retry Reservation (Idempotency-Key)", "POST", "reservations", 200,
+            data=reservation_data, extra_headers=key
+        )
+        if not (first_ok and retry_ok):
+            return False
+        if first.get('id') != retry.get('id'):
+            print(f"❌ Retry created a second reservation: {first.get('id')} != {retry.get('id')}")
+            return False
+        self.created_items.append(f"reservation_{first['id']}")
+        return True
+
+    def test_bulk_update_reservations(self):
+        """Test applying one estado change to several reservations"""
+        reservation_ids = [item.split('_', 1)[1] for item in self.created_items if item.startswith('reservation_')]
+        if not reservation_ids:
+            print("❌ No reservations to update")
+            return False
+        success, response = self.run_test(
+            "Bulk Update Reservations",
+            "POST",
+            "reservations/estado",
+            200,
+            data={"estado": "confirmada", "ids": reservation_ids + ["missing-id"]},
+            auth_required=True
+        )
+        if success and response.get('not_found') != ["missing-id"]:
+            print(f"❌ Unexpected not_found: {response.get('not_found')}")
+            return False
+        if not success:
+            return False
+        success, _ = self.run_test("Bulk Update With Empty Filter", "POST", "reservations/estado", 400,
+                                   data={"estado": "cancelada", "filter": {}}, auth_required=True)
+        if not success:
+            return False
+        success, _ = self.run_test("Bulk Update With Unknown Estado", "POST", "reservations/estado", 422,
+                                   data={"estado": "borrada", "ids": reservation_ids}, auth_required=True)
+        return success
+
+    def test_bulk_update_scoping(self):
+        """Test that bulk estado changes only touch the reservations they name or filter"""
+        fecha = (datetime.now() + timedelta(days=400 + int(time.time()) % 300)).strftime('%Y-%m-%d')
+        success, slots = self.run_test("Get Availability for Bulk", "GET", f"availability?fecha={fecha}", 200)
+        if not success:
+            return False
+        capacidad = next(s['capacidad'] for s in slots if s['hora'] == '13:00')
+        created = {}
+        for name, hora, personas in (("cancelada", "13:00", 2), ("lleno", "13:00", capacidad),
+                                     ("confirmada", "14:00", 2)):
+            success, response = self.run_test(
+                f"Create Reservation ({name})",
+                "POST",
+                "reservations",
+                200,
+                data={"nombre_cliente": f"Bulk {name}", "telefono": "2657000001", "fecha": fecha,
+                      "hora": hora, "cantidad_personas": personas}
+            )
+            if not success:
+                return False
+            created[name] = response['id']
+            if name != "lleno":
+                success, _ = self.run_test(f"Mark {name}", "PUT", f"reservations/{created[name]}", 200,
+                                           data={"estado": name}, auth_required=True)
+                if not success:
+                    return False
+
+        # The 13:00 slot is full, so the listed id comes back in sin_cupo;
+        # nothing outside the list may change. Run the server with
+        # RESERVATION_BULK_BATCH_SIZE=1 to also cover the multi-batch path.
+        success, response = self.run_test(
+            "Bulk Update Listed Ids Only",
+            "POST",
+            "reservations/estado",
+            200,
+            data={"estado": "pendiente", "ids": [created["cancelada"]]},
+            auth_required=True
+        )
+        if not success or response.get('modified') != 0 or response.get('sin_cupo') != [created["cancelada"]]:
+            print(f"❌ Unexpected result: {response}")
+            return False
+
+        success, response = self.run_test(
+            "Bulk Update by Estado Filter",
+            "POST",
+            "reservations/estado",
+            200,
+            data={"estado": "cancelada",
+                  "filter": {"estado": "pendiente", "fecha_desde": fecha, "fecha_hasta": fecha}},
+            auth_required=True
+        )
+        if not success or response.get('modified') != 1:
+            print(f"❌ Expected only the pending reservation to change: {response}")
+            return False
+        success, response = self.run_test(
+            "Confirmed Reservation Untouched",
+            "GET",
+            f"reservations?estado=confirmada&fecha_desde={fecha}&fecha_hasta={fecha}",
+            200,
+            auth_required=True
+        )
+        if success and [r['id'] for r in response] != [created["confirmada"]]:
+            print(f"❌ Confirmed reservation changed: {response}")
+            return False
+        return success
+
+    def test_table_assignment(self):
+        """Test that confirming a reservation seats it at a table"""
+        success, previous = self.run_test("Get Table Layout", "GET", "tables", 200, auth_required=True)
+        if not success:
+            return False
+        layout = {"mesas": [{"id": "T1", "capacidad": 2}, {"id": "T2", "capacidad": 4}], "combinaciones": []}
+        success, _ = self.run_test("Save Table Layout", "PUT", "tables", 200, data=layout, auth_required=True)
+        if not success:
+            return False
+        try:
+            fecha = (datetime.now() + timedelta(days=3)).strftime('%Y-%m-%d')
+            success, response = self.run_test(
+                "Create Reservation for Table",
+                "POST",
+                "reservations",
+                200,
+                data={"nombre_cliente": "Test Mesa", "telefono": "2657000000", "fecha": fecha,
+                      "hora": "12:00", "cantidad_personas": 3}
+            )
+            if not success:
+                return False
+            success, response = self.run_test(
+                "Confirm Reservation at Table",
+                "PUT",
+                f"reservations/{response['id']}",
+                200,
+                data={"estado": "confirmada"},
+                auth_required=True
+            )
+            if success and response.get('mesas') != ["T2"]:
+                print(f"❌ Expected table T2, got {response.get('mesas')}")
+                return False
+            success, plan = self.run_test(
+                "Get Table Plan", "GET", f"tables/plan?fecha={fecha}", 200, auth_required=True
+            )
+            return success and any(entry['mesas'] == ["T2"] for entry in plan.get('asignaciones', []))
+        finally:
+            restore = {"mesas": previous.get("mesas", []), "combinaciones": previous.get("combinaciones", [])}
+            self.run_test("Restore Table Layout", "PUT", "tables", 200, data=restore, auth_required=True)
+
+    def test_get_availability(self):
+        """Test slot availability for tomorrow"""
+        tomorrow = (datetime.now() + timedelta(days=1)).strftime('%Y-%m-%d')
+        success, response = self.run_test(
+            "Get Availability",
+            "GET",
+            f"availability?fecha={tomorrow}",
+            200
+        )
+        if success and isinstance(response, list):
+            slot = next((s for s in response if s['hora'] == '20:00'), None)
+            if slot and slot['ocupados'] < 4:
+                print("❌ 20:00 slot does not count the reservation created above")
+                return False
+            return True
+        return False
+
     def test_get_reservations(self):
         """Test getting all reservations (admin only)"""
         success, response = self.run_test(
@@ -213,6 +530,65 @@ class LaCalandriaAPITester:
             return True
         return False
 
+    def test_get_reservations_paginated(self):
+        """Test keyset pagination and filters on reservations"""
+        success, response = self.run_test(
+            "Get Reservations (limit=1, estado=pendiente)",
+            "GET",
+            "reservations?limit=1&estado=pendiente",
+            200,
+            auth_required=True
+        )
+        if not success or not isinstance(response, list) or len(response) > 1:
+            return False
+        if any(res.get('estado') != 'pendiente' for res in response):
+            print("❌ Filter returned reservations with a different estado")
+            return False
+
+        success, _ = self.run_test(
+            "Get Reservations (invalid cursor)",
+            "GET",
+            "reservations?cursor=not-a-cursor",
+            400,
+            auth_required=True
+        )
+        return success
+
+    def test_export_reservations(self):
+        """Test streaming CSV export of reservations"""
+        response = requests.get(
+            f"{self.api_url}/reservations/export",
+            params={'format': 'csv', 'estado': 'pendiente'},
+            headers={'Authorization': f'Bearer {self.token}'},
+            stream=True,
+            timeout=30
+        )
+        self.tests_run += 1
+        lines = list(response.iter_lines(decode_unicode=True))
+        if response.status_code != 200 or not lines or not lines[0].startswith('id,'):
+            print(f"❌ Failed - Status: {response.status_code}")
+            return False
+        self.tests_passed += 1
+        print(f"✅ Passed - Exported {len(lines) - 1} rows")
+        return True
+
+    def test_reservation_stats(self):
+        """Test daily reservation rollups"""
+        tomorrow = (datetime.now() + timedelta(days=1)).strftime('%Y-%m-%d')
+        success, response = self.run_test(
+            "Reservation Stats",
+            "GET",
+            f"reservations/stats?from={tomorrow}&to={tomorrow}",
+            200,
+            auth_required=True
+        )
+        if success and isinstance(response, list):
+            if not response or response[0]['reservas'] < 1:
+                print("❌ Stats do not count the reservation created above")
+                return False
+            return True
+        return False
+
     def test_update_reservation_status(self):
         """Test updating reservation status"""
         # First create a reservation to update
@@ -276,6 +652,68 @@ class LaCalandriaAPITester:
         )
         return success
 
+    def test_reservation_archive(self):
+        """Test listing archive months and reading an archived month"""
+        success, response = self.run_test(
+            "List Reservation Archives",
+            "GET",
+            "reservations/archive",
+            200,
+            auth_required=True
+        )
+        if not success or not isinstance(response.get('months'), list):
+            return False
+        if not response['months']:
+            return True
+        success, _ = self.run_test(
+            "Get Archived Reservations",
+            "GET",
+            f"reservations?archive={response['months'][-1]}",
+            200,
+            auth_required=True
+        )
+        return success
+
+    def test_index_report(self):
+        """Test that no handler query shape falls back to a collection scan"""
+        success, response = self.run_test(
+            "Index Report",
+            "GET",
+            "admin/indexes",
+            200,
+            auth_required=True
+        )
+        if success and response.get('collscans'):
+            print(f"❌ Collection scans: {response['collscans']}")
+            return False
+        return success
+
+    def test_profiles(self):
+        """Test listing request profiles and rejecting unknown ones"""
+        success, response = self.run_test(
+            "List Profiles",
+            "GET",
+            "admin/profiles",
+            200,
+            auth_required=True
+        )
+        if not success or 'profiles' not in response:
+            return False
+        missing, _ = self.run_test(
+            "Get Missing Profile",
+            "GET",
+            "admin/profiles/0-00000000",
+            404,
+            auth_required=True
+        )
+        return missing
+
+    def test_health(self):
+        """Test liveness and readiness probes"""
+        live, _ = self.run_test("Health Live", "GET", "health/live", 200)
+        ready, _ = self.run_test("Health Ready", "GET", "health/ready", 200)
+        return live and ready
+
     def test_unauthorized_access(self):
         """Test accessing protected endpoints without auth"""
         endpoints = [
@@ -310,13 +748,32 @@ def main():
         ("Admin Login Invalid", tester.test_admin_login_invalid),
         ("Seed Database", tester.test_seed_database),
         ("Get All Menu", tester.test_get_menu_all),
+        ("Unknown Sucursal", tester.test_unknown_sucursal),
         ("Get Menu by Category", tester.test_get_menu_by_category),
+        ("Get Menu Not Modified", tester.test_get_menu_not_modified),
+        ("Get Menu Sparse Fields", tester.test_get_menu_sparse_fields),
+        ("Search Menu", tester.test_search_menu),
         ("Create Menu Item", tester.test_create_menu_item),
+        ("Upload Image", tester.test_upload_image),
         ("Update Menu Item", tester.test_update_menu_item),
+        ("Bulk Menu Write", tester.test_bulk_menu_write),
         ("Create Reservation", tester.test_create_reservation),
+        ("Create Reservation Off Slot", tester.test_create_reservation_off_slot),
+        ("Create Reservation Idempotent", tester.test_create_reservation_idempotent),
+        ("Get Availability", tester.test_get_availability),
         ("Get Reservations", tester.test_get_reservations),
+        ("Get Reservations Paginated", tester.test_get_reservations_paginated),
+        ("Export Reservations", tester.test_export_reservations),
+        ("Reservation Stats", tester.test_reservation_stats),
         ("Update Reservation Status", tester.test_update_reservation_status),
+        ("Bulk Update Reservations", tester.test_bulk_update_reservations),
+        ("Bulk Update Scoping", tester.test_bulk_update_scoping),
+        ("Table Assignment", tester.test_table_assignment),
         ("Delete Menu Item", tester.test_delete_menu_item),
+        ("Reservation Archive", tester.test_reservation_archive),
+        ("Index Report", tester.test_index_report),
+        ("Profiles", tester.test_profiles),
+        ("Health", tester.test_health),
         ("Unauthorized Access", tester.test_unauthorized_access)
     ]
     
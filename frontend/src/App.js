@@ -15,13 +15,15 @@ function App() {
     }
   }, []);
 
-  const handleAdminLogin = (token) => {
+  const handleAdminLogin = (token, sucursal) => {
     localStorage.setItem('admin_token', token);
+    localStorage.setItem('admin_sucursal', sucursal);
     setIsAdminAuthenticated(true);
   };
 
   const handleAdminLogout = () => {
     localStorage.removeItem('admin_token');
+    localStorage.removeItem('admin_sucursal');
     setIsAdminAuthenticated(false);
   };
 
@@ -1,6 +1,7 @@
 import React from 'react';
 import { motion } from 'framer-motion';
 import { Star, Check } from 'lucide-react';
+import { menuImageProps } from '../lib/images';
 
 const MenuCard = ({ item, index }) => {
   return (
@@ -13,7 +14,8 @@ const MenuCard = ({ item, index }) => {
     >
       <div className="relative overflow-hidden h-80">
         <img
-          src={item.imagen_url}
+          {...menuImageProps(item)}
+          sizes="(min-width: 1024px) 33vw, (min-width: 768px) 50vw, 100vw"
           alt={item.nombre}
           className="w-full h-full object-cover transition-transform duration-700 group-hover:scale-110"
           loading="lazy"
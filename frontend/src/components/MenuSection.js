@@ -5,6 +5,9 @@ import MenuCard from './MenuCard';
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
+const SUCURSAL = process.env.REACT_APP_SUCURSAL;
+// Only the columns MenuCard renders.
+const CARD_FIELDS = 'id,nombre,descripcion,categoria,imagen,imagen_url,destacado,sin_tacc';
 
 const MenuSection = () => {
   const [menuItems, setMenuItems] = useState([]);
@@ -21,7 +24,11 @@ const MenuSection = () => {
     setLoading(true);
     try {
       const response = await axios.get(`${API}/menu`, {
-        params: selectedCategory !== 'Todos' ? { categoria: selectedCategory } : {}
+        params: {
+          sucursal: SUCURSAL,
+          fields: CARD_FIELDS,
+          ...(selectedCategory !== 'Todos' ? { categoria: selectedCategory } : {})
+        }
       });
       setMenuItems(response.data);
     } catch (error) {
@@ -2,6 +2,7 @@ import React, { useState, useEffect } from 'react';
 import axios from 'axios';
 import { toast } from 'sonner';
 import { Plus, Edit, Trash2, X } from 'lucide-react';
+import { menuImageProps } from '../../lib/images';
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
@@ -16,9 +17,11 @@ const MenuManagement = () => {
     descripcion: '',
     categoria: 'Brunch',
     imagen_url: '',
+    imagen: null,
     destacado: false,
     sin_tacc: false
   });
+  const [uploading, setUploading] = useState(false);
 
   useEffect(() => {
     fetchMenuItems();
@@ -27,8 +30,9 @@ const MenuManagement = () => {
   const fetchMenuItems = async () => {
     setLoading(true);
     try {
-      const token = localStorage.getItem('admin_token');
-      const response = await axios.get(`${API}/menu`);
+      const response = await axios.get(`${API}/menu`, {
+        params: { sucursal: localStorage.getItem('admin_sucursal') }
+      });
       setMenuItems(response.data);
     } catch (error) {
       toast.error('Error al cargar el menú');
@@ -88,7 +92,8 @@ const MenuManagement = () => {
         nombre: item.nombre,
         descripcion: item.descripcion,
         categoria: item.categoria,
-        imagen_url: item.imagen_url,
+        imagen_url: item.imagen_url || '',
+        imagen: item.imagen || null,
         destacado: item.destacado,
         sin_tacc: item.sin_tacc
       });
@@ -99,6 +104,7 @@ const MenuManagement = () => {
         descripcion: '',
         categoria: 'Brunch',
         imagen_url: '',
+        imagen: null,
         destacado: false,
         sin_tacc: false
       });
@@ -119,6 +125,26 @@ const MenuManagement = () => {
     });
   };
 
+  const handleImageUpload = async (e) => {
+    const file = e.target.files[0];
+    if (!file) return;
+    const token = localStorage.getItem('admin_token');
+    const body = new FormData();
+    body.append('file', file);
+    setUploading(true);
+    try {
+      const response = await axios.post(`${API}/images`, body, {
+        headers: { Authorization: `Bearer ${token}` }
+      });
+      setFormData((current) => ({ ...current, imagen: response.data.hash }));
+      toast.success('Imagen subida');
+    } catch (error) {
+      toast.error('Error al subir la imagen');
+    } finally {
+      setUploading(false);
+    }
+  };
+
   if (loading) {
     return (
       <div className="text-center py-12" data-testid="menu-management-loading">
@@ -147,7 +173,7 @@ const MenuManagement = () => {
         {menuItems.map((item) => (
           <div key={item.id} className="menu-card" data-testid={`menu-row-${item.id}`}>
             <div className="relative h-48">
-              <img src={item.imagen_url} alt={item.nombre} className="w-full h-full object-cover" />
+              <img {...menuImageProps(item, 'thumb')} sizes="400px" alt={item.nombre} className="w-full h-full object-cover" />
               {item.destacado && (
                 <div className="absolute top-2 left-2 bg-[#C1666B] text-white px-2 py-1 rounded-full text-xs font-semibold">
                   Recomendado
@@ -254,8 +280,28 @@ const MenuManagement = () => {
                   value={formData.imagen_url}
                   onChange={handleChange}
                   className="w-full px-4 py-2 border border-gray-300 rounded-lg focus:outline-none focus:ring-2 focus:ring-[#4A5D23]"
-                  required
+                  required={!formData.imagen}
+                />
+              </div>
+
+              <div className="mb-4">
+                <label className="block text-gray-700 font-semibold mb-2">Subir Imagen</label>
+                <input
+                  type="file"
+                  accept="image/*"
+                  data-testid="menu-form-imagen-file"
+                  onChange={handleImageUpload}
+                  disabled={uploading}
+                  className="w-full"
                 />
+                {formData.imagen && (
+                  <img
+                    {...menuImageProps(formData, 'thumb')}
+                    sizes="96px"
+                    alt="Vista previa"
+                    className="mt-2 h-24 rounded-lg object-cover"
+                  />
+                )}
               </div>
 
               <div className="flex gap-6 mb-6">
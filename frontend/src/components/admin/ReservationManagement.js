@@ -3,66 +3,140 @@ import axios from 'axios';
 import { toast } from 'sonner';
 import { format } from 'date-fns';
 import { es } from 'date-fns/locale';
-import { CheckCircle, XCircle, Clock } from 'lucide-react';
+import { CheckCircle, XCircle, Clock, TimerOff } from 'lucide-react';
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
+const PAGE_SIZE = 50;
+const EVENTS_RETRY_MS = 5000;
 
 const ReservationManagement = () => {
   const [reservations, setReservations] = useState([]);
   const [loading, setLoading] = useState(true);
+  const [loadingMore, setLoadingMore] = useState(false);
+  const [nextCursor, setNextCursor] = useState(null);
   const [filter, setFilter] = useState('todas');
 
   useEffect(() => {
     fetchReservations();
-  }, []);
+  }, [filter]);
 
-  const fetchReservations = async () => {
-    setLoading(true);
+  const matchesFilter = (reservation) => filter === 'todas' || reservation.estado === filter;
+
+  const applyUpdate = (reservation) => {
+    setReservations((prev) =>
+      matchesFilter(reservation)
+        ? prev.map((res) => (res.id === reservation.id ? reservation : res))
+        : prev.filter((res) => res.id !== reservation.id)
+    );
+  };
+
+  useEffect(() => {
+    // EventSource cannot send the Authorization header, so each connection
+    // opens with a short-lived ticket. A ticket is only good for a minute,
+    // so instead of letting EventSource retry with it, every reconnect
+    // asks for a new one.
+    let source = null;
+    let retry = null;
+    let closed = false;
+
+    const connect = async () => {
+      try {
+        const token = localStorage.getItem('admin_token');
+        const response = await axios.post(
+          `${API}/reservations/events/ticket`,
+          null,
+          { headers: { Authorization: `Bearer ${token}` } }
+        );
+        if (closed) return;
+        source = new EventSource(
+          `${API}/reservations/events?ticket=${encodeURIComponent(response.data.ticket)}`
+        );
+      } catch (error) {
+        if (!closed) retry = setTimeout(connect, EVENTS_RETRY_MS);
+        return;
+      }
+
+      source.addEventListener('created', (e) => {
+        const { reservation } = JSON.parse(e.data);
+        if (!matchesFilter(reservation)) return;
+        setReservations((prev) =>
+          prev.some((res) => res.id === reservation.id) ? prev : [reservation, ...prev]
+        );
+      });
+      source.addEventListener('updated', (e) => applyUpdate(JSON.parse(e.data).reservation));
+      source.addEventListener('resync', () => fetchReservations());
+      source.onerror = () => {
+        source.close();
+        if (!closed) retry = setTimeout(connect, EVENTS_RETRY_MS);
+      };
+    };
+
+    connect();
+    return () => {
+      closed = true;
+      clearTimeout(retry);
+      if (source) source.close();
+    };
+  }, [filter]);
+
+  const fetchReservations = async (cursor = null) => {
+    if (cursor) {
+      setLoadingMore(true);
+    } else {
+      setLoading(true);
+    }
     try {
       const token = localStorage.getItem('admin_token');
+      const params = { limit: PAGE_SIZE };
+      if (filter !== 'todas') params.estado = filter;
+      if (cursor) params.cursor = cursor;
       const response = await axios.get(`${API}/reservations`, {
-        headers: { Authorization: `Bearer ${token}` }
+        headers: { Authorization: `Bearer ${token}` },
+        params
       });
-      setReservations(response.data.sort((a, b) => new Date(b.created_at) - new Date(a.created_at)));
+      setReservations((prev) => (cursor ? [...prev, ...response.data] : response.data));
+      setNextCursor(response.headers['x-next-cursor'] || null);
     } catch (error) {
       toast.error('Error al cargar las reservas');
     } finally {
       setLoading(false);
+      setLoadingMore(false);
     }
   };
 
   const updateStatus = async (id, status) => {
     const token = localStorage.getItem('admin_token');
     try {
-      await axios.put(
+      const response = await axios.put(
         `${API}/reservations/${id}`,
         { estado: status },
         { headers: { Authorization: `Bearer ${token}` } }
       );
+      applyUpdate(response.data);
       toast.success('Estado actualizado exitosamente');
-      fetchReservations();
     } catch (error) {
-      toast.error('Error al actualizar el estado');
+      if (error.response?.status === 409) {
+        toast.error('No hay lugar ni mesa disponible para esa reserva');
+      } else {
+        toast.error('Error al actualizar el estado');
+      }
     }
   };
 
-  const getFilteredReservations = () => {
-    if (filter === 'todas') return reservations;
-    return reservations.filter((res) => res.estado === filter);
-  };
-
   const getStatusBadge = (status) => {
     const styles = {
       pendiente: 'bg-yellow-100 text-yellow-800',
       confirmada: 'bg-green-100 text-green-800',
-      cancelada: 'bg-red-100 text-red-800'
+      cancelada: 'bg-red-100 text-red-800',
+      expirada: 'bg-gray-100 text-gray-700'
     };
 
     const icons = {
       pendiente: <Clock size={16} />,
       confirmada: <CheckCircle size={16} />,
-      cancelada: <XCircle size={16} />
+      cancelada: <XCircle size={16} />,
+      expirada: <TimerOff size={16} />
     };
 
     return (
@@ -144,12 +218,13 @@ const ReservationManagement = () => {
               <th>Fecha</th>
               <th>Hora</th>
               <th>Personas</th>
+              <th>Mesa</th>
               <th>Estado</th>
               <th>Acciones</th>
             </tr>
           </thead>
           <tbody>
-            {getFilteredReservations().map((reservation) => (
+            {reservations.map((reservation) => (
               <tr key={reservation.id} data-testid={`reservation-row-${reservation.id}`}>
                 <td className="font-semibold" data-testid={`reservation-name-${reservation.id}`}>
                   {reservation.nombre_cliente}
@@ -158,6 +233,9 @@ const ReservationManagement = () => {
                 <td data-testid={`reservation-date-${reservation.id}`}>{reservation.fecha}</td>
                 <td data-testid={`reservation-time-${reservation.id}`}>{reservation.hora}</td>
                 <td data-testid={`reservation-guests-${reservation.id}`}>{reservation.cantidad_personas}</td>
+                <td data-testid={`reservation-tables-${reservation.id}`}>
+                  {reservation.mesas?.length ? reservation.mesas.join(' + ') : '—'}
+                </td>
                 <td>{getStatusBadge(reservation.estado)}</td>
                 <td>
                   <div className="flex gap-2">
@@ -186,11 +264,24 @@ const ReservationManagement = () => {
           </tbody>
         </table>
 
-        {getFilteredReservations().length === 0 && (
+        {reservations.length === 0 && (
           <div className="text-center py-12" data-testid="no-reservations">
             <p className="text-xl text-[#5D6D7E]">No hay reservas {filter !== 'todas' ? filter + 's' : ''}</p>
           </div>
         )}
+
+        {nextCursor && (
+          <div className="text-center mt-6">
+            <button
+              onClick={() => fetchReservations(nextCursor)}
+              disabled={loadingMore}
+              data-testid="load-more-reservations"
+              className="px-6 py-2 bg-gray-200 text-gray-700 rounded-lg font-medium hover:bg-gray-300 transition-all disabled:opacity-50"
+            >
+              {loadingMore ? 'Cargando...' : 'Cargar más'}
+            </button>
+          </div>
+        )}
       </div>
     </div>
   );
@@ -0,0 +1,18 @@
+const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
+const API = `${BACKEND_URL}/api`;
+
+// Widths of the WebP variants the backend renders for stored images.
+const VARIANT_WIDTHS = { thumb: 240, card: 800 };
+
+export function menuImageProps(item, size = 'card') {
+  if (!item.imagen) {
+    return { src: item.imagen_url };
+  }
+  const url = (variant) => `${API}/images/${item.imagen}/${variant}`;
+  return {
+    src: url(size),
+    srcSet: Object.entries(VARIANT_WIDTHS)
+      .map(([variant, width]) => `${url(variant)} ${width}w`)
+      .join(', '),
+  };
+}
@@ -23,7 +23,7 @@ const AdminLogin = ({ onLogin }) => {
       });
 
       if (response.data.token) {
-        onLogin(response.data.token);
+        onLogin(response.data.token, response.data.sucursal);
         toast.success('Inicio de sesión exitoso');
         navigate('/admin/dashboard');
       }
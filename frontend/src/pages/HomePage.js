@@ -13,12 +13,13 @@ import axios from 'axios';
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
+const SUCURSAL = process.env.REACT_APP_SUCURSAL;
 
 const HomePage = () => {
   useEffect(() => {
     const seedDatabase = async () => {
       try {
-        await axios.post(`${API}/seed`);
+        await axios.post(`${API}/seed`, null, { params: { sucursal: SUCURSAL } });
         console.log('Database seeded');
       } catch (error) {
         console.log('Seed error (may already be seeded):', error.message);
@@ -0,0 +1,143 @@
+"""Benchmark for the table-assignment engine in backend/table_assignment.py.
+
+Builds a Saturday for one branch: a floor of 2-, 4-, 6- and 8-tops plus the
+combinations staff push together for large parties, and several hundred
+bookings spread over lunch and dinner with the evening peak a Saturday
+has. It then times
+
+  - packing the whole day from scratch, as the server does for a day's
+    first plan, after a layout change or on POST /api/tables/plan/rebuild;
+  - one confirmation per booking, the way update_table_plan applies it:
+    the stored plan (every other seated party, with hora strings as in
+    Mongo) is restored into a DayPlan and the party placed; a party no
+    table can take also pays for the full repack the server tries next.
+
+and reports p50/p95 for each, plus how many parties were seated. The
+engine is timed directly, without MongoDB; on the server each change adds
+one plan read and one conditional write. Exits non-zero when the p95 of a
+full pack exceeds --budget-ms.
+
+    python table_bench.py
+    python table_bench.py --bookings 600 --runs 50 --budget-ms 100
+"""
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+from typing import List, Tuple
+
+sys.path.insert(0, str(Path(__file__).parent / "backend"))
+
+from table_assignment import TableLayout, minutes, pack, restore  # noqa: E402
+
+# (capacity, how many) for a ~60-table, ~240-seat floor.
+FLOOR = [(2, 20), (4, 24), (6, 10), (8, 6)]
+LUNCH = [f"{h:02d}:{m:02d}" for h in range(12, 16) for m in (0, 30)]
+DINNER = [f"{h:02d}:{m:02d}" for h in range(19, 24) for m in (0, 30)]
+PEAK = {"21:00", "21:30", "22:00"}
+
+def saturday_layout() -> TableLayout:
+    mesas, number = [], 1
+    for capacity, count in FLOOR:
+        for _ in range(count):
+            mesas.append({"id": str(number), "capacidad": capacity})
+            number += 1
+    by_capacity = {}
+    for mesa in mesas:
+        by_capacity.setdefault(mesa["capacidad"], []).append(mesa["id"])
+    combinaciones = []
+    # Neighbouring 4-tops push together into 8s, 6-tops into 12s, and
+    # two 8-tops make the long table for 16.
+    for size in (4, 6):
+        tables = by_capacity[size]
+        combinaciones += [{"mesas": tables[i:i + 2]} for i in range(0, len(tables) - 1, 2)]
+    combinaciones.append({"mesas": by_capacity[8][:2], "capacidad": 14})
+    return TableLayout(mesas, combinaciones, version=1)
+
+def saturday_bookings(count: int, rng: random.Random) -> List[Tuple[str, int, int]]:
+    horas = LUNCH + DINNER
+    weights = [3 if hora in PEAK else 2 if hora in DINNER else 1 for hora in horas]
+    sizes, size_weights = [1, 2, 3, 4, 5, 6, 8, 10, 12], [2, 40, 12, 25, 6, 8, 4, 2, 1]
+    bookings = []
+    for i in range(count):
+        hora = rng.choices(horas, weights)[0]
+        start = int(hora[:2]) * 60 + int(hora[3:])
+        bookings.append((f"r{i}", start, rng.choices(sizes, size_weights)[0]))
+    return bookings
+
+def stored_entries(plan) -> List[dict]:
+    """The plan as update_table_plan keeps it in table_plans."""
+    return [
+        {"id": res_id, "hora": f"{start // 60:02d}:{start % 60:02d}", "cantidad_personas": covers,
+         "mesas": list(tables)}
+        for res_id, (start, covers, tables) in plan.assignments.items()
+    ]
+
+def confirm(layout: TableLayout, entries: List[dict], booking: Tuple[str, int, int], duration: int) -> bool:
+    """update_table_plan's engine work for one confirmation; True if the party was seated."""
+    plan = restore(layout, (
+        (entry["id"], minutes(entry["hora"]), entry["cantidad_personas"], entry["mesas"])
+        for entry in entries if entry["mesas"]
+    ), duration)
+    if plan.place(*booking) is not None:
+        return True
+    everyone = [(entry["id"], minutes(entry["hora"]), entry["cantidad_personas"]) for entry in entries]
+    _, unseated = pack(layout, everyone + [booking], duration)
+    return booking[0] not in unseated
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    index = max(min(round(pct / 100 * len(sorted_values)) - 1, len(sorted_values) - 1), 0)
+    return sorted_values[index]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--bookings", type=int, default=350, help="Bookings on the Saturday")
+    parser.add_argument("--runs", type=int, default=20, help="Full packs to time")
+    parser.add_argument("--duration", type=int, default=90, help="Minutes a party holds its table")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--budget-ms", type=float, default=50.0, help="Fail if a full pack's p95 exceeds this")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    layout = saturday_layout()
+    bookings = saturday_bookings(args.bookings, rng)
+
+    full = []
+    for _ in range(args.runs):
+        started = time.perf_counter()
+        plan, unseated = pack(layout, bookings, args.duration)
+        full.append((time.perf_counter() - started) * 1000)
+    full.sort()
+
+    entries = stored_entries(plan)
+    seated, turned_away = [], []
+    for booking in bookings:
+        others = [entry for entry in entries if entry["id"] != booking[0]]
+        started = time.perf_counter()
+        placed = confirm(layout, others, booking, args.duration)
+        elapsed = (time.perf_counter() - started) * 1000
+        if booking[0] in plan.assignments:
+            assert placed, f"{booking[0]} lost its table after being freed"
+            seated.append(elapsed)
+        else:
+            turned_away.append(elapsed)
+    seated.sort()
+    turned_away.sort()
+
+    print(f"layout: {len(layout.capacities)} tables, {sum(layout.capacities.values())} seats, "
+          f"{len(layout.resources) - len(layout.capacities)} combinations")
+    print(f"bookings: {len(bookings)} ({sum(covers for _, _, covers in bookings)} covers), "
+          f"seated {len(bookings) - len(unseated)}, unseated {len(unseated)}")
+    print(f"full pack    p50 {percentile(full, 50):8.3f} ms   p95 {percentile(full, 95):8.3f} ms   ({args.runs} runs)")
+    for label, timings in (("confirm", seated), ("no table", turned_away)):
+        if timings:
+            print(f"{label:<12} p50 {percentile(timings, 50):8.3f} ms   p95 {percentile(timings, 95):8.3f} ms   "
+                  f"({len(timings)} changes)")
+    if percentile(full, 95) > args.budget_ms:
+        print(f"\n❌ Full pack p95 above the {args.budget_ms:g} ms budget")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())